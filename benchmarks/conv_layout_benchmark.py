@@ -0,0 +1,81 @@
+import timeit
+
+import numpy as np
+
+# Shape of the conv2 layer on CIFAR10: 16 filters, 28x28 output activations
+OUT_CHANNELS = 16
+OUT_H = 28
+OUT_W = 28
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+N_REPEATS = 5
+
+
+def split_output_layout(conv_matrix, n_images):
+    """
+    Layout conversion previously used by fast_convolve_2d (one array per image)
+    """
+    conv_result = np.array(np.hsplit(conv_matrix, n_images))
+    return conv_result.reshape((n_images, OUT_CHANNELS, OUT_H, OUT_W))
+
+
+def reshape_output_layout(conv_matrix, n_images):
+    """
+    Layout conversion currently used by fast_convolve_2d (a single view)
+    """
+    return conv_matrix.reshape((OUT_CHANNELS, n_images, OUT_H, OUT_W)).transpose(1, 0, 2, 3)
+
+
+def split_gradient_layout(gradient_values):
+    """
+    Layout conversion previously used by fast_convolution_backprop
+    """
+    n_images = gradient_values.shape[0]
+    dout = gradient_values.reshape(gradient_values.shape[0] * gradient_values.shape[1],
+                                   gradient_values.shape[2] * gradient_values.shape[3])
+    dout = np.array(np.vsplit(dout, n_images))
+    return np.concatenate(dout, axis=-1)
+
+
+def reshape_gradient_layout(gradient_values):
+    """
+    Layout conversion currently used by fast_convolution_backprop
+    """
+    return gradient_values.transpose(1, 0, 2, 3).reshape(gradient_values.shape[1], -1)
+
+
+def best_time(function, *args):
+    """
+    Best wall time (in seconds) over N_REPEATS runs of function(*args)
+    """
+    return min(timeit.repeat(lambda: function(*args), number=1, repeat=N_REPEATS))
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print('Per-batch cost of the conv layout conversions (ms)')
+    print('{:>6} | {:>12} {:>12} | {:>12} {:>12}'.format(
+        'batch', 'fwd split', 'fwd reshape', 'bwd split', 'bwd reshape'))
+
+    for n_images in BATCH_SIZES:
+        conv_matrix = rng.standard_normal((OUT_CHANNELS, n_images * OUT_H * OUT_W))
+        gradient_values = rng.standard_normal((n_images, OUT_CHANNELS, OUT_H, OUT_W))
+
+        # Sanity check: both versions must produce the same layout
+        assert np.array_equal(split_output_layout(conv_matrix, n_images),
+                              reshape_output_layout(conv_matrix, n_images))
+        assert np.array_equal(split_gradient_layout(gradient_values),
+                              reshape_gradient_layout(gradient_values))
+
+        times = [
+            best_time(split_output_layout, conv_matrix, n_images),
+            best_time(reshape_output_layout, conv_matrix, n_images),
+            best_time(split_gradient_layout, gradient_values),
+            best_time(reshape_gradient_layout, gradient_values),
+        ]
+        print('{:>6} | {:>12.3f} {:>12.3f} | {:>12.3f} {:>12.3f}'.format(n_images, *[t * 1000 for t in times]))
+
+
+if __name__ == '__main__':
+    main()
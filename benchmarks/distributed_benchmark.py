@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+import config
+from benchmarks.training_benchmark import SEED, load_data
+
+WORLD_SIZES = [1, 2, 4]
+EPOCHS = 2
+TRAIN_SAMPLES = 2048
+VALID_SAMPLES = 256
+
+
+def run_rank(args):
+    """
+    Train one rank (RANK and WORLD_SIZE come from the environment, see config.py)
+
+    Returns
+    -------
+    result : dict
+        The rank and the metrics of each epoch
+    """
+    with tempfile.TemporaryDirectory() as weights_dir:
+        # Rank 0 saves its weights, but outside of the repository (set before the model is imported)
+        config.VALIDATION_WEIGHTS_PATH = os.path.join(weights_dir, 'validation')
+        import model
+
+        # Every rank loads the same data, and trains on its own shard
+        train_images, train_labels, valid_images, valid_labels, _, _ = \
+            load_data('synthetic', args.train_samples, args.valid_samples, 0)
+
+        np.random.seed(SEED)
+        history = model.train_model(train_images, train_labels, valid_images, valid_labels, args.epochs)
+
+    return {'rank': config.DISTRIBUTED_RANK, 'history': history}
+
+
+def launch(world_size, args):
+    """
+    Launch world_size ranks on localhost and wait for them
+
+    Returns
+    -------
+    results : list
+        The result of each rank (see run_rank)
+    """
+    with tempfile.TemporaryDirectory() as run_dir:
+        processes = []
+        for rank in range(world_size):
+            environment = dict(os.environ, RANK=str(rank), WORLD_SIZE=str(world_size), RING_HOSTS='',
+                               RING_BASE_PORT=str(args.base_port), MPLBACKEND='Agg')
+            command = [sys.executable, '-m', 'benchmarks.distributed_benchmark', '--rank-result',
+                       os.path.join(run_dir, f'rank{rank}.json'), f'--epochs={args.epochs}',
+                       f'--train-samples={args.train_samples}', f'--valid-samples={args.valid_samples}']
+            processes.append(subprocess.Popen(command, env=environment, stdout=subprocess.PIPE,
+                                              stderr=subprocess.STDOUT, text=True))
+
+        outputs = [process.communicate()[0] for process in processes]
+        for rank, (process, output) in enumerate(zip(processes, outputs)):
+            if process.returncode != 0:
+                print(output)
+                raise SystemExit(f'Rank {rank} of {world_size} failed')
+
+        results = []
+        for rank in range(world_size):
+            with open(os.path.join(run_dir, f'rank{rank}.json')) as file:
+                results.append(json.load(file))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed data parallel training with ring all-reduce, '
+                                                 'with all the ranks on localhost')
+    parser.add_argument('--world-sizes', nargs='+', type=int, default=WORLD_SIZES)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--train-samples', type=int, default=TRAIN_SAMPLES)
+    parser.add_argument('--valid-samples', type=int, default=VALID_SAMPLES)
+    parser.add_argument('--base-port', type=int, default=config.DISTRIBUTED_BASE_PORT,
+                        help='port of rank 0, the other ranks use the following ones')
+    # Internal: run a single rank and write its result in a file
+    parser.add_argument('--rank-result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.rank_result:
+        result = run_rank(args)
+        with open(args.rank_result, 'w') as file:
+            json.dump(result, file)
+        return
+
+    print(f'Distributed training on localhost ({args.train_samples} samples, batch {config.BATCH_SIZE} per rank, '
+          f'{config.DTYPE}, {os.cpu_count()} cores)')
+    print('{:>6} | {:>10} | {:>11} | {:>11} | {:>15} | {:>13} | {:>11}'.format(
+        'ranks', 'images/s', 'compute s', 'comm s', 'exposed comm s', 'MB sent/rank', 'valid acc'))
+
+    for world_size in args.world_sizes:
+        results = launch(world_size, args)
+
+        # Last epoch of each rank: the metrics are already summed over the ranks,
+        # the times are the slowest rank
+        last_epochs = [result['history'][-1] for result in results]
+        train_time = max(epoch['train_time'] for epoch in last_epochs)
+        communication = [epoch['communication'] or {} for epoch in last_epochs]
+
+        def slowest(name):
+            return max(stats.get(name, 0.) for stats in communication)
+
+        print('{:>6} | {:>10.1f} | {:>11.3f} | {:>11.3f} | {:>15.3f} | {:>13.2f} | {:>11.3f}'.format(
+            world_size, last_epochs[0]['train_samples'] / train_time, slowest('compute_time'),
+            slowest('communication_time'), slowest('exposed_communication_time'),
+            slowest('bytes_sent') / 2 ** 20, last_epochs[0]['valid_accuracy']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import timeit
+
+import numpy as np
+
+import convolution
+from convolution import fast_convolve_2d, fast_convolution_backprop
+from fft_convolution import fft_convolve_2d, fft_convolution_backprop
+
+N_REPEATS = 3
+
+BATCH_SIZE = 16
+IN_CHANNELS = 8
+OUT_CHANNELS = 16
+
+KERNEL_SIZES = [3, 5, 7, 9, 11, 15]
+IMAGE_SIZES = [16, 32, 64, 128]
+
+# The im2col matrix grows with kernel_h * kernel_w: skip the sizes where it
+# does not fit in this budget (that is exactly where FFT is needed)
+MAX_COLUMNS_MB = 1024
+
+
+def best_time(function):
+    """
+    Best wall time (in milliseconds) over N_REPEATS runs of function()
+    """
+    return min(timeit.repeat(function, number=1, repeat=N_REPEATS)) * 1000
+
+
+def im2col_step(images, kernel, gradient_values):
+    """
+    Forward + backward with the im2col engine
+    """
+    _, columns = fast_convolve_2d(images, kernel, return_columns=True)
+    fast_convolution_backprop(images, kernel, gradient_values, input_columns=columns)
+
+
+def fft_step(images, kernel, gradient_values):
+    """
+    Forward + backward with the FFT engine
+    """
+    _, inputs_freq = fft_convolve_2d(images, kernel, return_transformed=True)
+    fft_convolution_backprop(images, kernel, gradient_values, inputs_freq=inputs_freq)
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print(f'Forward + backward time (ms), batch of {BATCH_SIZE} images, '
+          f'{IN_CHANNELS} -> {OUT_CHANNELS} channels')
+    print('{:>6} {:>7} | {:>10} {:>10} | {:>8}'.format('image', 'kernel', 'im2col', 'fft', 'winner'))
+
+    # Make sure fast_convolve_2d runs the im2col engine, whatever the configuration
+    engine = convolution.CONV_ENGINE
+    convolution.CONV_ENGINE = 'IM2COL'
+
+    try:
+        for image_size in IMAGE_SIZES:
+            for kernel_size in KERNEL_SIZES:
+                if kernel_size >= image_size:
+                    continue
+
+                images = rng.standard_normal((BATCH_SIZE, IN_CHANNELS, image_size, image_size))
+                kernel = rng.standard_normal((OUT_CHANNELS, IN_CHANNELS, kernel_size, kernel_size))
+                out_size = image_size - kernel_size + 1
+                gradient_values = rng.standard_normal((BATCH_SIZE, OUT_CHANNELS, out_size, out_size))
+
+                fft_time = best_time(lambda: fft_step(images, kernel, gradient_values))
+
+                columns_mb = IN_CHANNELS * kernel_size ** 2 * BATCH_SIZE * out_size ** 2 * images.itemsize / 2 ** 20
+                if columns_mb > MAX_COLUMNS_MB:
+                    print('{:>6} {:>7} | {:>10} {:>10.1f} | {:>8}'.format(
+                        image_size, kernel_size, 'no memory', fft_time, 'fft'))
+                    continue
+
+                im2col_time = best_time(lambda: im2col_step(images, kernel, gradient_values))
+
+                winner = 'fft' if fft_time < im2col_time else 'im2col'
+                print('{:>6} {:>7} | {:>10.1f} {:>10.1f} | {:>8}'.format(
+                    image_size, kernel_size, im2col_time, fft_time, winner))
+    finally:
+        convolution.CONV_ENGINE = engine
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import timeit
+import tracemalloc
+
+import numpy as np
+
+import model
+from model import forward, backward
+from optimizer import init_optimizer_dictionary
+from utils import init_model_weights
+from workspace import Workspace
+from config import DTYPE
+
+BATCH_SIZES = [32, 64, 128, 256, 512]
+N_REPEATS = 3
+
+# (name, use the layer graph, use a workspace)
+EXECUTORS = [
+    ('forward/backward', False, False),
+    ('+ workspace', False, True),
+    ('layer graph', True, False),
+]
+
+
+def training_step(data, weights, optimizer, workspace):
+    """
+    One forward + backward pass (with the weight update)
+    """
+    images, labels, labels_one_hot_encoded = data
+    scores, cache, _, _ = forward(images, labels, labels_one_hot_encoded, weights, workspace)
+    backward(images, labels_one_hot_encoded, scores, cache, weights, optimizer, 1, workspace)
+
+
+def measure(data, use_graph, use_workspace):
+    """
+    Peak memory of a training step, traced with tracemalloc.
+    Everything allocated by the step is counted, including the workspace buffers,
+    but not the data, the weights and the optimizer state
+
+    Returns
+    -------
+    peak : float
+        Peak memory (MB) of the second training step
+    step_time : float
+        Best wall time of a step (ms)
+    """
+    model.USE_LAYER_GRAPH = use_graph
+
+    np.random.seed(0)
+    weights = init_model_weights()
+    optimizer = init_optimizer_dictionary(weights)
+
+    tracemalloc.start()
+    workspace = Workspace() if use_workspace else None
+    training_step(data, weights, optimizer, workspace)
+
+    tracemalloc.reset_peak()
+    training_step(data, weights, optimizer, workspace)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    step_time = min(timeit.repeat(lambda: training_step(data, weights, optimizer, workspace),
+                                  number=1, repeat=N_REPEATS))
+
+    # Memory held before the step (e.g.: the workspace) is part of the peak
+    return peak / 1e6, step_time * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    use_graph = model.USE_LAYER_GRAPH
+
+    print(f'Peak memory (MB) and time (ms) of a training step ({DTYPE})')
+    print('{:>6} | '.format('batch') + ' | '.join('{:>24}'.format(name) for name, _, _ in EXECUTORS))
+
+    try:
+        for batch_size in BATCH_SIZES:
+            images = rng.standard_normal((batch_size, 3, 32, 32)).astype(DTYPE)
+            labels = rng.integers(0, 10, batch_size)
+            data = (images, labels, np.eye(10, dtype=DTYPE)[labels])
+
+            results = [measure(data, graph_executor, workspace) for _, graph_executor, workspace in EXECUTORS]
+            print('{:>6} | '.format(batch_size) +
+                  ' | '.join('{:>10.1f} MB {:>8.1f} ms'.format(*result) for result in results))
+    finally:
+        model.USE_LAYER_GRAPH = use_graph
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from benchmarks.training_benchmark import SEED, TARGET_ACCURACY, format_value, run_in_subprocess
+from parallel import available_cores
+
+EPOCHS = 5
+TRAIN_SAMPLES = 1024
+VALID_SAMPLES = 256
+TEST_SAMPLES = 256
+OPTIMIZER = 'MOMENTUM'
+
+REPORT_NAME = 'hogwild_benchmark'
+
+
+def mode_settings(mode, n_workers):
+    """
+    config.py settings of a training mode: single (one process), sync (DATA_PARALLEL_WORKERS)
+    or hogwild (HOGWILD_WORKERS)
+    """
+    if mode == 'sync':
+        return {'DATA_PARALLEL_WORKERS': n_workers}
+    if mode == 'hogwild':
+        return {'HOGWILD_WORKERS': n_workers}
+    return {}
+
+
+def mean_staleness(history):
+    """
+    Mean staleness of the updates of all the epochs (None if not a hogwild run)
+    """
+    epochs = [epoch['staleness'] for epoch in history if epoch.get('staleness')]
+    return float(np.mean([epoch['mean'] for epoch in epochs])) if epochs else None
+
+
+def write_report(rows, args, path):
+    """
+    Write the comparison of the modes as a markdown table
+    """
+    lines = [
+        '# Synchronous vs asynchronous (Hogwild) training',
+        '',
+        f'Synthetic data ({args.train_samples} train, {args.valid_samples} validation samples), {args.epochs} epochs, '
+        f'{args.optimizer}, seed {SEED}, {available_cores()} available cores.',
+        f'Images/s is the mean training throughput of the epochs after the first one. '
+        f'Time to accuracy: wall time to reach {args.target_accuracy:.0%} validation accuracy.',
+        '',
+        '| mode | workers | images/s | best valid acc | time to acc s | mean staleness |',
+        '|---|---|---|---|---|---|'
+    ]
+    for row in rows:
+        lines.append('| {} | {} | {} | {} | {} | {} |'.format(
+            row['mode'], row['workers'], format_value(row['images_per_second'], '{:.1f}'),
+            format_value(row['best_valid_accuracy'], '{:.3f}'), format_value(row['time_to_accuracy'], '{:.2f}'),
+            format_value(row['mean_staleness'], '{:.2f}')))
+
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Images/s and time to accuracy of the synchronous data parallel '
+                                                 'training vs the asynchronous Hogwild training')
+    parser.add_argument('--workers', nargs='+', type=int, default=[max(2, available_cores())])
+    parser.add_argument('--modes', nargs='+', choices=['single', 'sync', 'hogwild'],
+                        default=['single', 'sync', 'hogwild'])
+    parser.add_argument('--optimizer', default=OPTIMIZER)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--train-samples', type=int, default=TRAIN_SAMPLES)
+    parser.add_argument('--valid-samples', type=int, default=VALID_SAMPLES)
+    parser.add_argument('--test-samples', type=int, default=TEST_SAMPLES)
+    parser.add_argument('--target-accuracy', type=float, default=TARGET_ACCURACY)
+    parser.add_argument('--output-dir', default=os.path.join('plots', 'results'),
+                        help='where the JSON and markdown reports are written (not versioned: they are '
+                             'specific to the machine)')
+    args = parser.parse_args()
+    # Read by run_in_subprocess
+    args.data = 'synthetic'
+
+    runs = [(mode, 1) for mode in args.modes if mode == 'single'] + \
+        [(mode, n_workers) for n_workers in args.workers for mode in args.modes if mode != 'single']
+
+    if available_cores() < max(n_workers for _, n_workers in runs):
+        print(f'Warning: only {available_cores()} available cores, the workers share them: '
+              f'the results do not measure the scaling')
+
+    rows = []
+    results = []
+    for mode, n_workers in runs:
+        settings = dict(mode_settings(mode, n_workers), OPTIMIZER=args.optimizer)
+        print(f'Running {mode} with {n_workers} workers', flush=True)
+
+        result = run_in_subprocess(settings, args)
+        results.append(result)
+        summary = result['summary']
+        rows.append({'mode': mode, 'workers': n_workers,
+                     'images_per_second': summary['mean_images_per_second'],
+                     'best_valid_accuracy': summary['best_valid_accuracy'],
+                     'time_to_accuracy': summary['time_to_accuracy'],
+                     'mean_staleness': mean_staleness(result['history'])})
+        print('\t{:.1f} images/s, best valid accuracy {:.3f}, time to accuracy {} s'.format(
+            rows[-1]['images_per_second'], rows[-1]['best_valid_accuracy'],
+            format_value(rows[-1]['time_to_accuracy'], '{:.2f}')))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    json_path = os.path.join(args.output_dir, REPORT_NAME + '.json')
+    report_path = os.path.join(args.output_dir, REPORT_NAME + '.md')
+    with open(json_path, 'w') as file:
+        json.dump({'arguments': vars(args), 'seed': SEED, 'numpy': np.__version__,
+                   'available_cores': available_cores(), 'rows': rows, 'results': results}, file, indent=2)
+    write_report(rows, args, report_path)
+    print(f'Results saved in {json_path} and {report_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import io
+import os
+import tempfile
+import threading
+import urllib.request
+from timeit import default_timer as timer
+
+import numpy as np
+
+import config
+
+CLIENTS = 16
+REQUESTS_PER_CLIENT = 50
+MAX_LATENCIES_MS = [0, 2, 5, 10]
+
+
+def save_random_checkpoint(path):
+    """
+    Save randomly initialized weights (the latency does not depend on their values)
+    """
+    from model import init_model_weights, save_weights
+
+    np.random.seed(0)
+    save_weights(init_model_weights(), 0, path)
+
+
+def run_clients(url, n_clients, n_requests, input_shape):
+    """
+    Send n_requests single image requests from each of n_clients concurrent clients
+
+    Returns
+    -------
+    elapsed : float
+        Wall time (s) until all the requests are answered
+    """
+    rng = np.random.default_rng(0)
+    buffer = io.BytesIO()
+    np.save(buffer, rng.standard_normal(input_shape).astype(config.DTYPE))
+    body = buffer.getvalue()
+
+    def client():
+        for _ in range(n_requests):
+            request = urllib.request.Request(url + '/predict', data=body,
+                                             headers={'Content-Type': 'application/x-npy'})
+            with urllib.request.urlopen(request) as response:
+                response.read()
+
+    threads = [threading.Thread(target=client) for _ in range(n_clients)]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timer() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency of the inference server with concurrent '
+                                                 'single image requests, for several batching deadlines')
+    parser.add_argument('--clients', type=int, default=CLIENTS)
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_CLIENT, help='requests per client')
+    parser.add_argument('--max-latencies-ms', nargs='+', type=float, default=MAX_LATENCIES_MS)
+    args = parser.parse_args()
+
+    # Checkpoints are only saved when not training on the small dataset
+    config.TRAIN_SMALL_DATASET = False
+    from inference_server import serve
+
+    print(f'{args.clients} clients x {args.requests} single image requests ({config.DTYPE})')
+    print('{:>14} | {:>10} | {:>15} | {:>13} | {:>13} | {:>15} | {:>15}'.format(
+        'max latency ms', 'images/s', 'mean batch size', 'queue p50 ms', 'queue p99 ms', 'latency p50 ms',
+        'latency p99 ms'))
+
+    with tempfile.TemporaryDirectory() as weights_dir:
+        save_random_checkpoint(weights_dir)
+
+        for max_latency_ms in args.max_latencies_ms:
+            server = serve(weights_dir, port=0, max_latency=max_latency_ms / 1000)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                url = f'http://{config.INFERENCE_HOST}:{server.server_address[1]}'
+                elapsed = run_clients(url, args.clients, args.requests, server.batcher.input_shape)
+                metrics = server.batcher.metrics()
+            finally:
+                server.shutdown()
+                server.server_close()
+                server.batcher.close()
+
+            print('{:>14g} | {:>10.1f} | {:>15.2f} | {:>13.2f} | {:>13.2f} | {:>15.2f} | {:>15.2f}'.format(
+                max_latency_ms, metrics['images'] / elapsed, metrics['mean_batch_size'],
+                metrics['queue_ms']['p50'], metrics['queue_ms']['p99'],
+                metrics['latency_ms']['p50'], metrics['latency_ms']['p99']))
+
+
+if __name__ == '__main__':
+    main()
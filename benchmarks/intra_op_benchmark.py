@@ -0,0 +1,96 @@
+import argparse
+import timeit
+
+import numpy as np
+
+from model import forward, backward
+from max_pooling import fast_non_overlapping_max_pool, fast_non_overlapping_maxpool_backprop
+from optimizer import init_optimizer_dictionary
+from parallel import available_cores, blas_threads, set_intra_op_threads
+from relu import ReLU
+from utils import im2col, col2im, init_model_weights
+from workspace import Workspace
+from config import BATCH_SIZE, DTYPE
+
+N_REPEATS = 5
+
+# Shape of the conv1 output on CIFAR10 (inputs of conv2)
+CHANNELS = 8
+IMAGE_SIZE = 30
+KERNEL_SIZE = 3
+
+
+def best_time(function):
+    """
+    Best wall time (in milliseconds) over N_REPEATS runs of function(), after a warm up run
+    """
+    function()
+    return min(timeit.repeat(function, number=1, repeat=N_REPEATS)) * 1000
+
+
+def make_benchmarks(batch_size):
+    """
+    The timed operations, on seeded synthetic data
+
+    Returns
+    -------
+    benchmarks : dict
+        For each name, a function without arguments running the operation once
+    """
+    rng = np.random.default_rng(0)
+    images = rng.standard_normal((batch_size, CHANNELS, IMAGE_SIZE, IMAGE_SIZE)).astype(DTYPE)
+    columns = im2col(images, KERNEL_SIZE, KERNEL_SIZE)
+    relu_output = np.empty_like(images)
+    pooled, positions = fast_non_overlapping_max_pool(images)
+    pool_gradient = rng.standard_normal(pooled.shape).astype(DTYPE)
+
+    # Whole training step, with a workspace as in train_model
+    step_images = rng.standard_normal((batch_size, 3, 32, 32)).astype(DTYPE)
+    labels = rng.integers(0, 10, batch_size)
+    labels_one_hot_encoded = np.eye(10, dtype=DTYPE)[labels]
+    np.random.seed(0)
+    weights = init_model_weights()
+    optimizer = init_optimizer_dictionary(weights)
+    workspace = Workspace()
+
+    def training_step():
+        scores, cache, _, _ = forward(step_images, labels, labels_one_hot_encoded, weights, workspace)
+        backward(step_images, labels_one_hot_encoded, scores, cache, weights, optimizer, 1, workspace)
+
+    return {
+        'im2col': lambda: im2col(images, KERNEL_SIZE, KERNEL_SIZE, out=columns),
+        'col2im': lambda: col2im(columns, images.shape, KERNEL_SIZE, KERNEL_SIZE),
+        'max pool': lambda: fast_non_overlapping_max_pool(images),
+        'max pool backprop': lambda: fast_non_overlapping_maxpool_backprop(pool_gradient, images.shape, positions),
+        'ReLU': lambda: ReLU(images, out=relu_output),
+        'training step': training_step
+    }
+
+
+def main():
+    cores = available_cores()
+    # Powers of two up to the number of cores
+    default_threads = sorted({cores} | {2 ** power for power in range(cores.bit_length())})
+
+    parser = argparse.ArgumentParser(description='Scaling of the intra-op parallel kernels with the number of threads')
+    parser.add_argument('--threads', nargs='+', type=int, default=default_threads)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    benchmarks = make_benchmarks(args.batch_size)
+    print(f'Intra-op scaling (batch {args.batch_size}, {DTYPE}, {cores} available cores, '
+          f'BLAS threads: {blas_threads() or "unknown"})')
+    print('{:>8} | '.format('threads') + ' | '.join('{:>20}'.format(name) for name in benchmarks))
+
+    # Speedups are relative to the first thread count
+    baseline = None
+    for n_threads in args.threads:
+        set_intra_op_threads(n_threads)
+        times = [best_time(function) for function in benchmarks.values()]
+        baseline = baseline or times
+        print('{:>8} | '.format(n_threads) + ' | '.join(
+            '{:>9.2f} ms {:>6.2f}x'.format(time, base / time) for time, base in zip(times, baseline)))
+
+
+if __name__ == '__main__':
+    main()
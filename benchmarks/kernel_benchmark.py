@@ -0,0 +1,315 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import timeit
+
+import numpy as np
+
+import config
+from convolution import convolve_2d, fast_convolve_2d, fast_convolution_backprop
+from max_pooling import max_pool, fast_max_pool, fast_maxpool_backprop
+from utils import im2col, col2im
+
+SEED = 0
+
+# Grid of the benchmarked shapes: the inputs are (batch, channels, size, size)
+BATCH_SIZES = [8, 32, 128]
+CHANNELS = [3, 16]
+IMAGE_SIZES = [16, 32]
+DTYPES = ['float32', 'float64']
+
+# Smaller grid for a quick check (--quick)
+QUICK_GRID = {'batch_sizes': [8, 32], 'channels': [3], 'image_sizes': [32], 'dtypes': ['float32']}
+
+# Layer of the benchmarked kernels: 5x5 convolution with 16 filters, 2x2 maxpooling
+OUT_CHANNELS = 16
+KERNEL_SIZE = 5
+POOL_SIZE = 2
+
+# The naive implementations loop in python: only the smallest batches are timed
+NAIVE_KERNELS = ('convolve_2d', 'max_pool')
+NAIVE_MAX_BATCH_SIZE = 8
+
+N_REPEATS = 20
+N_WARMUP = 3
+# Each measure repeats the kernel until it lasts at least this long, so the fast kernels are not timer noise
+MIN_MEASURE_MS = 20
+
+# A kernel is a regression if its best time exceeds the baseline by more than REGRESSION_THRESHOLD,
+# and the slowdown is larger than the noise of both runs (NOISE_FACTOR times their spread) and
+# than MIN_REGRESSION_MS
+REGRESSION_THRESHOLD = 0.10
+NOISE_FACTOR = 2
+MIN_REGRESSION_MS = 0.05
+# The load of the machine can change between two runs: a regression is only reported if it is still
+# there when the kernel is measured again, up to CONFIRM_RUNS times
+CONFIRM_RUNS = 2
+
+REPORT_PATH = os.path.join('plots', 'results', 'kernel_benchmark.json')
+# Versioned baseline of --compare. The timings are machine specific: record a new one when the machine
+# changes, with --output benchmarks/baselines/kernel_baseline.json
+BASELINE_PATH = os.path.join('benchmarks', 'baselines', 'kernel_baseline.json')
+
+
+def make_kernels(batch_size, channels, image_size, dtype):
+    """
+    Build the benchmarked calls for a point of the grid, with seeded synthetic data
+
+    Returns
+    -------
+    kernels : dict
+        For each kernel name, a function without arguments running it once
+    """
+    rng = np.random.default_rng(SEED)
+    images = rng.standard_normal((batch_size, channels, image_size, image_size)).astype(dtype)
+    kernel = rng.standard_normal((OUT_CHANNELS, channels, KERNEL_SIZE, KERNEL_SIZE)).astype(dtype)
+
+    conv_output, columns = fast_convolve_2d(images, kernel, return_columns=True)
+    conv_gradient = rng.standard_normal(conv_output.shape).astype(dtype)
+    # im2col always returns a new matrix, while the forward may return the winograd/FFT transforms
+    im2col_columns = im2col(images, KERNEL_SIZE, KERNEL_SIZE)
+
+    pool_output, positions = fast_max_pool(images, POOL_SIZE, POOL_SIZE, POOL_SIZE)
+    pool_gradient = rng.standard_normal(pool_output.shape).astype(dtype)
+
+    return {
+        'convolve_2d': lambda: convolve_2d(images, kernel),
+        'fast_convolve_2d': lambda: fast_convolve_2d(images, kernel),
+        'fast_convolution_backprop': lambda: fast_convolution_backprop(images, kernel, conv_gradient,
+                                                                       input_columns=columns),
+        'max_pool': lambda: max_pool(images, POOL_SIZE, POOL_SIZE, POOL_SIZE),
+        'fast_max_pool': lambda: fast_max_pool(images, POOL_SIZE, POOL_SIZE, POOL_SIZE),
+        'fast_maxpool_backprop': lambda: fast_maxpool_backprop(pool_gradient, images.shape, positions,
+                                                               stride=POOL_SIZE, max_pool_size=POOL_SIZE),
+        'im2col': lambda: im2col(images, KERNEL_SIZE, KERNEL_SIZE),
+        'col2im': lambda: col2im(im2col_columns, images.shape, KERNEL_SIZE, KERNEL_SIZE)
+    }
+
+
+def measure(function, n_repeats=N_REPEATS):
+    """
+    Time a kernel: N_WARMUP runs, then n_repeats measures of at least MIN_MEASURE_MS each
+
+    Returns
+    -------
+    times : ndarray
+        The time of a single run (ms) in each measure
+    """
+    start = timeit.default_timer()
+    for _ in range(N_WARMUP):
+        function()
+    run_time = (timeit.default_timer() - start) / N_WARMUP * 1000
+
+    number = max(1, int(np.ceil(MIN_MEASURE_MS / max(run_time, 1e-6))))
+    return np.array(timeit.repeat(function, number=number, repeat=n_repeats)) / number * 1000
+
+
+def run(batch_sizes, channels, image_sizes, dtypes, n_repeats=N_REPEATS):
+    """
+    Time all the kernels over the grid
+
+    Returns
+    -------
+    results : list
+        One dict per kernel and point of the grid, with the best and the median
+        wall time (ms) over n_repeats measures (see measure), and their spread:
+        the interquartile range (ms), used as the noise of the measures
+    """
+    results = []
+    for batch_size, n_channels, image_size, dtype in itertools.product(batch_sizes, channels, image_sizes, dtypes):
+        for name, function in make_kernels(batch_size, n_channels, image_size, dtype).items():
+            if name in NAIVE_KERNELS and batch_size > NAIVE_MAX_BATCH_SIZE:
+                continue
+
+            times = measure(function, n_repeats)
+            result = {
+                'kernel': name,
+                'batch_size': batch_size,
+                'channels': n_channels,
+                'image_size': image_size,
+                'dtype': dtype,
+                'best_ms': float(times.min()),
+                'median_ms': float(np.median(times)),
+                'spread_ms': float(np.subtract(*np.percentile(times, [75, 25])))
+            }
+            results.append(result)
+            print('{:<28} {:>6} {:>9} {:>6} {:>8} | {:>10.3f} {:>10.3f}'.format(
+                name, batch_size, n_channels, image_size, dtype, result['best_ms'], result['median_ms']))
+
+    return results
+
+
+def environment():
+    """
+    Settings that change the timings, saved along with the results
+    """
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'conv_engine': config.CONV_ENGINE,
+        'im2col_backend': config.IM2COL_BACKEND,
+        'n_repeats': N_REPEATS,
+        'min_measure_ms': MIN_MEASURE_MS,
+        'seed': SEED
+    }
+
+
+def result_key(result):
+    return result['kernel'], result['batch_size'], result['channels'], result['image_size'], result['dtype']
+
+
+def is_regression(base, now, threshold=REGRESSION_THRESHOLD):
+    """
+    Check if a result is slower than its baseline by more than threshold and than the noise
+
+    Returns
+    -------
+    regression : bool
+        True if the kernel is a regression
+    noise_ms : float
+        The noise of the two measures (ms)
+    """
+    # Older baselines have no spread
+    noise_ms = NOISE_FACTOR * max(base.get('spread_ms', 0.), now['spread_ms'])
+    slowdown_ms = now['best_ms'] - base['best_ms']
+    return now['best_ms'] > base['best_ms'] * (1 + threshold) and slowdown_ms > max(noise_ms, MIN_REGRESSION_MS), \
+        noise_ms
+
+
+def confirm(regressions, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Measure the regressions again (see CONFIRM_RUNS), keeping the best time of all the measures
+
+    Parameters
+    ----------
+    regressions : list
+        The regressions found by compare
+    baseline : list
+        The results of the baseline
+    threshold : float, optional
+        Maximum slowdown before a kernel is flagged as a regression
+
+    Returns
+    -------
+    regressions : list
+        The regressions that are confirmed
+    """
+    baseline_results = {result_key(result): result for result in baseline}
+
+    confirmed = []
+    for key, _, now_ms in regressions:
+        kernel, batch_size, channels, image_size, dtype = key
+        now = {'best_ms': now_ms, 'spread_ms': 0.}
+        regression = True
+        for _ in range(CONFIRM_RUNS):
+            times = measure(make_kernels(batch_size, channels, image_size, dtype)[kernel])
+            now = {'best_ms': min(now['best_ms'], float(times.min())),
+                   'spread_ms': float(np.subtract(*np.percentile(times, [75, 25])))}
+            regression = is_regression(baseline_results[key], now, threshold)[0]
+            if not regression:
+                break
+
+        if regression:
+            confirmed.append((key, baseline_results[key]['best_ms'], now['best_ms']))
+        print('{:<28} {:>6} {:>9} {:>6} {:>8} | {:>10.3f} {:>10.3f} {}'.format(
+            *key, baseline_results[key]['best_ms'], now['best_ms'], 'REGRESSION' if regression else 'noise'))
+
+    return confirmed
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare the best times against a baseline. The best time is the least
+    disturbed by the other processes, and a slowdown only counts when it is
+    larger than the noise of the two runs (see REGRESSION_THRESHOLD)
+
+    Parameters
+    ----------
+    results : list
+        The current results (see run)
+    baseline : list
+        The results of the baseline
+    threshold : float, optional
+        Maximum slowdown (e.g.: 0.1 = 10%) before a kernel is flagged as a regression
+
+    Returns
+    -------
+    regressions : list
+        (key, baseline ms, current ms) of the kernels slower than the baseline by more than threshold and the noise
+    """
+    baseline_results = {result_key(result): result for result in baseline}
+
+    print('{:<28} {:>6} {:>9} {:>6} {:>8} | {:>10} {:>10} {:>8} {:>9}'.format(
+        'kernel', 'batch', 'channels', 'size', 'dtype', 'base ms', 'now ms', 'ratio', 'noise ms'))
+
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in baseline_results:
+            continue
+
+        base_ms = baseline_results[key]['best_ms']
+        now_ms = result['best_ms']
+        regression, noise_ms = is_regression(baseline_results[key], result, threshold)
+        ratio = now_ms / base_ms
+        flag = ''
+        if regression:
+            flag = ' REGRESSION'
+            regressions.append((key, base_ms, now_ms))
+        print('{:<28} {:>6} {:>9} {:>6} {:>8} | {:>10.3f} {:>10.3f} {:>7.2f}x {:>9.3f}{}'.format(
+            *key, base_ms, now_ms, ratio, noise_ms, flag))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the convolution, pooling and im2col kernels')
+    parser.add_argument('--output', default=REPORT_PATH, help='JSON file where the results are written')
+    parser.add_argument('--compare', metavar='BASELINE', nargs='?', const=BASELINE_PATH,
+                        help='JSON file of a previous run: flag the regressions (default: %(const)s)')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='slowdown ratio flagged as a regression (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true', help='run a smaller grid')
+    args = parser.parse_args()
+
+    # The baseline is read before the results are written, and it must not be overwritten by them
+    baseline = None
+    if args.compare:
+        if os.path.abspath(args.compare) == os.path.abspath(args.output):
+            parser.error('--output and --compare are the same file: the baseline would be overwritten')
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    grid = QUICK_GRID if args.quick else {'batch_sizes': BATCH_SIZES, 'channels': CHANNELS,
+                                          'image_sizes': IMAGE_SIZES, 'dtypes': DTYPES}
+
+    print('{:<28} {:>6} {:>9} {:>6} {:>8} | {:>10} {:>10}'.format(
+        'kernel', 'batch', 'channels', 'size', 'dtype', 'best ms', 'median ms'))
+    results = run(**grid)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump({'environment': environment(), 'grid': grid, 'results': results}, file, indent=2)
+    print(f'Results saved in {args.output}')
+
+    if baseline is not None:
+        print(f'\nComparison with {args.compare}')
+        changed = [name for name, value in environment().items() if baseline['environment'].get(name) != value]
+        if changed:
+            print('Warning: the baseline was measured with different settings: ' + ', '.join(changed))
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print('\nMeasuring the regressions again')
+            regressions = confirm(regressions, baseline['results'], args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) above {args.threshold:.0%}')
+            raise SystemExit(1)
+        print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
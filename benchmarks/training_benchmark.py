@@ -0,0 +1,311 @@
+import argparse
+import importlib
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+import config
+
+SEED = 0
+
+# Configurations compared by default: each combination runs in its own process
+FAST_CONV = [True, False]
+OPTIMIZERS = ['ADAM', 'MOMENTUM', 'SGD']
+BATCH_SIZES = [32, 128]
+DTYPES = ['float32', 'float64']
+
+EPOCHS = 5
+TRAIN_SAMPLES = 1024
+VALID_SAMPLES = 256
+TEST_SAMPLES = 256
+TARGET_ACCURACY = 0.9
+
+# The naive convolution loops in python (seconds per image): its runs are cut to these sizes (see --full-naive)
+NAIVE_EPOCHS = 1
+NAIVE_TRAIN_SAMPLES = 128
+NAIVE_VALID_SAMPLES = 32
+NAIVE_TEST_SAMPLES = 32
+
+# Synthetic data: each class is a fixed random image, plus gaussian noise
+SYNTHETIC_SIGNAL = 1.0
+
+REPORT_NAME = 'training_benchmark'
+
+
+# ################################################################################
+# SINGLE RUN (child process)
+# ################################################################################
+def synthetic_dataset(n_samples, rng, templates, dtype):
+    """
+    Learnable random dataset: the images of a class are noisy copies of the same template
+    """
+    labels = rng.integers(0, len(templates), n_samples)
+    images = templates[labels] * SYNTHETIC_SIGNAL + rng.standard_normal((n_samples,) + templates.shape[1:])
+    return images.astype(dtype), labels
+
+
+def load_data(data, n_train, n_valid, n_test):
+    """
+    Load the train, validation and test sets
+
+    Parameters
+    ----------
+    data : string
+        'synthetic', or 'cifar10' to use a CIFAR10 copy already downloaded by main.py
+    n_train, n_valid, n_test : int
+        Number of samples of each set
+
+    Returns
+    -------
+    datasets : tuple
+        Train images and labels, validation images and labels, test images and labels
+    """
+    if data == 'cifar10':
+        from dataset_cifar10 import CACHE_DIRECTORY, Cifar10
+
+        dataset_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cifar10')
+        if not any(os.path.isdir(os.path.join(dataset_path, directory))
+                   for directory in (CACHE_DIRECTORY, 'cifar-10-batches-py')):
+            raise SystemExit(f'CIFAR10 not found in {dataset_path}: the benchmark does not download it')
+
+        from utils import normalize_images
+
+        dataset = Cifar10()
+        train_images, train_labels, valid_images, valid_labels, test_images, test_labels = dataset.get_datasets()
+        # Normalized here: load_data returns images of DTYPE for all the datasets
+        return normalize_images(train_images[:n_train], dataset.train_normalization), train_labels[:n_train], \
+            normalize_images(valid_images[:n_valid], dataset.train_normalization), valid_labels[:n_valid], \
+            normalize_images(test_images[:n_test], dataset.test_normalization), test_labels[:n_test]
+
+    rng = np.random.default_rng(SEED)
+    shape = (3, 32, 32) if config.USE_CIFAR_10 else (1, 28, 28)
+    templates = rng.standard_normal((10,) + shape)
+    return synthetic_dataset(n_train, rng, templates, config.DTYPE) + \
+        synthetic_dataset(n_valid, rng, templates, config.DTYPE) + \
+        synthetic_dataset(n_test, rng, templates, config.DTYPE)
+
+
+def run_configuration(settings, args):
+    """
+    Train and test the model with the given config.py settings.
+    It must run in a fresh process: the settings are applied to config before
+    the model is imported, and the peak RSS is the one of the process
+
+    Returns
+    -------
+    result : dict
+        The settings, the metrics of each epoch and the summary metrics
+    """
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+    with tempfile.TemporaryDirectory() as weights_dir:
+        # Weights are saved (needed by test_model), but outside of the repository
+        config.TRAIN_SMALL_DATASET = False
+        config.VALIDATION_WEIGHTS_PATH = os.path.join(weights_dir, 'validation')
+        model = importlib.import_module('model')
+
+        train_images, train_labels, valid_images, valid_labels, test_images, test_labels = \
+            load_data(args.data, args.train_samples, args.valid_samples, args.test_samples)
+
+        np.random.seed(SEED)
+        history = model.train_model(train_images, train_labels, valid_images, valid_labels, args.epochs)
+
+        test = None
+        if os.path.isdir(config.VALIDATION_WEIGHTS_PATH):
+            test = model.test_model(config.VALIDATION_WEIGHTS_PATH, test_images, test_labels, None, show_plots=False)
+
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'settings': settings, 'history': history, 'test': test,
+            'summary': summarize(history, test, peak_rss, args.target_accuracy)}
+
+
+def run_arguments(settings, args):
+    """
+    The arguments of a run: the ones of the command line, cut to the NAIVE_* sizes
+    for the naive convolution (unless --full-naive)
+    """
+    if settings['USE_FAST_CONV'] or args.full_naive:
+        return args
+
+    return argparse.Namespace(**dict(vars(args), epochs=min(args.epochs, NAIVE_EPOCHS),
+                                     train_samples=min(args.train_samples, NAIVE_TRAIN_SAMPLES),
+                                     valid_samples=min(args.valid_samples, NAIVE_VALID_SAMPLES),
+                                     test_samples=min(args.test_samples, NAIVE_TEST_SAMPLES)))
+
+
+def run_in_subprocess(settings, args):
+    """
+    Run run_configuration in a fresh Python process
+
+    Parameters
+    ----------
+    settings : dict
+        The config.py settings of the run
+    args : Namespace
+        The arguments shared by all the runs (epochs, number of samples, target accuracy, data)
+
+    Returns
+    -------
+    result : dict
+        See run_configuration
+    """
+    common_args = [f'--{name.replace("_", "-")}={getattr(args, name)}'
+                   for name in ('epochs', 'train_samples', 'valid_samples', 'test_samples', 'target_accuracy', 'data')]
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        result_path = os.path.join(run_dir, 'result.json')
+        process = subprocess.run([sys.executable, '-m', 'benchmarks.training_benchmark', '--run',
+                                  json.dumps(settings), '--result', result_path] + common_args,
+                                 capture_output=True, text=True, env=dict(os.environ, MPLBACKEND='Agg'))
+        if process.returncode != 0:
+            print(process.stdout + process.stderr)
+            raise SystemExit(f'Run failed: {settings}')
+
+        with open(result_path) as file:
+            return json.load(file)
+
+
+def summarize(history, test, peak_rss, target_accuracy):
+    """
+    Summary metrics of a run
+
+    The step latency percentiles skip the first step, which allocates the buffers.
+    The time to accuracy is the wall time (training + validation) of the epochs
+    completed when the validation accuracy first reaches target_accuracy (None if never).
+    """
+    step_times = np.concatenate([epoch['step_times'] for epoch in history])[1:] * 1000
+    images_per_second = [epoch['train_samples'] / epoch['train_time'] for epoch in history]
+
+    time_to_accuracy = None
+    elapsed = 0
+    for epoch in history:
+        elapsed += epoch['epoch_time']
+        if epoch['valid_accuracy'] >= target_accuracy:
+            time_to_accuracy = elapsed
+            break
+
+    summary = {
+        'images_per_second': images_per_second,
+        'mean_images_per_second': float(np.mean(images_per_second[1:] if len(history) > 1 else images_per_second)),
+        'step_ms_p50': float(np.percentile(step_times, 50)) if step_times.size else None,
+        'step_ms_p90': float(np.percentile(step_times, 90)) if step_times.size else None,
+        'step_ms_p99': float(np.percentile(step_times, 99)) if step_times.size else None,
+        'peak_rss_bytes': peak_rss,
+        'best_valid_accuracy': max(epoch['valid_accuracy'] for epoch in history),
+        'target_accuracy': target_accuracy,
+        'time_to_accuracy': time_to_accuracy,
+        'test_accuracy': test['test_accuracy'] if test else None,
+        'test_images_per_second': test['test_samples'] / test['test_time'] if test else None
+    }
+    return summary
+
+
+# ################################################################################
+# REPORT
+# ################################################################################
+def format_value(value, pattern):
+    return '-' if value is None else pattern.format(value)
+
+
+def write_report(results, args, path):
+    """
+    Write the comparison of the runs as a markdown table
+    """
+    lines = [
+        '# Training benchmark',
+        '',
+        f'Data: {args.data} ({args.train_samples} train, {args.valid_samples} validation, '
+        f'{args.test_samples} test samples), {args.epochs} epochs, seed {SEED}.',
+        f'Images/s is the mean training throughput of the epochs after the first one. '
+        f'Time to accuracy: wall time to reach {args.target_accuracy:.0%} validation accuracy.',
+        f'The naive convolution runs are shorter (see the epochs and train samples columns): '
+        f'their accuracies are not comparable with the fast ones.',
+        '',
+        '| fast conv | optimizer | batch | dtype | epochs | train samples | images/s | step p50 ms | step p99 ms '
+        '| peak RSS MB | best valid acc | time to acc s | test acc | test images/s |',
+        '|---|---|---|---|---|---|---|---|---|---|---|---|---|---|'
+    ]
+    for result in results:
+        settings = result['settings']
+        summary = result['summary']
+        run_args = run_arguments(settings, args)
+        lines.append('| {} | {} | {} | {} | {} | {} | {} | {} | {} | {} | {} | {} | {} | {} |'.format(
+            settings['USE_FAST_CONV'], settings['OPTIMIZER'], settings['BATCH_SIZE'], settings['DTYPE'],
+            run_args.epochs, run_args.train_samples,
+            format_value(summary['mean_images_per_second'], '{:.1f}'),
+            format_value(summary['step_ms_p50'], '{:.1f}'),
+            format_value(summary['step_ms_p99'], '{:.1f}'),
+            format_value(summary['peak_rss_bytes'] / 1e6, '{:.0f}'),
+            format_value(summary['best_valid_accuracy'], '{:.3f}'),
+            format_value(summary['time_to_accuracy'], '{:.2f}'),
+            format_value(summary['test_accuracy'], '{:.3f}'),
+            format_value(summary['test_images_per_second'], '{:.1f}')))
+
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end training throughput and time-to-accuracy benchmark')
+    parser.add_argument('--fast-conv', nargs='+', choices=['true', 'false'],
+                        default=[str(value).lower() for value in FAST_CONV])
+    parser.add_argument('--optimizers', nargs='+', default=OPTIMIZERS)
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=BATCH_SIZES)
+    parser.add_argument('--dtypes', nargs='+', default=DTYPES)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--train-samples', type=int, default=TRAIN_SAMPLES)
+    parser.add_argument('--valid-samples', type=int, default=VALID_SAMPLES)
+    parser.add_argument('--test-samples', type=int, default=TEST_SAMPLES)
+    parser.add_argument('--target-accuracy', type=float, default=TARGET_ACCURACY)
+    parser.add_argument('--data', choices=['synthetic', 'cifar10'], default='synthetic')
+    parser.add_argument('--full-naive', action='store_true',
+                        help='run the naive convolution with the same epochs and samples of the fast one')
+    parser.add_argument('--output-dir', default=os.path.join('plots', 'results'),
+                        help='where the JSON and markdown reports are written (not versioned: they are '
+                             'specific to the machine)')
+    # Internal: run a single configuration (JSON settings) and write its result in a file
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        result = run_configuration(json.loads(args.run), args)
+        with open(args.result, 'w') as file:
+            json.dump(result, file)
+        return
+
+    grid = itertools.product([value == 'true' for value in args.fast_conv], args.optimizers, args.batch_sizes,
+                             args.dtypes)
+
+    results = []
+    for fast_conv, optimizer, batch_size, dtype in grid:
+        settings = {'USE_FAST_CONV': fast_conv, 'OPTIMIZER': optimizer, 'BATCH_SIZE': batch_size, 'DTYPE': dtype}
+        print('Running ' + ', '.join(f'{name}={value}' for name, value in settings.items()), flush=True)
+
+        result = run_in_subprocess(settings, run_arguments(settings, args))
+        results.append(result)
+        summary = result['summary']
+        print('\t{:.1f} images/s, step p50 {} ms, best valid accuracy {:.3f}'.format(
+            summary['mean_images_per_second'], format_value(summary['step_ms_p50'], '{:.1f}'),
+            summary['best_valid_accuracy']))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    json_path = os.path.join(args.output_dir, REPORT_NAME + '.json')
+    report_path = os.path.join(args.output_dir, REPORT_NAME + '.md')
+    with open(json_path, 'w') as file:
+        json.dump({'arguments': {name: value for name, value in vars(args).items() if name not in ('run', 'result')},
+                   'seed': SEED, 'numpy': np.__version__, 'results': results}, file, indent=2)
+    write_report(results, args, report_path)
+    print(f'Results saved in {json_path} and {report_path}')
+
+
+if __name__ == '__main__':
+    main()
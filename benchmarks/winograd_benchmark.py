@@ -0,0 +1,88 @@
+import timeit
+
+import numpy as np
+
+import convolution
+from convolution import convolve_2d, convolution_backprop, fast_convolve_2d, fast_convolution_backprop
+from winograd import winograd_convolve_2d, winograd_convolution_backprop
+
+N_REPEATS = 5
+
+# CIFAR10 layers built by init_model_weights: (name, input shape, number of filters)
+CIFAR10_LAYERS = [
+    ('conv1', (128, 3, 32, 32), 8),
+    ('conv2', (128, 8, 30, 30), 16),
+]
+
+
+def best_time(function):
+    """
+    Best wall time (in milliseconds) over N_REPEATS runs of function()
+    """
+    return min(timeit.repeat(function, number=1, repeat=N_REPEATS)) * 1000
+
+
+def accuracy_check(rng):
+    """
+    Compare the Winograd convolution with the NAIVE implementation
+    on a small batch, for both float64 and float32 inputs
+    """
+    print('Max absolute error WRT convolve_2d / convolution_backprop')
+    print('{:>8} | {:>10} {:>10} {:>10}'.format('dtype', 'output', 'dW', 'dX'))
+
+    images = rng.standard_normal((2, 3, 9, 9))
+    kernel = rng.standard_normal((4, 3, 3, 3))
+    gradient_values = rng.standard_normal((2, 4, 7, 7))
+
+    expected = convolve_2d(images, kernel)
+    expected_dw, expected_dx = convolution_backprop(images, kernel, gradient_values)
+
+    for dtype in (np.float64, np.float32):
+        result = winograd_convolve_2d(images.astype(dtype), kernel.astype(dtype))
+        dw, dx = winograd_convolution_backprop(images.astype(dtype), kernel.astype(dtype),
+                                               gradient_values.astype(dtype))
+        errors = [np.abs(result - expected).max(), np.abs(dw - expected_dw).max(), np.abs(dx - expected_dx).max()]
+        print('{:>8} | {:>10.2e} {:>10.2e} {:>10.2e}'.format(np.dtype(dtype).name, *errors))
+    print()
+
+
+def speed_comparison(rng):
+    """
+    Time forward and backward of the CIFAR10 conv layers with both engines
+    """
+    print('CIFAR10 conv layers, batch of 128 images (ms)')
+    print('{:>6} | {:>12} {:>12} | {:>12} {:>12}'.format(
+        'layer', 'im2col fwd', 'winograd fwd', 'im2col bwd', 'winograd bwd'))
+
+    # Make sure fast_convolve_2d runs the im2col engine, whatever the configuration
+    engine = convolution.CONV_ENGINE
+    convolution.CONV_ENGINE = 'IM2COL'
+
+    try:
+        for name, input_shape, n_filters in CIFAR10_LAYERS:
+            images = rng.standard_normal(input_shape)
+            kernel = rng.standard_normal((n_filters, input_shape[1], 3, 3))
+
+            result, columns = fast_convolve_2d(images, kernel, return_columns=True)
+            _, tiles = winograd_convolve_2d(images, kernel, return_transformed=True)
+            gradient_values = rng.standard_normal(result.shape)
+
+            times = [
+                best_time(lambda: fast_convolve_2d(images, kernel, return_columns=True)),
+                best_time(lambda: winograd_convolve_2d(images, kernel, return_transformed=True)),
+                best_time(lambda: fast_convolution_backprop(images, kernel, gradient_values, input_columns=columns)),
+                best_time(lambda: winograd_convolution_backprop(images, kernel, gradient_values, input_tiles=tiles)),
+            ]
+            print('{:>6} | {:>12.1f} {:>12.1f} | {:>12.1f} {:>12.1f}'.format(name, *times))
+    finally:
+        convolution.CONV_ENGINE = engine
+
+
+def main():
+    rng = np.random.default_rng(0)
+    accuracy_check(rng)
+    speed_comparison(rng)
+
+
+if __name__ == '__main__':
+    main()
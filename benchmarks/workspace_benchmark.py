@@ -0,0 +1,85 @@
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from model import forward, backward
+from optimizer import init_optimizer_dictionary
+from utils import init_model_weights
+from workspace import Workspace
+from config import BATCH_SIZE, DTYPE
+
+N_WARMUP_STEPS = 2
+N_STEPS = 5
+
+
+def training_step(data, weights, optimizer, n_weight_updates, workspace):
+    """
+    One forward + backward pass (with the weight update)
+    """
+    images, labels, labels_one_hot_encoded = data
+    scores, cache, _, _ = forward(images, labels, labels_one_hot_encoded, weights, workspace)
+    backward(images, labels_one_hot_encoded, scores, cache, weights, optimizer, n_weight_updates, workspace)
+
+
+def measure(data, workspace):
+    """
+    Memory allocated by the training steps, traced with tracemalloc
+
+    Returns
+    -------
+    allocated : float
+        Peak memory allocated during a step (MB), on top of what was already allocated before it
+    retained : float
+        Memory still allocated after a step (MB), on top of what was already allocated before it
+    step_time : float
+        Best wall time of a step (ms)
+    n_allocations : int
+        Buffers allocated by the workspace after the warm up steps
+    """
+    np.random.seed(0)
+    weights = init_model_weights()
+    optimizer = init_optimizer_dictionary(weights)
+
+    for step in range(1, N_WARMUP_STEPS + 1):
+        training_step(data, weights, optimizer, step, workspace)
+    warm_allocations = workspace.n_allocations if workspace is not None else 0
+
+    allocated, retained = [], []
+    tracemalloc.start()
+    for step in range(N_WARMUP_STEPS + 1, N_WARMUP_STEPS + N_STEPS + 1):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        training_step(data, weights, optimizer, step, workspace)
+        end, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - start)
+        retained.append(end - start)
+    tracemalloc.stop()
+
+    step_time = min(timeit.repeat(lambda: training_step(data, weights, optimizer, N_STEPS, workspace),
+                                  number=1, repeat=N_STEPS))
+    n_allocations = workspace.n_allocations - warm_allocations if workspace is not None else 0
+
+    return np.median(allocated) / 1e6, np.median(retained) / 1e6, step_time * 1000, n_allocations
+
+
+def main():
+    rng = np.random.default_rng(0)
+    images = rng.standard_normal((BATCH_SIZE, 3, 32, 32)).astype(DTYPE)
+    labels = rng.integers(0, 10, BATCH_SIZE)
+    labels_one_hot_encoded = np.eye(10, dtype=DTYPE)[labels]
+    data = (images, labels, labels_one_hot_encoded)
+
+    print(f'Steady-state allocations of a training step (batch {BATCH_SIZE}, {DTYPE})')
+    print('{:>12} | {:>14} {:>14} {:>10} {:>12}'.format(
+        'workspace', 'allocated MB', 'retained MB', 'step ms', 'new buffers'))
+
+    workspace = Workspace()
+    for name, arena in (('no', None), ('yes', workspace)):
+        print('{:>12} | {:>14.2f} {:>14.2f} {:>10.1f} {:>12}'.format(name, *measure(data, arena)))
+
+    print(f'Workspace size: {workspace.nbytes / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,22 +9,61 @@ TRAIN_SMALL_DATASET = True  # Just try on dummy dataset
 USE_HE_WEIGHT_INITIALIZATION = True  # True for best results
 
 USE_FAST_CONV = True
+# Valid values: IM2COL, WINOGRAD (3x3 kernels, stride 1), FFT (stride 1). Unsupported layers use IM2COL
+CONV_ENGINE = 'IM2COL'
+IM2COL_BACKEND = 'STRIDED'  # Valid values: INDICES, STRIDED
+INDEX_CACHE_SIZE = 32  # Max number of im2col/col2im index plans kept in memory
+CACHE_CONV_COLUMNS = True  # Reuse the forward im2col matrices in the backward pass (costs memory)
+USE_FUSED_CONV_RELU_POOL = True  # Compute conv2 + ReLU + maxpool as a single block (fast conv only)
+# Threads splitting im2col, col2im, maxpooling and ReLU over the batch (see parallel.py). 0: one per core
+INTRA_OP_THREADS = 1
+BLAS_THREADS = 0  # Threads of the matrix multiplications (0: BLAS default). Needs threadpoolctl
+# Processes computing the gradients of each batch in parallel (see data_parallel.py). 1: single process
+DATA_PARALLEL_WORKERS = 1
+# Processes training asynchronously on shared weights, without locks (see hogwild.py). 1: single process
+HOGWILD_WORKERS = 1
+# Distributed data parallel training (see distributed.py): each rank trains on its shard of the data and the
+# gradients are averaged with a ring all-reduce over TCP. Set per process by the launcher (RANK, WORLD_SIZE)
+DISTRIBUTED_RANK = int(os.environ.get('RANK', 0))
+DISTRIBUTED_WORLD_SIZE = int(os.environ.get('WORLD_SIZE', 1))
+# host:port of every rank, comma separated. Empty: all the ranks on localhost, from DISTRIBUTED_BASE_PORT
+DISTRIBUTED_HOSTS = os.environ.get('RING_HOSTS', '')
+DISTRIBUTED_BASE_PORT = int(os.environ.get('RING_BASE_PORT', 29500))
+# Run the model through the layer graph of graph.py, which releases each value as soon as it is consumed
+# (lower peak memory, but the workspace buffers are not used)
+USE_LAYER_GRAPH = False
+# Input pipeline (see data_loader.py)
+SHUFFLE_EACH_EPOCH = True  # New order of the training samples at every epoch
+DROP_LAST_BATCH = False  # Skip the last training batch when it is smaller than BATCH_SIZE
+LOADER_PREFETCH_BATCHES = 2  # Batches prepared by a background thread while training (0: no thread)
 USE_DROPOUT = False
 CONV_DROPOUT_PROBABILITY = 0.8
 DENSE_DROPOUT_PROBABILITY = 0.5
 
+DTYPE = 'float32'  # Valid values: float64, float32, float16
+CHECK_DTYPE = True  # Raise an error when an operation silently changes the dtype
+
 LEARNING_RATE = 1e-3
 EPS = 1e-8
 BETA1 = 0.9
 BETA2 = 0.999
 OPTIMIZER = 'ADAM'  # Valid values: ADAM, MOMENTUM
 
+# Inference server (see inference_server.py): the concurrent requests are run as a single batch, which waits
+# at most INFERENCE_MAX_LATENCY_MS for more requests after the first one
+INFERENCE_HOST = '127.0.0.1'
+INFERENCE_PORT = 8000
+INFERENCE_MAX_BATCH_SIZE = 128
+INFERENCE_MAX_LATENCY_MS = 5
+
+# Record time, allocated memory and GFLOP/s of each stage of forward/backward (see profiler.py)
+ENABLE_PROFILING = False
+PROFILE_MEMORY = True  # Trace the allocated bytes with tracemalloc (slows down the profiled run)
+
 
 TRAIN_WEIGHTS_PATH = os.path.join('weights', 'cifar10_train') if USE_CIFAR_10 \
     else os.path.join('weights', 'mnist_train')
 VALIDATION_WEIGHTS_PATH = os.path.join('weights', 'cifar10_validation') if USE_CIFAR_10 \
     else os.path.join('weights', 'mnist_validation')
-
-
-
-
+PROFILING_PATH = os.path.join('plots', 'results', 'cifar10_profile.json') if USE_CIFAR_10 \
+    else os.path.join('plots', 'results', 'mnist_profile.json')
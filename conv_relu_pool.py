@@ -0,0 +1,114 @@
+from convolution import *
+from max_pooling import *
+
+
+def fast_conv_relu_pool(inputs, kernel, padding=0, pool_size=2, return_columns=False, workspace=None,
+                        return_positions=True):
+    """
+    Compute convolution + ReLU + maxpooling (non-overlapping windows) as a single block.
+
+    The ReLU is monotonic, so max(ReLU(x)) == ReLU(max(x)): the maxpooling is
+    applied directly to the convolution result, and the ReLU only to the pooled
+    values. Neither a full size ReLU output nor an im2col copy of the convolution
+    result is ever created, and only the pooled result and the compact positions
+    of the maxima are needed during the backpropagation.
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+    padding: int, optional
+        The possible padding applied to the inputs of the convolution
+    pool_size : int, optional
+        The size (and stride) of the maxpooling windows
+    return_columns: bool, optional
+        If True, the im2col matrix (or the transformed inputs) of the
+        convolution is returned as well (see fast_convolve_2d)
+    workspace: Workspace, optional
+        Arena providing the buffers of the results and of the temporaries
+    return_positions: bool, optional
+        If False, the positions of the maxima (only needed by the backpropagation) are not computed
+
+    Returns
+    -------
+    max_pool_result : ndarray
+        The result of the block
+    pos_result : ndarray
+        The position of the maximum inside each window (only if return_positions is True)
+    input_matrix : ndarray
+        The inputs in column form (only if return_columns is True)
+    """
+    if return_columns:
+        conv_result, input_matrix = fast_convolve_2d(inputs, kernel, padding, return_columns=True, workspace=workspace)
+    else:
+        conv_result = fast_convolve_2d(inputs, kernel, padding, workspace=workspace)
+
+    pooled = fast_non_overlapping_max_pool(conv_result, pool_size, get_scope(workspace, 'pool'), return_positions)
+    max_pool_result = pooled[0] if return_positions else pooled
+
+    # ReLU on the pooled values only (the pooled result is a new array)
+    np.maximum(max_pool_result, 0, out=max_pool_result)
+
+    results = (max_pool_result,) + ((pooled[1],) if return_positions else ()) + \
+        ((input_matrix,) if return_columns else ())
+    return results if len(results) > 1 else max_pool_result
+
+
+def fast_conv_relu_pool_backprop(inputs, kernel, gradient_values, max_pool_result, pos_result, padding=0,
+                                 pool_size=2, input_columns=None, workspace=None, input_gradient=True,
+                                 reuse_columns=False):
+    """
+    Compute the backpropagation through the convolution + ReLU + maxpooling block
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+    gradient_values : ndarray
+        The gradients WRT the result of the block
+    max_pool_result : ndarray
+        The result of the block, as returned by fast_conv_relu_pool
+    pos_result : ndarray
+        The positions of the maxima, as returned by fast_conv_relu_pool
+    padding: int, optional
+        The possible padding applied to the inputs of the convolution
+    pool_size : int, optional
+        The size (and stride) of the maxpooling windows
+    input_columns: ndarray, optional
+        The im2col matrix of the inputs, as returned by fast_conv_relu_pool
+    workspace: Workspace, optional
+        Arena providing the buffers of the results and of the temporaries
+    input_gradient: bool, optional
+        If False, dX is not computed (see fast_convolution_backprop)
+    reuse_columns: bool, optional
+        If True, the memory of input_columns is reused (see fast_convolution_backprop)
+
+    Returns
+    -------
+    dW : ndarray
+        The derivative computed WRT the weights
+    dX : ndarray
+        The derivative computed WRT the inputs
+    """
+    n_images, _, input_h, input_w = inputs.shape
+    out_channels, _, kernel_h, kernel_w = kernel.shape
+
+    # Shape of the convolution result
+    conv_shape = (n_images, out_channels, input_h + 2 * padding - kernel_h + 1, input_w + 2 * padding - kernel_w + 1)
+
+    # ReLU derivative: a window contributes only if its maximum was positive
+    is_positive = get_array(workspace, 'relu_mask', max_pool_result.shape, bool)
+    np.greater(max_pool_result, 0, out=is_positive)
+    gradient_values = np.multiply(gradient_values, is_positive,
+                                  out=get_buffer(workspace, 'relu_delta', max_pool_result.shape, gradient_values.dtype))
+
+    delta_conv = fast_non_overlapping_maxpool_backprop(gradient_values, conv_shape, pos_result, pool_size,
+                                                       get_scope(workspace, 'pool'))
+
+    return fast_convolution_backprop(inputs, kernel, delta_conv, padding, input_columns=input_columns,
+                                     workspace=workspace, input_gradient=input_gradient,
+                                     reuse_columns=reuse_columns)
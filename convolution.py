@@ -1,4 +1,6 @@
 from utils import *
+from winograd import *
+from fft_convolution import *
 
 
 def convolve_2d(images, kernel, padding=0, stride=1):
@@ -34,7 +36,7 @@ def convolve_2d(images, kernel, padding=0, stride=1):
 
     # Init the convolution matrix with zero values
     convolution_result = np.zeros((images.shape[0], output_channels, output_h, output_w),
-                                  dtype=np.float)
+                                  dtype=images.dtype)
 
     # Cycle all the images in the batch
     for image_idx in range(images.shape[0]):
@@ -84,7 +86,7 @@ def convolve_2d(images, kernel, padding=0, stride=1):
     return convolution_result
 
 
-def fast_convolve_2d(inputs, kernel, padding=0, stride=1):
+def fast_convolve_2d(inputs, kernel, padding=0, stride=1, return_columns=False, workspace=None):
     """
     Compute the FAST version of the convolution
 
@@ -98,12 +100,25 @@ def fast_convolve_2d(inputs, kernel, padding=0, stride=1):
         The possible padding applied to the inputs
     stride: int, optional
         The stride applied for the convolution operation
+    return_columns: bool, optional
+        If True, the im2col matrix of the inputs is returned as well,
+        so that it can be reused by fast_convolution_backprop
+    workspace: Workspace, optional
+        Arena providing the buffers of the im2col matrix and of the result.
+        Not used by the WINOGRAD and FFT engines
 
     Returns
     -------
     conv_result : ndarray
         The result of the computed convolution
+    input_matrix : ndarray
+        The inputs in column form (only if return_columns is True).
+        With the WINOGRAD and FFT engines, these are the transformed inputs
     """
+    if CONV_ENGINE == 'WINOGRAD' and winograd_supported(kernel.shape, stride):
+        return winograd_convolve_2d(inputs, kernel, padding, return_transformed=return_columns)
+    if CONV_ENGINE == 'FFT' and fft_supported(kernel.shape, stride):
+        return fft_convolve_2d(inputs, kernel, padding, return_transformed=return_columns)
 
     # Get required variables from the input shape
     n_images, n_channels, input_h, input_w = inputs.shape
@@ -116,19 +131,27 @@ def fast_convolve_2d(inputs, kernel, padding=0, stride=1):
     out_w = int((input_w + 2 * padding - kernel_w) / stride) + 1
 
     # Transform to matrix
-    input_matrix = im2col(inputs, kernel_h, kernel_w, stride, padding)
+    with profile('im2col'):
+        input_matrix = __im2col(inputs, kernel_h, kernel_w, stride, padding, workspace)
 
     # Reshape the kernel based on the number of channels
     # (e.g.: one channel = one row in the resulting matrix)
     kernel_matrix = kernel.reshape((out_channels, -1))
 
     # perform the matrix multiplication that emulates the convolution
-    conv_matrix = kernel_matrix @ input_matrix
-
-    # reshape to the expected shape after the convolution
-    conv_result = np.array(np.hsplit(conv_matrix, n_images))
-    conv_result = conv_result.reshape((n_images, out_channels, out_h, out_w))
-
+    with profile('gemm', flops=2 * kernel_matrix.size * input_matrix.shape[1]):
+        conv_matrix = np.matmul(kernel_matrix, input_matrix,
+                                out=get_buffer(workspace, 'output', (out_channels, input_matrix.shape[1]),
+                                               inputs.dtype))
+
+    # reshape to the expected shape after the convolution.
+    # The columns of conv_matrix are ordered by (image, output row, output column), so
+    # (out_channels, n_images, out_h, out_w) is just a view: swapping the first two axes
+    # gives the expected layout without copying any data.
+    conv_result = conv_matrix.reshape((out_channels, n_images, out_h, out_w)).transpose(1, 0, 2, 3)
+
+    if return_columns:
+        return conv_result, input_matrix
     return conv_result
 
 
@@ -171,7 +194,7 @@ def convolution_backprop(X, kernel, gradient_values, padding=0, stride=1):
     kernel_w = kernel.shape[3]
 
     # Initializing dW with the expected shape
-    dW = np.zeros(kernel.shape)
+    dW = np.zeros(kernel.shape, dtype=kernel.dtype)
 
     # Cycle all the inputs in the batch.
     # For simplicity, refer to inputs as images.
@@ -279,12 +302,13 @@ def convolution_backprop(X, kernel, gradient_values, padding=0, stride=1):
                                     filter_idx, ch, kernel_h_idx, kernel_w_idx]
 
     # Remove the padding from the final result if required
-    dX = dx_padded[:, :, padding:dX.shape[2], padding:dX.shape[3]]
+    dX = dx_padded[:, :, padding:padding + dX.shape[2], padding:padding + dX.shape[3]]
 
     return dW, dX
 
 
-def fast_convolution_backprop(inputs, kernel, gradient_values, padding=0, stride=1):
+def fast_convolution_backprop(inputs, kernel, gradient_values, padding=0, stride=1, input_columns=None,
+                              workspace=None, input_gradient=True, reuse_columns=False):
     """
     Compute the FAST version of the backpropagation through a
     convolutional layer
@@ -302,6 +326,18 @@ def fast_convolution_backprop(inputs, kernel, gradient_values, padding=0, stride
         The possible padding applied to the inputs
     stride: int, optional
         The stride applied for the convolution operation
+    input_columns: ndarray, optional
+        The im2col matrix of the inputs (or the transformed inputs with the
+        WINOGRAD and FFT engines), as returned by fast_convolve_2d.
+        If not given, it is computed again from the inputs
+    workspace: Workspace, optional
+        Arena providing the buffers of the temporaries and of the results.
+        Not used by the WINOGRAD and FFT engines
+    input_gradient: bool, optional
+        If False, dX is not needed (e.g.: first layer of the network) and None is returned
+    reuse_columns: bool, optional
+        If True, input_columns are not needed after this call, and their memory
+        is reused for the gradients WRT the columns (only with the IM2COL engine)
 
     Returns
     -------
@@ -310,27 +346,31 @@ def fast_convolution_backprop(inputs, kernel, gradient_values, padding=0, stride
     dX : ndarray
         The derivative computed WRT the inputs
     """
+    if CONV_ENGINE == 'WINOGRAD' and winograd_supported(kernel.shape, stride):
+        dW, dX = winograd_convolution_backprop(inputs, kernel, gradient_values, padding, input_tiles=input_columns)
+        return dW, dX if input_gradient else None
+    if CONV_ENGINE == 'FFT' and fft_supported(kernel.shape, stride):
+        dW, dX = fft_convolution_backprop(inputs, kernel, gradient_values, padding, inputs_freq=input_columns)
+        return dW, dX if input_gradient else None
+
     # Get required variables from the kernel shape
     out_channels, in_channels, kernel_h, kernel_w = kernel.shape
 
-    # Get required variables from the inputs
-    n_inputs, _, _, _ = inputs.shape
-
-    # Transform the inputs in to plain matrices
-    X_col = im2col(inputs, kernel_h, kernel_w, stride, padding)
+    # Transform the inputs in to plain matrices (if not already done during the forward pass)
+    if input_columns is None:
+        with profile('im2col'):
+            X_col = __im2col(inputs, kernel_h, kernel_w, stride, padding, workspace)
+    else:
+        X_col = input_columns
     # Flat the kernel
     w_col = kernel.reshape((out_channels, -1))
 
-    # Reshape dout properly.
-    # (Number of images * Number of channels), (gradient height * gradient width)
-    dout = gradient_values.reshape(gradient_values.shape[0] * gradient_values.shape[1],
-                                   gradient_values.shape[2] * gradient_values.shape[3])
-
-    # When working with the flat version of the gradients, then we need to stack
-    # horizontally the images.
+    # Reshape dout properly: when working with the flat version of the gradients,
+    # the images must be stacked horizontally, so that each row contains one channel
+    # of all the images.
     '''
         Example:
-        The gradient have the shape(n_images=2, n_channels=2, height=2, width=3)
+        The gradient have the shape(n_images=2, n_channels=2, height=2, width=2)
         
         [
             [ # image 1
@@ -343,45 +383,70 @@ def fast_convolution_backprop(inputs, kernel, gradient_values, padding=0, stride
             ]
         ] 
         
-        After the previus line of code we obtain:
+        Swap the images and channels axes (n_channels, n_images, height, width):
             [
-                [1, 2, 3, 4]        # img 1 - ch 1
-                [5, 6, 7, 8]        # img 1 - ch 2
-                [9, 10, 11, 12]     # img 2 - ch 1
-                [13, 14, 15, 16]    # img 2 - ch 2
+                [[[1, 2], [3, 4]], [[9, 10], [11, 12]]],      # channel 1
+                [[[5, 6], [7, 8]], [[13, 14], [15, 16]]]      # channel 2
             ]
         
-        Split WRT the number of images:
-            [   
-                [
-                    [1, 2, 3, 4],        
-                    [5, 6, 7, 8]
-                ],        
-                [
-                    [9, 10, 11, 12]     
-                    [13, 14, 15, 16]
-                ]    
-            ]
-        
-        Finally, stack horizontally:
+        Finally, flat everything but the channels:
                 [
                     [1, 2, 3, 4, 9, 10, 11, 12],
                     [5, 6, 7, 8, 13, 14, 15, 16]
                 ]
     '''
-    dout = np.array(np.vsplit(dout, n_inputs))
-    dout = np.concatenate(dout, axis=-1)
-
-    # Perform matrix multiplication between reshaped dout and w_col to get dX_col.
-    dX_col = w_col.T @ dout
+    gradient_values = gradient_values.transpose(1, 0, 2, 3)
+    dout = get_buffer(workspace, 'dout', (out_channels, X_col.shape[1]), gradient_values.dtype)
+    if dout is None:
+        dout = gradient_values.reshape(out_channels, -1)
+    else:
+        np.copyto(dout.reshape(gradient_values.shape), gradient_values)
 
     # Perform matrix multiplication between reshaped dout and X_col to get dW_col.
-    dw_col = dout @ X_col.T
-
-    # Reshape back to image (col2im).
-    dX = col2im(dX_col, inputs.shape, kernel_h, kernel_w, stride, padding)
+    with profile('gemm_dw', flops=2 * w_col.size * X_col.shape[1]):
+        dw_col = np.matmul(dout, X_col.T, out=get_buffer(workspace, 'dw', w_col.shape, dout.dtype))
 
     # Reshape dw_col into dw.
     dW = dw_col.reshape((dw_col.shape[0], in_channels, kernel_h, kernel_w))
 
+    if not input_gradient:
+        return dW, None
+
+    # Perform matrix multiplication between reshaped dout and w_col to get dX_col.
+    # X_col has the same shape, and it is not used anymore after dW
+    if reuse_columns and input_columns is not None:
+        dx_col_buffer = X_col
+    else:
+        dx_col_buffer = get_buffer(workspace, 'dx_cols', X_col.shape, dout.dtype)
+    with profile('gemm_dx', flops=2 * w_col.size * X_col.shape[1]):
+        dX_col = np.matmul(w_col.T, dout, out=dx_col_buffer)
+
+    # Reshape back to image (col2im).
+    with profile('col2im'):
+        dX = col2im(dX_col, inputs.shape, kernel_h, kernel_w, stride, padding,
+                    out=get_buffer(workspace, 'dx', __padded_shape(inputs.shape, padding), dout.dtype))
+
     return dW, dX
+
+
+def __im2col(inputs, kernel_h, kernel_w, stride, padding, workspace=None):
+    """
+    Transform the inputs into columns, using the buffers of the workspace (if any)
+    """
+    n_images, n_channels, input_h, input_w = inputs.shape
+    out_h = (input_h + 2 * padding - kernel_h) // stride + 1
+    out_w = (input_w + 2 * padding - kernel_w) // stride + 1
+
+    out = get_buffer(workspace, 'cols', (n_channels * kernel_h * kernel_w, n_images * out_h * out_w), inputs.dtype)
+    pad_out = get_buffer(workspace, 'padded', __padded_shape(inputs.shape, padding), inputs.dtype) \
+        if padding > 0 else None
+
+    return im2col(inputs, kernel_h, kernel_w, stride, padding, out=out, pad_out=pad_out)
+
+
+def __padded_shape(input_shape, padding):
+    """
+    Shape of the inputs after the padding
+    """
+    n_images, n_channels, input_h, input_w = input_shape
+    return n_images, n_channels, input_h + 2 * padding, input_w + 2 * padding
@@ -16,13 +16,14 @@ def cross_entropy(scores, targets):
     ce : float
         The cross entropy loss value
     """
-    # Clip values for numerical stability
-    scores = np.clip(scores, 1e-8, 1. - 1e-8)
+    # Clip values for numerical stability (1e-8 underflows to zero with float16, see DTYPE in config.py)
+    eps = max(1e-8, float(np.finfo(scores.dtype).tiny))
+    scores = np.clip(scores, eps, 1. - eps)
 
     # Number of samples
     n_predictions = scores.shape[0]
 
     # Cross entropy computation
-    ce = -np.sum(targets*np.log(scores+1e-8))/n_predictions
+    ce = -np.sum(targets*np.log(scores+eps))/n_predictions
 
     return ce
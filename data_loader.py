@@ -0,0 +1,173 @@
+import queue
+import threading
+from timeit import default_timer as timer
+
+from utils import *
+
+# Seconds between two checks of the stop request, while the prefetch queue is full
+PUT_TIMEOUT = 0.1
+
+
+class DataLoader:
+    """
+    Iterate over the batches of a dataset, as (images, labels, one hot labels).
+
+    Each epoch (each iteration over the loader) can use a new permutation of the
+    samples. With prefetch > 0, a background thread gathers the next batches
+    while the current one is used: NumPy releases the GIL during the copies, so
+    the gathering overlaps with the training. The time spent waiting for a batch
+    is measured, to show when the input pipeline is the bottleneck.
+
+    The dataset can stay in its raw form (e.g.: uint8 pixels, 8 times smaller
+    than float64): the images of each batch are normalized directly into a
+    DTYPE buffer. The buffers are reused, so a batch is only valid until the
+    next one is requested.
+    """
+
+    def __init__(self, images, labels, batch_size=BATCH_SIZE, shuffle=False, drop_last=False,
+                 prefetch=LOADER_PREFETCH_BATCHES, normalization=None):
+        """
+        Parameters
+        ----------
+        images : ndarray
+            The images of the dataset
+        labels : ndarray
+            The labels of the images
+        batch_size : int, optional
+            Number of samples of each batch
+        shuffle : bool, optional
+            If True, the samples are permuted at every epoch (with np.random)
+        drop_last : bool, optional
+            If True, the last batch is skipped when it is smaller than batch_size
+        prefetch : int, optional
+            Number of batches prepared in advance by the background thread (0: no thread)
+        normalization : tuple, optional
+            The mean and the std applied to the images of each batch (see normalize_images).
+            None if the images are already normalized
+        """
+        if normalization is None and not np.issubdtype(images.dtype, np.floating):
+            raise ValueError(f'Images of dtype {images.dtype} need a normalization')
+
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+        self.normalization = normalization
+
+        # Batches in use at the same time: the one being trained, the ones in the queue and the one being loaded
+        n_slots = prefetch + 2 if prefetch else 1
+        self.__image_buffers = [np.empty((batch_size,) + images.shape[1:], dtype=DTYPE) for _ in range(n_slots)]
+        self.__one_hot_buffers = [np.empty((batch_size, 10), dtype=DTYPE) for _ in range(n_slots)]
+
+        # Time spent waiting for the batches in the last epoch (s)
+        self.wait_time = 0.
+        self.__stop = None
+        self.__thread = None
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.images) // self.batch_size
+        return -(-len(self.images) // self.batch_size)
+
+    def batch_indices(self):
+        """
+        The indices of the samples of each batch of a new epoch (a new permutation if shuffle is True)
+
+        Returns
+        -------
+        batches : list
+            An array of indices for each batch
+        """
+        n_samples = len(self.images)
+        order = np.random.permutation(n_samples) if self.shuffle else np.arange(n_samples)
+        return [order[start:start + self.batch_size] for start in range(0, len(self) * self.batch_size,
+                                                                         self.batch_size)]
+
+    def __iter__(self):
+        # Drawn in the calling thread, so the sequence of np.random does not depend on the timing of the thread
+        batches = self.batch_indices()
+        self.wait_time = 0.
+
+        # A previous epoch that was not completed stops its thread, which could still write in the buffers
+        if self.__thread is not None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+
+        if not self.prefetch:
+            for indices in batches:
+                start = timer()
+                batch = self.load_batch(indices, 0)
+                self.wait_time += timer() - start
+                yield batch
+            return
+
+        stop = threading.Event()
+        prepared = queue.Queue(maxsize=self.prefetch)
+        thread = threading.Thread(target=self.__prefetch_loop, args=(batches, prepared, stop), name='data-loader',
+                                  daemon=True)
+        self.__stop = stop
+        self.__thread = thread
+        thread.start()
+
+        try:
+            for _ in batches:
+                start = timer()
+                batch = prepared.get()
+                self.wait_time += timer() - start
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+            if self.__thread is thread:
+                self.__thread = None
+
+    def load_batch(self, indices, slot=None):
+        """
+        Gather the samples of a batch, and normalize the images
+
+        Parameters
+        ----------
+        indices : ndarray
+            The indices of the samples
+        slot : int, optional
+            Index of the buffers written (None: new arrays are allocated)
+
+        Returns
+        -------
+        images : ndarray
+            The images of the batch
+        labels : ndarray
+            The labels of the batch
+        labels_one_hot_encoded : ndarray
+            The one hot encoding of the labels
+        """
+        images_out = one_hot_out = None
+        if slot is not None:
+            images_out = self.__image_buffers[slot][:len(indices)]
+            one_hot_out = self.__one_hot_buffers[slot][:len(indices)]
+
+        labels = self.labels[indices]
+        images = normalize_images(self.images[indices], self.normalization, images_out)
+        return images, labels, one_hot_encode(labels, out=one_hot_out)
+
+    def __prefetch_loop(self, batches, prepared, stop):
+        for position, indices in enumerate(batches):
+            try:
+                batch = self.load_batch(indices, position % len(self.__image_buffers))
+            except Exception as error:
+                batch = error
+
+            # Wait for a free slot, unless the epoch is stopped
+            while not stop.is_set():
+                try:
+                    prepared.put(batch, timeout=PUT_TIMEOUT)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set() or isinstance(batch, Exception):
+                return
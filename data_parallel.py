@@ -0,0 +1,287 @@
+import multiprocessing
+import os
+import traceback
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+
+from model import *
+from worker_process import config_settings, run_worker
+
+# Environment variables read by the BLAS libraries when a worker starts
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+class DataParallelTrainer:
+    """
+    Synchronous data-parallel training over worker processes.
+
+    The training set, the flat parameter vector and one gradient vector per
+    worker live in shared memory (multiprocessing.shared_memory), so each step
+    only sends the indices of the samples of the batch to the workers. Each
+    worker runs forward and compute_gradients on its shard of the batch; the
+    gradients are divided by BATCH_SIZE, so their sum is the gradient of the
+    whole batch. The optimizer update is applied once per step, by the calling
+    process, to the shared parameters that the workers read at the next step.
+    """
+
+    def __init__(self, train_images, train_labels, weights, optimizer, n_workers, normalization=None):
+        """
+        Parameters
+        ----------
+        train_images : ndarray
+            The training images (copied into shared memory, in their raw dtype)
+        train_labels : ndarray
+            The training labels (copied into shared memory)
+        weights : dict
+            The model weights. Replaced in place by views of the shared parameters
+        optimizer : dict
+            The optimizer values (see init_optimizer_dictionary). Its parameters
+            are moved into shared memory
+        n_workers : int
+            Number of worker processes
+        normalization : tuple, optional
+            The mean and the std applied by the workers to the images of each batch (see normalize_images)
+        """
+        self.n_workers = n_workers
+        self.optimizer = optimizer
+        self.__memories = []
+
+        images = _shared_copy(self.__memories, train_images)
+        labels = _shared_copy(self.__memories, train_labels)
+
+        # The weights dict (and the optimizer) keep pointing to the same values, now shared
+        parameters = _shared_copy(self.__memories, optimizer['parameters'])
+        optimizer['parameters'] = parameters
+        weights.update(unflatten_parameters(parameters, weights))
+
+        n_parameters = parameters.size
+        self.gradients = _shared_array(self.__memories, (n_workers, n_parameters), parameters.dtype)
+
+        specs = _shared_specs({'images': images, 'labels': labels, 'parameters': parameters,
+                               'gradients': self.gradients}, self.__memories)
+        shapes = {name: weights[name].shape for name in PARAMETER_NAMES}
+
+        self.__connections, self.__processes = _start_workers(
+            _worker_loop, [(specs, shapes, worker, normalization) for worker in range(n_workers)])
+
+        self.__finalizer = weakref.finalize(self, _shutdown, self.__connections, self.__processes, self.__memories)
+
+    def step(self, indices, n_weight_updates):
+        """
+        Train on a batch of the training set
+
+        Parameters
+        ----------
+        indices : ndarray
+            Indices of the samples of the batch (see DataLoader.batch_indices)
+        n_weight_updates : int
+            Number of times the weights have been updated, including this one (needed for ADAM)
+
+        Returns
+        -------
+        loss : float
+            The cross entropy loss, summed over the samples
+        acc : float
+            The number of correct predictions
+        """
+        shards = np.array_split(indices, self.n_workers)
+        workers = [worker for worker in range(self.n_workers) if len(shards[worker])]
+
+        for worker in workers:
+            self.__connections[worker].send(shards[worker])
+
+        loss = 0
+        acc = 0
+        for worker in workers:
+            try:
+                status, *result = self.__connections[worker].recv()
+            except EOFError:
+                raise RuntimeError(f'Data parallel worker {worker} died')
+            if status == 'error':
+                raise RuntimeError(f'Data parallel worker {worker} failed:\n{result[0]}')
+            loss += result[0]
+            acc += result[1]
+
+        # Sum of the gradients of the shards (each one is already divided by BATCH_SIZE)
+        gradients = self.optimizer['gradients']
+        np.copyto(gradients, self.gradients[workers[0]])
+        for worker in workers[1:]:
+            gradients += self.gradients[worker]
+
+        with profile('optimizer', flops=optimizer_flops(self.optimizer)):
+            optimizer_step(self.optimizer, n_weight_updates)
+
+        return loss, acc
+
+    def close(self, weights):
+        """
+        Stop the workers and release the shared memory.
+        The parameters are copied out of the shared memory first, so the weights stay valid
+
+        Parameters
+        ----------
+        weights : dict
+            The model weights. Replaced in place by views of the copied parameters
+        """
+        parameters = self.optimizer['parameters'].copy()
+        self.optimizer['parameters'] = parameters
+        weights.update(unflatten_parameters(parameters, weights))
+
+        # No view of the shared memory can be left, or it cannot be closed
+        del self.gradients
+        self.__finalizer()
+
+
+def _worker_loop(connection, specs, shapes, worker, normalization):
+    """
+    Body of a worker process: attach the shared memory and train on the shards received
+    """
+    memories, arrays = _attach_shared(specs)
+
+    __train_shards(connection, arrays, shapes, worker, normalization)
+
+    # All the views of the shared memory are gone with __train_shards
+    del arrays
+    for memory in memories:
+        memory.close()
+
+
+def __train_shards(connection, arrays, shapes, worker, normalization):
+    """
+    Compute the gradients of the shards received by a worker, until None is received
+    """
+    shape_weights = {name: shape_only(shape, arrays['parameters'].dtype) for name, shape in shapes.items()}
+    weights = unflatten_parameters(arrays['parameters'], shape_weights)
+    gradients = unflatten_parameters(arrays['gradients'][worker], shape_weights)
+    workspace = Workspace()
+
+    while True:
+        indices = connection.recv()
+        if indices is None:
+            break
+
+        try:
+            input_data = normalize_images(arrays['images'][indices], normalization)
+            input_labels = arrays['labels'][indices]
+            input_labels_one_hot_encoded = one_hot_encode(input_labels)
+
+            scores, cache, loss, acc = forward(input_data, input_labels, input_labels_one_hot_encoded, weights,
+                                               workspace)
+            compute_gradients(input_data, input_labels_one_hot_encoded, scores, cache, weights, gradients,
+                              workspace)
+            connection.send(('ok', float(loss), float(acc)))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+
+
+def _shared_array(memories, shape, dtype):
+    """
+    Allocate an array in a new block of shared memory (appended to memories)
+    """
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    memory = SharedMemory(create=True, size=max(size, 1))
+    memories.append(memory)
+    return np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _shared_copy(memories, array):
+    """
+    Copy an array into a new block of shared memory (appended to memories)
+    """
+    shared = _shared_array(memories, array.shape, array.dtype)
+    np.copyto(shared, array)
+    return shared
+
+
+def _shared_specs(arrays, memories):
+    """
+    What a worker needs to attach the shared arrays: name of the memory, shape and type of each array.
+    memories are the blocks of the arrays, in the same order
+    """
+    return {name: (memory.name, array.shape, array.dtype.str)
+            for (name, array), memory in zip(arrays.items(), memories)}
+
+
+def _attach_shared(specs):
+    """
+    Attach the shared arrays described by _shared_specs (in a worker process)
+
+    Returns
+    -------
+    memories : list
+        The attached blocks, to close when the arrays are gone
+    arrays : dict
+        The shared arrays
+    """
+    memories = []
+    arrays = {}
+    for name, (memory_name, shape, dtype) in specs.items():
+        # The workers share the resource tracker of the creator, which unlinks the memory
+        memory = SharedMemory(name=memory_name)
+        memories.append(memory)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+    return memories, arrays
+
+
+def _start_workers(target, worker_arguments):
+    """
+    Start a worker process for each tuple of arguments, running target(connection, *arguments)
+
+    Returns
+    -------
+    connections : list
+        The pipe to each worker
+    processes : list
+        The worker processes
+    """
+    # Every worker gets an equal share of the cores for its BLAS threads
+    blas_threads = str(max(1, available_cores() // len(worker_arguments)))
+    environment = {name: os.environ.get(name) for name in BLAS_THREAD_VARIABLES}
+    for name, value in environment.items():
+        os.environ[name] = value or blas_threads
+
+    # spawn: the workers do not inherit the threads of this process (e.g.: BLAS, intra-op pool).
+    # They import config.py again, and get the settings of this process (see run_worker)
+    context = multiprocessing.get_context('spawn')
+    settings = config_settings()
+    connections = []
+    processes = []
+    try:
+        for arguments in worker_arguments:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_worker, args=(settings, (target.__module__, target.__name__),
+                                                               worker_connection) + tuple(arguments), daemon=True)
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            processes.append(process)
+    finally:
+        for name, value in environment.items():
+            if value is None:
+                del os.environ[name]
+
+    return connections, processes
+
+
+def _shutdown(connections, processes, memories):
+    """
+    Stop the workers and release the shared memory (see DataParallelTrainer.close)
+    """
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+    for connection in connections:
+        connection.close()
+    for memory in memories:
+        try:
+            memory.close()
+        except BufferError:
+            # Views of the memory are still alive: it is released with them
+            pass
+        memory.unlink()
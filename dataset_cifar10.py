@@ -4,8 +4,15 @@ import tarfile
 import urllib.request
 import numpy as np
 import ssl
+from config import *
 ssl._create_default_https_context = ssl._create_unverified_context
 
+# Preprocessed dataset, in the dataset directory (see Cifar10.create_cache)
+CACHE_DIRECTORY = 'cache'
+CACHE_IMAGES = 'images.npy'
+CACHE_LABELS = 'labels.npy'
+CACHE_STATS = 'stats.npz'
+
 
 class Cifar10:
     """
@@ -14,11 +21,18 @@ class Cifar10:
 
     def __init__(self):
 
-        self.train_images = None
-        self.test_images = None
+        # Memory-mapped images (uint8) and labels of the preprocessed dataset
+        self.images = None
+        self.labels = None
+        # Mean and std of the train (also used by the validation) and of the test images, applied to each
+        # batch by the DataLoader
+        self.train_normalization = None
+        self.test_normalization = None
+        # Indices of the train and validation images (the test images are the last 10000)
+        self.train_indices = None
+        self.validation_indices = None
         self.train_labels = None
         self.test_labels = None
-        self.validation_images = None
         self.validation_labels = None
 
         self.classes = (
@@ -33,7 +47,11 @@ class Cifar10:
 
         dataset_path = self.create_dataset_path()
 
-        self.download_dataset(dataset_path)
+        # The batch files are only needed once, to create the preprocessed dataset
+        if not os.path.isfile(os.path.join(dataset_path, CACHE_DIRECTORY, CACHE_STATS)):
+            self.download_dataset(dataset_path)
+            print('Preprocessing Cifar 10...')
+            self.create_cache(dataset_path)
 
         self.process_dataset(dataset_path)
 
@@ -83,6 +101,42 @@ class Cifar10:
                 safe_extract(tar_object, dataset_path)
 
     def process_dataset(self, dataset_path):
+        """
+        Open the preprocessed dataset (see create_cache). The images are
+        memory-mapped: only the pages of the images that are used are read
+        from the disk, when a split is requested (see get_datasets). They stay
+        uint8: the normalization is applied to each batch by the DataLoader
+        """
+        cache_path = os.path.join(dataset_path, CACHE_DIRECTORY)
+        self.images = np.load(os.path.join(cache_path, CACHE_IMAGES), mmap_mode='r')
+        self.labels = np.load(os.path.join(cache_path, CACHE_LABELS), mmap_mode='r')
+        with np.load(os.path.join(cache_path, CACHE_STATS)) as stats:
+            self.train_normalization = (stats['train_mean'], stats['train_std'])
+            self.test_normalization = (stats['test_mean'], stats['test_std'])
+
+        # Shuffle the train set (the first 50000 images): only the indices are permuted,
+        # the images are gathered when a split is requested
+        permutation_indices = np.random.permutation(50000)
+
+        # Create the validation set
+        self.train_indices = permutation_indices[:45000]
+        self.validation_indices = permutation_indices[45000:]
+
+        self.train_labels = self.labels[self.train_indices]
+        self.validation_labels = self.labels[self.validation_indices]
+        self.test_labels = np.array(self.labels[50000:])
+
+    @staticmethod
+    def create_cache(dataset_path):
+        """
+        One-time conversion of the batch files to the preprocessed dataset, in
+        dataset_path/CACHE_DIRECTORY:
+        - CACHE_IMAGES: the 60000 images (train then test) as uint8, shape (60000, 3, 32, 32)
+        - CACHE_LABELS: the 60000 labels
+        - CACHE_STATS: the mean and std of each channel of the train and of the test images
+
+        The stats file is written last, so an interrupted conversion is done again by the next run
+        """
         # The tar contains some files that must be ignored
         # (e.g.: readme.html).
         # Create a list of files that must be processed for
@@ -97,8 +151,8 @@ class Cifar10:
         ]
         # There are 60000 images. Each image is 3x32x32 = 3072
         # There are 60000 labels
-        images = np.zeros(shape=(60000, 3, 32, 32))
-        labels = np.zeros(shape=(60000,), dtype=np.int)
+        images = np.zeros(shape=(60000, 3, 32, 32), dtype=np.uint8)
+        labels = np.zeros(shape=(60000,), dtype=int)
         # Process each file and append images and labels to the
         # correct array
         for idx, file_name in enumerate(expected_files):
@@ -109,41 +163,28 @@ class Cifar10:
                 file_images = dictionary.get(b'data')
                 file_labels = dictionary.get(b'labels')
 
-                # file_images = file_images / 255
-                # file_images = (file_images - 0.5) / 0.5
                 file_images = file_images.reshape(10000, 3, 32, 32)
 
                 images[idx * 10000:10000 * (idx + 1)] = file_images
                 labels[idx * 10000:10000 * (idx + 1)] = file_labels
-        # Split into train and test
-        self.train_images, self.test_images = images[:50000], images[50000:]
-        self.train_labels, self.test_labels = labels[:50000], labels[50000:]
-
-        # Check if class are balanced
-        # unique, counts = np.unique(self.train_labels, return_counts=True)
-        # a = dict(zip(unique, counts))
-
-        # Shuffle the train set
-        # np.random.seed(12)
-        permutation_indices = np.random.permutation(len(self.train_images))
-        self.train_images = self.train_images[permutation_indices]
-        self.train_labels = self.train_labels[permutation_indices]
-
-        # Normalize with mean and std
-        mean_train = self.train_images.mean(axis=(0, 2, 3), keepdims=True)
-        std_train = self.train_images.std(axis=(0, 2, 3), keepdims=True)
-        self.train_images = (self.train_images - mean_train) / std_train
-
-        mean_test = self.test_images.mean(axis=(0, 2, 3), keepdims=True)
-        std_test = self.test_images.std(axis=(0, 2, 3), keepdims=True)
-        self.test_images = (self.test_images - mean_test) / std_test
-
-        # Create the validation set
-        self.validation_images = self.train_images[45000:]
-        self.validation_labels = self.train_labels[45000:]
 
-        self.train_images = self.train_images[:45000]
-        self.train_labels = self.train_labels[:45000]
+        # Normalization stats, computed in float64 (the train and the validation sets use the train stats)
+        stats = {}
+        for split, split_images in (('train', images[:50000]), ('test', images[50000:])):
+            stats[f'{split}_mean'] = split_images.mean(axis=(0, 2, 3), dtype=np.float64, keepdims=True)
+            stats[f'{split}_std'] = split_images.std(axis=(0, 2, 3), dtype=np.float64, keepdims=True)
+
+        cache_path = os.path.join(dataset_path, CACHE_DIRECTORY)
+        os.makedirs(cache_path, exist_ok=True)
+        for file_name, content in ((CACHE_IMAGES, images), (CACHE_LABELS, labels), (CACHE_STATS, stats)):
+            # Written to a temporary file first: a file of the cache is either complete or missing
+            file = os.path.join(cache_path, file_name)
+            with open(file + '.tmp', 'wb') as fo:
+                if isinstance(content, dict):
+                    np.savez(fo, **content)
+                else:
+                    np.save(fo, content)
+            os.replace(file + '.tmp', file)
 
     @staticmethod
     def __download_progress(block_num, block_size, total_size):
@@ -153,13 +194,13 @@ class Cifar10:
 
     def get_small_datasets(self):
         return \
-            self.train_images[:500], self.train_labels[:500], \
-            self.validation_images[:100], self.validation_labels[:100], \
-            self.test_images, self.test_labels
+            self.images[self.train_indices[:500]], self.train_labels[:500], \
+            self.images[self.validation_indices[:100]], self.validation_labels[:100], \
+            self.images[50000:], self.test_labels
             #self.test_images[:100], self.test_labels[:100]
 
     def get_datasets(self):
         return \
-            self.train_images, self.train_labels, \
-            self.validation_images, self.validation_labels, \
-            self.test_images, self.test_labels
+            self.images[self.train_indices], self.train_labels, \
+            self.images[self.validation_indices], self.validation_labels, \
+            self.images[50000:], self.test_labels
@@ -15,6 +15,9 @@ class Mnist:
         self.test_labels = None
         self.validation_images = None
         self.validation_labels = None
+        # The images stay uint8: (images / 255 - 0.5) / 0.5 is applied to each batch by the DataLoader
+        self.train_normalization = (np.full((1, 1, 1, 1), 127.5), np.full((1, 1, 1, 1), 127.5))
+        self.test_normalization = self.train_normalization
 
         self.classes = (
             '0', '1', '2', '3',
@@ -30,13 +33,9 @@ class Mnist:
     def process_dataset(self):
         (trainX, trainy), (testX, testy) = mnist.load_data()
         self.train_images = np.expand_dims(trainX, axis=1)
-        self.train_images = self.train_images / 255
-        self.train_images = (self.train_images - 0.5) / 0.5
         self.train_labels = trainy
 
         self.test_images = np.expand_dims(testX, axis=1)
-        self.test_images = self.test_images / 255
-        self.test_images = (self.test_images - 0.5) / 0.5
         self.test_labels = testy
 
         # Shuffle the train set
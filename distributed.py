@@ -0,0 +1,391 @@
+import queue
+import socket
+import threading
+import time
+from timeit import default_timer as timer
+
+from model import *
+
+# Seconds to wait for the other ranks while the ring is being connected
+CONNECT_TIMEOUT = 60
+
+
+def ring_addresses(world_size, hosts=DISTRIBUTED_HOSTS, base_port=DISTRIBUTED_BASE_PORT):
+    """
+    Addresses of the ranks of the ring
+
+    Parameters
+    ----------
+    world_size : int
+        Number of ranks
+    hosts : string, optional
+        Comma separated host:port of every rank (see DISTRIBUTED_HOSTS in config.py).
+        If empty, all the ranks run on localhost, on consecutive ports from base_port
+    base_port : int, optional
+        Port of rank 0 when hosts is empty
+
+    Returns
+    -------
+    addresses : list
+        (host, port) of each rank
+    """
+    if not hosts:
+        return [('127.0.0.1', base_port + rank) for rank in range(world_size)]
+
+    addresses = []
+    for address in hosts.split(','):
+        host, port = address.strip().rsplit(':', 1)
+        addresses.append((host, int(port)))
+    if len(addresses) != world_size:
+        raise ValueError(f'{len(addresses)} addresses given for {world_size} ranks (see DISTRIBUTED_HOSTS)')
+    return addresses
+
+
+class RingAllReduce:
+    """
+    Collective operations over a ring of TCP connections: each rank sends
+    to the next rank and receives from the previous one.
+    The all-reduce is the bandwidth-optimal ring algorithm: a reduce-scatter
+    followed by an all-gather, 2 * (world_size - 1) steps each moving
+    1 / world_size of the vector.
+    """
+
+    def __init__(self, rank, world_size, addresses, timeout=CONNECT_TIMEOUT):
+        """
+        Parameters
+        ----------
+        rank : int
+            Rank of this process (from 0 to world_size - 1)
+        world_size : int
+            Number of ranks
+        addresses : list
+            (host, port) of each rank (see ring_addresses)
+        timeout : float, optional
+            Seconds to wait for the other ranks
+        """
+        self.rank = rank
+        self.world_size = world_size
+        self.bytes_sent = 0
+        self.__buffer = np.empty(0, dtype=np.uint8)
+
+        if world_size == 1:
+            return
+
+        # Listen first, so the previous rank can connect while this one connects to the next
+        listener = socket.create_server(('', addresses[rank][1]))
+        listener.settimeout(timeout)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.__next = socket.create_connection(addresses[(rank + 1) % world_size], timeout=timeout)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        self.__previous, _ = listener.accept()
+        listener.close()
+
+        for connection in (self.__next, self.__previous):
+            connection.settimeout(None)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # Sends run on their own thread, so that the receives of the same step
+        # can proceed (all the ranks send at the same time)
+        self.__sends = queue.Queue()
+        self.__send_error = None
+        threading.Thread(target=self.__send_loop, name='ring-send', daemon=True).start()
+
+    def all_reduce(self, vector):
+        """
+        Sum a contiguous vector over all the ranks, in place.
+        Every rank receives exactly the same result
+
+        Parameters
+        ----------
+        vector : ndarray
+            1d contiguous array, with the same size and type on all the ranks
+
+        Returns
+        -------
+        vector : ndarray
+            The summed vector
+        """
+        if self.world_size == 1:
+            return vector
+
+        chunks = np.array_split(vector, self.world_size)
+        incoming = self.__get_buffer(chunks[0].nbytes).view(vector.dtype)
+
+        # Reduce-scatter: after it, each rank holds the total of one chunk
+        for step in range(self.world_size - 1):
+            send_chunk = chunks[(self.rank - step) % self.world_size]
+            receive_chunk = chunks[(self.rank - step - 1) % self.world_size]
+            self.__exchange(send_chunk, incoming[:receive_chunk.size])
+            receive_chunk += incoming[:receive_chunk.size]
+
+        # All-gather: the totals go around the ring
+        for step in range(self.world_size - 1):
+            send_chunk = chunks[(self.rank - step + 1) % self.world_size]
+            receive_chunk = chunks[(self.rank - step) % self.world_size]
+            self.__exchange(send_chunk, receive_chunk)
+
+        return vector
+
+    def broadcast(self, vector, root=0):
+        """
+        Copy the vector of the root rank to all the ranks, in place
+
+        Parameters
+        ----------
+        vector : ndarray
+            1d contiguous array, with the same size and type on all the ranks
+        root : int, optional
+            The rank whose values are sent
+
+        Returns
+        -------
+        vector : ndarray
+            The vector of the root rank
+        """
+        if self.world_size == 1:
+            return vector
+
+        if self.rank != root:
+            self.__receive(vector)
+        # The last rank of the ring does not send back to the root
+        if (self.rank + 1) % self.world_size != root:
+            self.__send(vector)
+            self.__wait_sends()
+
+        return vector
+
+    def close(self):
+        """
+        Close the connections of the ring
+        """
+        if self.world_size == 1:
+            return
+
+        self.__sends.put(None)
+        self.__next.close()
+        self.__previous.close()
+
+    def __exchange(self, send_chunk, receive_chunk):
+        self.__send(send_chunk)
+        self.__receive(receive_chunk)
+        self.__wait_sends()
+
+    def __send(self, array):
+        self.__sends.put(memoryview(array).cast('B'))
+        self.bytes_sent += array.nbytes
+
+    def __wait_sends(self):
+        # The sent chunk must not be modified before it is out
+        self.__sends.join()
+        if self.__send_error is not None:
+            raise ConnectionError('Ring send failed') from self.__send_error
+
+    def __receive(self, array):
+        view = memoryview(array).cast('B')
+        while view.nbytes:
+            n_bytes = self.__previous.recv_into(view)
+            if n_bytes == 0:
+                raise ConnectionError('Ring connection closed by the previous rank')
+            view = view[n_bytes:]
+
+    def __send_loop(self):
+        while True:
+            data = self.__sends.get()
+            if data is None:
+                return
+            try:
+                self.__next.sendall(data)
+            except OSError as error:
+                self.__send_error = error
+            finally:
+                self.__sends.task_done()
+
+    def __get_buffer(self, n_bytes):
+        if self.__buffer.nbytes < n_bytes:
+            self.__buffer = np.empty(n_bytes, dtype=np.uint8)
+        return self.__buffer[:n_bytes]
+
+
+class DistributedTrainer:
+    """
+    Distributed data parallel training: each rank trains on its own shard of
+    the data, and the gradients are averaged with a ring all-reduce.
+
+    The all-reduce runs on a communication thread, one layer at a time, as soon
+    as compute_gradients reports the gradients of a layer as ready (fc2 first),
+    so the communication overlaps with the backward pass of the earlier layers.
+    Every rank then applies the same optimizer update to the same weights.
+    """
+
+    def __init__(self, weights, optimizer, rank=DISTRIBUTED_RANK, world_size=DISTRIBUTED_WORLD_SIZE,
+                 addresses=None, workspace=None):
+        """
+        Parameters
+        ----------
+        weights : dict
+            The model weights. The weights of rank 0 are copied to all the ranks
+        optimizer : dict
+            The optimizer values (see init_optimizer_dictionary)
+        rank : int, optional
+            Rank of this process
+        world_size : int, optional
+            Number of ranks
+        addresses : list, optional
+            (host, port) of each rank. By default, from DISTRIBUTED_HOSTS (see ring_addresses)
+        workspace : Workspace, optional
+            Arena providing the buffers of the temporaries
+        """
+        self.rank = rank
+        self.world_size = world_size
+        self.weights = weights
+        self.optimizer = optimizer
+        self.workspace = workspace
+        self.ring = RingAllReduce(rank, world_size, addresses or ring_addresses(world_size))
+
+        # All the ranks start from the same weights
+        self.ring.broadcast(optimizer['parameters'])
+
+        # Position of each weight inside the flat gradient vector
+        self.__offsets = {}
+        offset = 0
+        for name in PARAMETER_NAMES:
+            self.__offsets[name] = (offset, offset + weights[name].size)
+            offset += weights[name].size
+
+        self.__segments = queue.Queue()
+        self.__comm_error = None
+        self.__stats = {'compute_time': 0., 'communication_time': 0., 'exposed_communication_time': 0.}
+        threading.Thread(target=self.__communication_loop, name='ring-all-reduce', daemon=True).start()
+
+    def shard(self, images, labels):
+        """
+        The shard of the data of this rank. All the shards have the same size,
+        so that all the ranks run the same number of steps
+
+        Parameters
+        ----------
+        images : ndarray
+            The images (in the same order on all the ranks)
+        labels : ndarray
+            The labels
+
+        Returns
+        -------
+        images : ndarray
+            The images of this rank
+        labels : ndarray
+            The labels of this rank
+        """
+        shard_size = len(images) // self.world_size
+        start = self.rank * shard_size
+        return images[start:start + shard_size], labels[start:start + shard_size]
+
+    def step(self, input_data, input_labels, input_labels_one_hot_encoded, n_weight_updates):
+        """
+        Train on a batch of the shard of this rank
+
+        Parameters
+        ----------
+        input_data : ndarray
+            The input images
+        input_labels : ndarray
+            The labels of the images
+        input_labels_one_hot_encoded : ndarray
+            The one hot encoding of the labels
+        n_weight_updates : int
+            Number of times the weights have been updated, including this one (needed for ADAM)
+
+        Returns
+        -------
+        loss : float
+            The cross entropy loss, summed over the samples of this rank
+        acc : float
+            The number of correct predictions of this rank
+        """
+        start = timer()
+        scores, cache, loss, acc = forward(input_data, input_labels, input_labels_one_hot_encoded, self.weights,
+                                           self.workspace)
+        compute_gradients(input_data, input_labels_one_hot_encoded, scores, cache, self.weights,
+                          self.optimizer['weight_gradients'], self.workspace, gradient_ready=self.__gradient_ready)
+        backward_end = timer()
+
+        # Wait for the all-reduce of the last layers
+        self.__segments.join()
+        if self.__comm_error is not None:
+            raise ConnectionError('Gradient all-reduce failed') from self.__comm_error
+        communication_end = timer()
+
+        # Sum -> average over the ranks
+        self.optimizer['gradients'] /= self.world_size
+        with profile('optimizer', flops=optimizer_flops(self.optimizer)):
+            optimizer_step(self.optimizer, n_weight_updates)
+
+        self.__stats['compute_time'] += backward_end - start + timer() - communication_end
+        self.__stats['exposed_communication_time'] += communication_end - backward_end
+
+        return loss, acc
+
+    def reduce_metrics(self, *values):
+        """
+        Sum some values (e.g.: loss, accuracy, samples) over all the ranks
+
+        Returns
+        -------
+        totals : list
+            The sums, in the same order
+        """
+        totals = np.array(values, dtype=np.float64)
+        self.ring.all_reduce(totals)
+        return totals.tolist()
+
+    def end_epoch(self):
+        """
+        Communication and compute times of the epoch (then reset)
+
+        Returns
+        -------
+        stats : dict
+            - compute_time: forward, backward and optimizer step (s)
+            - communication_time: time spent in the all-reduce, mostly overlapped with backward (s)
+            - exposed_communication_time: time the training waited for the all-reduce (s)
+            - bytes_sent: bytes sent by this rank
+        """
+        stats = dict(self.__stats, bytes_sent=self.ring.bytes_sent)
+        self.__stats = dict.fromkeys(self.__stats, 0.)
+        self.ring.bytes_sent = 0
+        return stats
+
+    def close(self):
+        """
+        Stop the communication thread and close the ring
+        """
+        self.__segments.put(None)
+        self.ring.close()
+
+    def __gradient_ready(self, names):
+        # The weights of a layer are contiguous in the flat vector
+        start = min(self.__offsets[name][0] for name in names)
+        stop = max(self.__offsets[name][1] for name in names)
+        self.__segments.put(self.optimizer['gradients'][start:stop])
+
+    def __communication_loop(self):
+        while True:
+            segment = self.__segments.get()
+            if segment is None:
+                return
+            try:
+                start = timer()
+                self.ring.all_reduce(segment)
+                self.__stats['communication_time'] += timer() - start
+            except Exception as error:
+                self.__comm_error = error
+            finally:
+                self.__segments.task_done()
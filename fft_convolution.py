@@ -0,0 +1,165 @@
+from utils import *
+
+
+def fft_supported(kernel_shape, stride=1):
+    """
+    Check if a convolution can be computed in the frequency domain
+
+    Parameters
+    ----------
+    kernel_shape : tuple
+        Shape of the kernel of the convolutional layer
+    stride: int, optional
+        The stride applied for the convolution operation
+
+    Returns
+    -------
+    supported : bool
+        True if the stride is 1 (any kernel size is supported)
+    """
+    return stride == 1
+
+
+def fft_convolve_2d(inputs, kernel, padding=0, return_transformed=False):
+    """
+    Compute the convolution in the frequency domain.
+
+    The (padded) inputs and the kernel are transformed with a real FFT of the
+    same size of the padded inputs, so the circular correlation computed by
+    the FFT never wraps around on the valid output positions.
+    The cost does not depend on the kernel size, which makes this engine
+    convenient for large kernels and large images.
+    Only stride 1 is supported.
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+    padding: int, optional
+        The possible padding applied to the inputs
+    return_transformed: bool, optional
+        If True, the transformed inputs are returned as well,
+        so that they can be reused by fft_convolution_backprop
+
+    Returns
+    -------
+    conv_result : ndarray
+        The result of the computed convolution
+    inputs_freq : ndarray
+        The transformed inputs (only if return_transformed is True)
+    """
+    n_images, _, input_h, input_w = inputs.shape
+    out_channels, in_channels, kernel_h, kernel_w = kernel.shape
+
+    fft_shape = (input_h + 2 * padding, input_w + 2 * padding)
+    out_h = fft_shape[0] - kernel_h + 1
+    out_w = fft_shape[1] - kernel_w + 1
+
+    # Frequencies first: (n_frequencies, N, C)
+    inputs_freq = __transform_inputs(inputs, padding, fft_shape)
+
+    # (n_frequencies, C, F)
+    kernel_freq = np.fft.rfft2(kernel, s=fft_shape).reshape(out_channels, in_channels, -1).transpose(2, 1, 0)
+
+    # Correlation theorem: the correlation becomes a product with the conjugate of the kernel.
+    # The sum over the input channels is a matrix multiplication for each frequency.
+    result_freq = np.matmul(inputs_freq, np.conj(kernel_freq))
+
+    # Back to the spatial domain (N, F, H, W) and keep only the valid positions
+    result_freq = result_freq.transpose(1, 2, 0).reshape(n_images, out_channels, fft_shape[0], -1)
+    conv_result = np.fft.irfft2(result_freq, s=fft_shape)[:, :, :out_h, :out_w]
+    conv_result = conv_result.astype(inputs.dtype, copy=False)
+
+    if return_transformed:
+        return conv_result, inputs_freq
+    return conv_result
+
+
+def fft_convolution_backprop(inputs, kernel, gradient_values, padding=0, inputs_freq=None):
+    """
+    Compute the backpropagation through a convolutional layer in the frequency domain.
+
+    - dW is the correlation between the inputs and the gradients
+    - dX is the full convolution between the gradients and the kernel
+    Both fit in the same FFT size used during the forward pass.
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+    gradient_values : ndarray
+        The gradients that are flowing back from following layers
+        through the backpropagation algorithm
+    padding: int, optional
+        The possible padding applied to the inputs
+    inputs_freq: ndarray, optional
+        The transformed inputs, as returned by fft_convolve_2d.
+        If not given, they are computed again from the inputs
+
+    Returns
+    -------
+    dW : ndarray
+        The derivative computed WRT the weights
+    dX : ndarray
+        The derivative computed WRT the inputs
+    """
+    n_images, _, input_h, input_w = inputs.shape
+    out_channels, in_channels, kernel_h, kernel_w = kernel.shape
+
+    fft_shape = (input_h + 2 * padding, input_w + 2 * padding)
+
+    if inputs_freq is None:
+        inputs_freq = __transform_inputs(inputs, padding, fft_shape)
+
+    # (n_frequencies, N, F)
+    gradient_freq = np.fft.rfft2(gradient_values, s=fft_shape).reshape(n_images, out_channels, -1).transpose(2, 0, 1)
+
+    # (n_frequencies, F, C)
+    kernel_freq = np.fft.rfft2(kernel, s=fft_shape).reshape(out_channels, in_channels, -1).transpose(2, 0, 1)
+
+    # dW: correlation between inputs and gradients, summed over the images -> (n_frequencies, F, C)
+    dw_freq = np.matmul(np.conj(gradient_freq).transpose(0, 2, 1), inputs_freq)
+    dw_freq = dw_freq.transpose(1, 2, 0).reshape(out_channels, in_channels, fft_shape[0], -1)
+    dW = np.fft.irfft2(dw_freq, s=fft_shape)[:, :, :kernel_h, :kernel_w]
+
+    # dX: full convolution between gradients and kernel, summed over the filters -> (n_frequencies, N, C)
+    dx_freq = np.matmul(gradient_freq, kernel_freq)
+    dx_freq = dx_freq.transpose(1, 2, 0).reshape(n_images, in_channels, fft_shape[0], -1)
+    dX = np.fft.irfft2(dx_freq, s=fft_shape)
+
+    # Remove the padding
+    dX = dX[:, :, padding:padding + input_h, padding:padding + input_w]
+
+    return dW.astype(kernel.dtype, copy=False), dX.astype(inputs.dtype, copy=False)
+
+
+def __transform_inputs(inputs, padding, fft_shape):
+    """
+    Pad the inputs and compute their real FFT
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    padding: int
+        The padding applied to the inputs
+    fft_shape: tuple
+        Size of the transform (e.g.: the size of the padded inputs)
+
+    Returns
+    -------
+    inputs_freq : ndarray
+        The transformed inputs with shape (n_frequencies, N, C)
+    """
+    n_images, n_channels, _, _ = inputs.shape
+
+    if padding > 0:
+        inputs = np.pad(inputs, ((0, 0), (0, 0), (padding, padding), (padding, padding)), mode='constant')
+
+    inputs_freq = np.fft.rfft2(inputs, s=fft_shape)
+
+    return inputs_freq.reshape(n_images, n_channels, -1).transpose(2, 0, 1)
@@ -0,0 +1,517 @@
+from conv_relu_pool import *
+from cross_entropy import cross_entropy
+from flatten import flatten
+from relu import ReLU, dReLU
+from softmax import softmax
+
+
+# ################################################################################
+# LAYERS
+# ################################################################################
+class Layer:
+    """
+    Node of a ModelGraph: it reads the tensors named in inputs and produces
+    a single tensor, with the same name of the layer.
+
+    The flags tell the graph which tensors are needed by backward, so that
+    all the others can be released as soon as they are consumed:
+    - keeps_inputs: the inputs are needed by backward
+    - keeps_output: the output is needed by backward
+    - in_place: forward can overwrite its input, if nobody else needs it
+
+    weight_names lists the weights of the layer, whose gradients backward writes.
+    """
+    keeps_inputs = False
+    keeps_output = False
+    in_place = False
+    weight_names = ()
+
+    def __init__(self, name, inputs=None):
+        """
+        Parameters
+        ----------
+        name : string
+            Name of the layer (and of its output tensor)
+        inputs : list, optional
+            Names of the input tensors. By default, the output of the previous layer
+        """
+        self.name = name
+        self.inputs = inputs
+
+    def forward(self, inputs, weights, overwrite=False):
+        """
+        Compute the output of the layer
+
+        Parameters
+        ----------
+        inputs : list
+            The input tensors
+        weights : dict
+            The model weights
+        overwrite : bool, optional
+            True if the first input can be overwritten (see in_place)
+
+        Returns
+        -------
+        output : ndarray
+            The output of the layer
+        context : dict
+            Values needed by backward, other than the inputs and the output
+        """
+        raise NotImplementedError
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        """
+        Compute the gradients WRT the inputs and the weights of the layer.
+        The gradient received belongs to the layer, so it can be overwritten
+
+        Parameters
+        ----------
+        gradient : ndarray
+            The gradient WRT the output of the layer
+        inputs : list
+            The input tensors (None if not kept, see keeps_inputs)
+        output : ndarray
+            The output tensor (None if not kept, see keeps_output)
+        context : dict
+            The values returned by forward
+        weights : dict
+            The model weights
+        gradients : dict
+            Where the gradients WRT the weights are written (same names and shapes of the weights)
+        input_gradient : bool, optional
+            False if the gradients WRT the inputs are not needed
+
+        Returns
+        -------
+        input_gradients : list
+            The gradients WRT the inputs (None if input_gradient is False)
+        """
+        raise NotImplementedError
+
+    def flops(self, input_shapes, weights):
+        """
+        Floating point operations of forward (used by the profiler).
+        Backward computes the same products for the weights, and again for the inputs
+
+        Parameters
+        ----------
+        input_shapes : list
+            The shapes of the input tensors
+        weights : dict
+            The model weights
+
+        Returns
+        -------
+        flops : int
+            The number of floating point operations (0 if negligible)
+        """
+        return 0
+
+
+class Conv2DLayer(Layer):
+    """
+    Convolutional layer (without bias).
+    fast_conv and cache_columns default to USE_FAST_CONV and CACHE_CONV_COLUMNS
+    """
+
+    def __init__(self, name, weight_name, padding=0, fast_conv=None, cache_columns=None, inputs=None):
+        super().__init__(name, inputs)
+        self.weight_name = weight_name
+        self.weight_names = (weight_name,)
+        self.padding = padding
+        self.fast_conv = USE_FAST_CONV if fast_conv is None else fast_conv
+        self.cache_columns = self.fast_conv and (CACHE_CONV_COLUMNS if cache_columns is None else cache_columns)
+
+        # The cached im2col matrix replaces the inputs in backward
+        self.keeps_inputs = not self.cache_columns
+
+    def forward(self, inputs, weights, overwrite=False):
+        images = inputs[0]
+        kernel = weights[self.weight_name]
+
+        if not self.fast_conv:
+            return convolve_2d(images, kernel, padding=self.padding), {}
+
+        if not self.cache_columns:
+            return fast_convolve_2d(images, kernel, padding=self.padding), {}
+
+        output, columns = fast_convolve_2d(images, kernel, padding=self.padding, return_columns=True)
+        return output, {'columns': columns, 'input_shape': images.shape, 'dtype': images.dtype}
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        kernel = weights[self.weight_name]
+
+        if not self.fast_conv:
+            dW, dX = convolution_backprop(inputs[0], kernel, gradient, padding=self.padding)
+        else:
+            images = inputs[0] if self.keeps_inputs else shape_only(context['input_shape'], context['dtype'])
+            dW, dX = fast_convolution_backprop(images, kernel, gradient, padding=self.padding,
+                                               input_columns=context.pop('columns', None),
+                                               input_gradient=input_gradient, reuse_columns=True)
+
+        np.copyto(gradients[self.weight_name], dW)
+        return [dX]
+
+    def flops(self, input_shapes, weights):
+        return conv_flops(input_shapes[0], weights[self.weight_name].shape, self.padding)
+
+
+class ReLULayer(Layer):
+    """
+    Rectified linear unit. The derivative only needs the sign of the output
+    """
+    keeps_output = True
+    in_place = True
+
+    def forward(self, inputs, weights, overwrite=False):
+        return ReLU(inputs[0], out=inputs[0] if overwrite else None), {}
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        return [np.multiply(gradient, dReLU(output), out=gradient)]
+
+
+class MaxPoolLayer(Layer):
+    """
+    Maxpooling layer with square windows.
+    fast_pool defaults to USE_FAST_CONV
+    """
+
+    def __init__(self, name, pool_size=2, stride=2, fast_pool=None, inputs=None):
+        super().__init__(name, inputs)
+        self.pool_size = pool_size
+        self.stride = stride
+        self.fast_pool = USE_FAST_CONV if fast_pool is None else fast_pool
+
+    def forward(self, inputs, weights, overwrite=False):
+        images = inputs[0]
+
+        if self.fast_pool:
+            output, positions = fast_max_pool(images, self.stride, self.pool_size, self.pool_size)
+        else:
+            output, positions = max_pool(images, self.stride, self.pool_size, self.pool_size)
+
+        return output, {'positions': positions, 'input_shape': images.shape}
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        if self.fast_pool:
+            dX = fast_maxpool_backprop(gradient, context['input_shape'], context['positions'],
+                                       stride=self.stride, max_pool_size=self.pool_size)
+        else:
+            dX = maxpool_backprop(gradient, context['positions'], context['input_shape'])
+
+        return [dX]
+
+
+class ConvReLUPoolLayer(Layer):
+    """
+    Convolution + ReLU + maxpooling with non-overlapping windows, computed as
+    a single block (see fast_conv_relu_pool). The output is needed by backward
+    for the derivative of the ReLU. cache_columns defaults to CACHE_CONV_COLUMNS
+    """
+    keeps_output = True
+
+    def __init__(self, name, weight_name, padding=0, pool_size=2, cache_columns=None, inputs=None):
+        super().__init__(name, inputs)
+        self.weight_name = weight_name
+        self.weight_names = (weight_name,)
+        self.padding = padding
+        self.pool_size = pool_size
+        self.cache_columns = CACHE_CONV_COLUMNS if cache_columns is None else cache_columns
+
+        # The cached im2col matrix replaces the inputs in backward
+        self.keeps_inputs = not self.cache_columns
+
+    def forward(self, inputs, weights, overwrite=False):
+        images = inputs[0]
+        kernel = weights[self.weight_name]
+
+        if not self.cache_columns:
+            output, positions = fast_conv_relu_pool(images, kernel, self.padding, self.pool_size)
+            return output, {'positions': positions}
+
+        output, positions, columns = fast_conv_relu_pool(images, kernel, self.padding, self.pool_size,
+                                                         return_columns=True)
+        return output, {'positions': positions, 'columns': columns, 'input_shape': images.shape,
+                        'dtype': images.dtype}
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        images = inputs[0] if self.keeps_inputs else shape_only(context['input_shape'], context['dtype'])
+
+        dW, dX = fast_conv_relu_pool_backprop(images, weights[self.weight_name], gradient, output,
+                                              context['positions'], self.padding, self.pool_size,
+                                              input_columns=context.pop('columns', None),
+                                              input_gradient=input_gradient, reuse_columns=True)
+
+        np.copyto(gradients[self.weight_name], dW)
+        return [dX]
+
+    def flops(self, input_shapes, weights):
+        return conv_flops(input_shapes[0], weights[self.weight_name].shape, self.padding)
+
+
+class FlattenLayer(Layer):
+    """
+    Flat the values coming from a convolutional layer
+    """
+
+    def forward(self, inputs, weights, overwrite=False):
+        return flatten(inputs[0]), {'input_shape': inputs[0].shape}
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        return [gradient.reshape(context['input_shape'])]
+
+
+class DenseLayer(Layer):
+    """
+    Fully connected layer
+    """
+    keeps_inputs = True
+
+    def __init__(self, name, weight_name, bias_name, inputs=None):
+        super().__init__(name, inputs)
+        self.weight_name = weight_name
+        self.bias_name = bias_name
+        self.weight_names = (weight_name, bias_name)
+
+    def forward(self, inputs, weights, overwrite=False):
+        output = np.matmul(inputs[0], weights[self.weight_name])
+        output += weights[self.bias_name]
+        return output, {}
+
+    def backward(self, gradient, inputs, output, context, weights, gradients, input_gradient=True):
+        np.matmul(inputs[0].T, gradient, out=gradients[self.weight_name])
+        np.sum(gradient, axis=0, keepdims=True, out=gradients[self.bias_name])
+
+        if not input_gradient:
+            return [None]
+        return [(weights[self.weight_name] @ gradient.T).T]
+
+    def flops(self, input_shapes, weights):
+        return dense_flops(input_shapes[0][0], *weights[self.weight_name].shape)
+
+
+def shape_only(shape, dtype):
+    """
+    Array without memory that only carries a shape and a type.
+    Used in place of the inputs of a layer when backward only needs their shape
+    (e.g.: when the im2col matrix has been cached)
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the array
+    dtype : dtype
+        The type of the array
+
+    Returns
+    -------
+    array : ndarray
+        A read-only broadcast view of a single element
+    """
+    return np.broadcast_to(np.zeros((), dtype=dtype), shape)
+
+
+# ################################################################################
+# GRAPH EXECUTOR
+# ################################################################################
+class ModelGraph:
+    """
+    Graph of layers, followed by the softmax and the cross entropy loss.
+
+    The backward pass is derived from the layers, so a new architecture only
+    needs a new list of layers. The lifetime of each tensor is computed once
+    (see __plan): a tensor is released right after its last use, that is
+    - after the forward of its last consumer, if no layer needs it in backward
+    - after the backward of the last layer (in backward order) that needs it.
+    The same holds for the values saved by the layers and for the gradients,
+    so during backward the memory goes down layer after layer, instead of
+    keeping every intermediate until the whole backward is finished.
+    """
+    INPUT = 'input'
+
+    def __init__(self, layers):
+        """
+        Parameters
+        ----------
+        layers : list
+            The layers, in execution order (see Layer)
+        """
+        self.layers = layers
+
+        previous = self.INPUT
+        for layer in layers:
+            if layer.inputs is None:
+                layer.inputs = [previous]
+            previous = layer.name
+
+        self.output = previous
+        self.__plan()
+
+    def __plan(self):
+        """
+        Liveness analysis: find when every tensor can be released
+        """
+        n_layers = len(self.layers)
+        consumers = {}
+        keepers = {}
+
+        for idx, layer in enumerate(self.layers):
+            for name in layer.inputs:
+                consumers.setdefault(name, []).append(idx)
+                if layer.keeps_inputs:
+                    keepers.setdefault(name, []).append(idx)
+            if layer.keeps_output:
+                keepers.setdefault(layer.name, []).append(idx)
+
+        # The output of the graph is consumed by the loss
+        consumers.setdefault(self.output, []).append(n_layers)
+        self.__kept = set(keepers)
+
+        # Tensors released after the forward of each layer: during inference all of them,
+        # during training only the ones not needed by backward
+        self.inference_release = [[] for _ in range(n_layers)]
+        self.training_release = [[] for _ in range(n_layers)]
+        # Tensors released after the backward of each layer
+        self.backward_release = [[] for _ in range(n_layers)]
+
+        for name, users in consumers.items():
+            last_use = max(users)
+            if last_use < n_layers:
+                self.inference_release[last_use].append(name)
+                if name not in keepers:
+                    self.training_release[last_use].append(name)
+            if name in keepers:
+                self.backward_release[min(keepers[name])].append(name)
+
+        # Layers that can overwrite their input: the input is not needed by anyone else,
+        # and it is not the data of the caller
+        self.inference_in_place = [self.__can_overwrite(idx, consumers, {}) for idx in range(n_layers)]
+        self.training_in_place = [self.__can_overwrite(idx, consumers, keepers) for idx in range(n_layers)]
+
+    def __can_overwrite(self, idx, consumers, keepers):
+        layer = self.layers[idx]
+        name = layer.inputs[0]
+        return layer.in_place and name != self.INPUT and consumers[name] == [idx] and name not in keepers
+
+    def forward(self, input_data, input_labels, input_labels_one_hot_encoded, weights, training=True):
+        """
+        Compute the forward pass
+
+        Parameters
+        ----------
+        input_data : ndarray
+            The input images
+        input_labels : ndarray
+            The labels of the images
+        input_labels_one_hot_encoded : ndarray
+            The one hot encoding of the labels
+        weights : dict
+            The model weights
+        training : bool, optional
+            If False, nothing is kept for the backward pass
+
+        Returns
+        -------
+        scores : ndarray
+            The scores computed by the softmax
+        state : dict
+            The tensors and the values kept for the backward pass
+        loss : float
+            The cross entropy loss, summed over the samples
+        acc : float
+            The number of correct predictions
+        """
+        n_samples = input_data.shape[0]
+        check_dtype('input_data', input_data)
+
+        release = self.training_release if training else self.inference_release
+        in_place = self.training_in_place if training else self.inference_in_place
+
+        tensors = {self.INPUT: input_data}
+        contexts = []
+        flops = []
+
+        for idx, layer in enumerate(self.layers):
+            inputs = [tensors[name] for name in layer.inputs]
+            flops.append(layer.flops([tensor.shape for tensor in inputs], weights))
+            with profile(layer.name, flops=flops[idx]):
+                tensors[layer.name], context = layer.forward(inputs, weights, overwrite=in_place[idx])
+            del inputs
+
+            contexts.append(context if training else None)
+            for name in release[idx]:
+                del tensors[name]
+
+        # The raw outputs are overwritten by the scores, unless backward needs them
+        with profile('softmax'):
+            if self.output in self.__kept:
+                scores = softmax(tensors[self.output])
+            else:
+                logits = tensors.pop(self.output)
+                scores = softmax(logits, out=logits)
+        check_dtype('scores', scores)
+
+        with profile('loss'):
+            loss = cross_entropy(scores, input_labels_one_hot_encoded) * n_samples
+            acc = accuracy(scores, input_labels) * n_samples
+
+        state = {'tensors': tensors, 'contexts': contexts, 'flops': flops}
+        return scores, state, loss, acc
+
+    def backward(self, scores, input_labels_one_hot_encoded, state, weights, gradients, gradient_ready=None):
+        """
+        Compute the backward pass, releasing the values as soon as they are consumed
+
+        Parameters
+        ----------
+        scores : ndarray
+            The scores returned by forward
+        input_labels_one_hot_encoded : ndarray
+            The one hot encoding of the labels
+        state : dict
+            The state returned by forward (it is emptied)
+        weights : dict
+            The model weights
+        gradients : dict
+            Where the gradients WRT the weights are written (same names and shapes of the weights)
+        gradient_ready : function, optional
+            Called as gradient_ready(layer.weight_names) when the gradients of a layer are written
+        """
+        tensors = state['tensors']
+        contexts = state['contexts']
+        flops = state['flops']
+
+        # Softmax + cross entropy
+        # https://stats.stackexchange.com/questions/183840/sum-or-average-of-gradients-in-mini-batch-gradient-decent/183990
+        output_gradients = {self.output: (scores - input_labels_one_hot_encoded) / BATCH_SIZE}
+
+        for idx in range(len(self.layers) - 1, -1, -1):
+            layer = self.layers[idx]
+            gradient = output_gradients.pop(layer.name)
+            needs_input_gradient = any(name != self.INPUT for name in layer.inputs)
+
+            inputs = [tensors.get(name) for name in layer.inputs] if layer.keeps_inputs else None
+            output = tensors.get(layer.name) if layer.keeps_output else None
+
+            with profile(layer.name, flops=flops[idx] * (2 if needs_input_gradient else 1)):
+                input_gradients = layer.backward(gradient, inputs, output, contexts[idx], weights, gradients,
+                                                 needs_input_gradient)
+            del gradient, inputs, output
+            contexts[idx] = None
+
+            if layer.weight_names and gradient_ready is not None:
+                gradient_ready(layer.weight_names)
+
+            for name in self.backward_release[idx]:
+                del tensors[name]
+
+            for name, input_gradient in zip(layer.inputs, input_gradients):
+                if name == self.INPUT:
+                    continue
+                check_dtype(f'gradient of {name}', input_gradient)
+                if name in output_gradients:
+                    # Tensor consumed by more than one layer
+                    output_gradients[name] = output_gradients[name] + input_gradient
+                else:
+                    output_gradients[name] = input_gradient
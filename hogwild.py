@@ -0,0 +1,213 @@
+import traceback
+import weakref
+from timeit import default_timer as timer
+
+from data_parallel import _attach_shared, _shared_array, _shared_copy, _shared_specs, _shutdown, _start_workers
+from model import *
+
+
+class HogwildTrainer:
+    """
+    Asynchronous, lock-free data-parallel training (Hogwild!).
+
+    The training set and the flat parameter vector live in shared memory.
+    Each worker process trains on its own batches with the usual forward and
+    backward, and its optimizer step writes the shared parameters in place,
+    without any lock: the other workers may read the weights while they are
+    being updated, and compute their gradients on weights that are already
+    a few updates old. Each worker keeps its own optimizer moments.
+
+    The staleness of an update is the number of updates that the other
+    workers applied between the read of the weights (start of forward) and
+    the write of the update. Each worker counts its own updates in its slot of
+    a shared vector, so the counters need no lock either.
+    """
+
+    def __init__(self, train_images, train_labels, weights, optimizer, n_workers, normalization=None):
+        """
+        Parameters
+        ----------
+        train_images : ndarray
+            The training images (copied into shared memory, in their raw dtype)
+        train_labels : ndarray
+            The training labels (copied into shared memory)
+        weights : dict
+            The model weights. Replaced in place by views of the shared parameters
+        optimizer : dict
+            The optimizer values (see init_optimizer_dictionary). Its parameters
+            are moved into shared memory
+        n_workers : int
+            Number of worker processes
+        normalization : tuple, optional
+            The mean and the std applied by the workers to the images of each batch (see normalize_images)
+        """
+        self.n_workers = n_workers
+        self.optimizer = optimizer
+        self.__memories = []
+
+        images = _shared_copy(self.__memories, train_images)
+        labels = _shared_copy(self.__memories, train_labels)
+
+        # The weights dict (and the optimizer) keep pointing to the same values, now shared
+        parameters = _shared_copy(self.__memories, optimizer['parameters'])
+        optimizer['parameters'] = parameters
+        weights.update(unflatten_parameters(parameters, weights))
+
+        # Number of updates applied by each worker
+        self.updates = _shared_array(self.__memories, (n_workers,), np.int64)
+        self.updates[...] = 0
+
+        specs = _shared_specs({'images': images, 'labels': labels, 'parameters': parameters,
+                               'updates': self.updates}, self.__memories)
+        shapes = {name: weights[name].shape for name in PARAMETER_NAMES}
+
+        self.__connections, self.__processes = _start_workers(
+            _worker_loop, [(specs, shapes, worker, normalization) for worker in range(n_workers)])
+
+        self.__finalizer = weakref.finalize(self, _shutdown, self.__connections, self.__processes, self.__memories)
+
+    def train_epoch(self, batches):
+        """
+        Train on the batches of an epoch: the batches are dealt to the workers
+        in turn, and the workers run concurrently
+
+        Parameters
+        ----------
+        batches : list
+            The indices of the samples of each batch (see DataLoader.batch_indices)
+
+        Returns
+        -------
+        loss : float
+            The cross entropy loss, summed over the samples
+        acc : float
+            The number of correct predictions
+        step_times : list
+            The time of each step (s), worker after worker
+        staleness : ndarray
+            The staleness of each update (see HogwildTrainer)
+        """
+        for worker in range(self.n_workers):
+            self.__connections[worker].send(batches[worker::self.n_workers])
+
+        loss = 0
+        acc = 0
+        step_times = []
+        staleness = []
+        for worker in range(self.n_workers):
+            try:
+                status, *result = self.__connections[worker].recv()
+            except EOFError:
+                raise RuntimeError(f'Hogwild worker {worker} died')
+            if status == 'error':
+                raise RuntimeError(f'Hogwild worker {worker} failed:\n{result[0]}')
+            loss += result[0]
+            acc += result[1]
+            step_times += result[2]
+            staleness += result[3]
+
+        return loss, acc, step_times, np.array(staleness, dtype=np.int64)
+
+    def close(self, weights):
+        """
+        Stop the workers and release the shared memory.
+        The parameters are copied out of the shared memory first, so the weights stay valid
+
+        Parameters
+        ----------
+        weights : dict
+            The model weights. Replaced in place by views of the copied parameters
+        """
+        parameters = self.optimizer['parameters'].copy()
+        self.optimizer['parameters'] = parameters
+        weights.update(unflatten_parameters(parameters, weights))
+
+        # No view of the shared memory can be left, or it cannot be closed
+        del self.updates
+        self.__finalizer()
+
+
+def staleness_stats(staleness):
+    """
+    Summary of the staleness of the updates of an epoch
+
+    Parameters
+    ----------
+    staleness : ndarray
+        The staleness of each update (see HogwildTrainer.train_epoch)
+
+    Returns
+    -------
+    stats : dict
+        mean, p50, p99 and max staleness, and the fraction of the updates computed on up-to-date weights
+    """
+    if not staleness.size:
+        return {'mean': 0., 'p50': 0., 'p99': 0., 'max': 0, 'fresh_fraction': 1.}
+    return {
+        'mean': float(staleness.mean()),
+        'p50': float(np.percentile(staleness, 50)),
+        'p99': float(np.percentile(staleness, 99)),
+        'max': int(staleness.max()),
+        'fresh_fraction': float(np.mean(staleness == 0))
+    }
+
+
+def _worker_loop(connection, specs, shapes, worker, normalization):
+    """
+    Body of a worker process: attach the shared memory and train on the batches received
+    """
+    memories, arrays = _attach_shared(specs)
+
+    __train_batches(connection, arrays, shapes, worker, normalization)
+
+    # All the views of the shared memory are gone with __train_batches
+    del arrays
+    for memory in memories:
+        memory.close()
+
+
+def __train_batches(connection, arrays, shapes, worker, normalization):
+    """
+    Train on the batches received by a worker, one epoch per message, until None is received
+    """
+    weights = {name: shape_only(shape, arrays['parameters'].dtype) for name, shape in shapes.items()}
+
+    # Private gradients and moments, shared parameters (the weights become views of them)
+    optimizer = init_optimizer_dictionary(weights, arrays['parameters'])
+    updates = arrays['updates']
+    workspace = Workspace()
+    n_weight_updates = 1
+
+    while True:
+        batches = connection.recv()
+        if batches is None:
+            break
+
+        try:
+            loss = 0
+            acc = 0
+            step_times = []
+            staleness = []
+            for indices in batches:
+                step_start = timer()
+                input_data = normalize_images(arrays['images'][indices], normalization)
+                input_labels = arrays['labels'][indices]
+                input_labels_one_hot_encoded = one_hot_encode(input_labels)
+
+                version = updates.sum()
+                scores, cache, batch_loss, batch_acc = forward(input_data, input_labels,
+                                                               input_labels_one_hot_encoded, weights, workspace)
+                backward(input_data, input_labels_one_hot_encoded, scores, cache, weights, optimizer,
+                         n_weight_updates, workspace)
+                # Updates of the other workers since the weights were read (this worker's slot did not change)
+                staleness.append(int(updates.sum() - version))
+                updates[worker] += 1
+                n_weight_updates += 1
+
+                loss += float(batch_loss)
+                acc += float(batch_acc)
+                step_times.append(timer() - step_start)
+
+            connection.send(('ok', loss, acc, step_times, staleness))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
@@ -0,0 +1,352 @@
+import argparse
+import io
+import json
+import queue
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer as timer
+
+from model import *
+
+# Number of recent requests kept for the latency percentiles
+METRICS_WINDOW = 10000
+# Values of the raw pixels, expected when the checkpoint has a normalization (see save_weights)
+RAW_PIXEL_RANGE = (0, 255)
+
+
+class _Request:
+    """
+    Images waiting for a batch, and their result once the batch is done
+    """
+
+    def __init__(self, images):
+        self.images = images
+        self.arrival = timer()
+        self.done = threading.Event()
+        self.probabilities = None
+        self.error = None
+        self.queue_time = None
+
+
+class MicroBatcher:
+    """
+    Coalesce the concurrent prediction requests into a single forward pass.
+
+    A batch starts with the oldest waiting request and closes when it holds
+    max_batch_size images, or when max_latency has passed since the arrival of
+    its first request: a lone request waits at most max_latency before running.
+    A single thread runs the batches, so the workspace buffers are reused
+    without locks.
+
+    With a normalization, the requests hold raw pixels (in RAW_PIXEL_RANGE),
+    normalized like the training batches. Without it, the images must be
+    already normalized.
+    """
+
+    def __init__(self, weights, max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                 max_latency=INFERENCE_MAX_LATENCY_MS / 1000, normalization=None):
+        """
+        Parameters
+        ----------
+        weights : dict
+            The model weights (see load_weights)
+        max_batch_size : int, optional
+            Maximum number of images of a forward pass (a larger request runs alone)
+        max_latency : float, optional
+            Maximum time (s) the first request of a batch waits for other requests
+        normalization : tuple, optional
+            The mean and the std of the raw images (see load_normalization)
+        """
+        self.weights = weights
+        self.normalization = normalization
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.input_shape = (weights['conv1_w'].shape[1],) + ((32, 32) if USE_CIFAR_10 else (28, 28))
+
+        self.__requests = queue.Queue()
+        # A request taken from the queue that did not fit in the previous batch (or the stop signal)
+        self.__deferred = []
+        self.__workspace = Workspace()
+        self.__lock = threading.Lock()
+        self.__metrics = {
+            'requests': 0,
+            'images': 0,
+            'batches': 0,
+            'batch_sizes': Counter(),
+            'queue_times': deque(maxlen=METRICS_WINDOW),
+            'latencies': deque(maxlen=METRICS_WINDOW),
+            'forward_times': deque(maxlen=METRICS_WINDOW)
+        }
+
+        self.__thread = threading.Thread(target=self.__batch_loop, name='micro-batcher', daemon=True)
+        self.__thread.start()
+
+    def predict(self, images):
+        """
+        Class probabilities of some images, computed in a batch with the concurrent requests
+
+        Parameters
+        ----------
+        images : ndarray
+            A single image (channels, height, width) or a batch of images: raw
+            pixels if the batcher has a normalization, else normalized images
+
+        Returns
+        -------
+        probabilities : ndarray
+            The probabilities of the classes, one row per image
+        """
+        images = np.asarray(images)
+        if images.shape == self.input_shape:
+            images = images[np.newaxis]
+        if images.shape[1:] != self.input_shape or not len(images):
+            raise ValueError(f'Expected images of shape {self.input_shape}, got {images.shape}')
+        if not np.issubdtype(images.dtype, np.number):
+            raise ValueError(f'Expected numeric images, got {images.dtype}')
+
+        if self.normalization is None:
+            # Raw pixels would give wrong predictions without any error
+            if not np.issubdtype(images.dtype, np.floating):
+                raise ValueError(f'Expected normalized float images, got {images.dtype}: the checkpoint has no '
+                                 f'normalization to apply to raw pixels')
+            images = images.astype(DTYPE, copy=False)
+        else:
+            if images.min() < RAW_PIXEL_RANGE[0] or images.max() > RAW_PIXEL_RANGE[1]:
+                raise ValueError(f'Expected raw pixels in {list(RAW_PIXEL_RANGE)}, got values in '
+                                 f'[{images.min()}, {images.max()}]')
+            images = normalize_images(images, self.normalization)
+
+        request = _Request(images)
+        self.__requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+        latency = timer() - request.arrival
+        with self.__lock:
+            self.__metrics['requests'] += 1
+            self.__metrics['queue_times'].append(request.queue_time)
+            self.__metrics['latencies'].append(latency)
+        return request.probabilities
+
+    def metrics(self):
+        """
+        Statistics of the requests served so far (the times on the last METRICS_WINDOW requests)
+
+        Returns
+        -------
+        metrics : dict
+            - requests, images, batches: counts
+            - mean_batch_size and batch_sizes: number of batches of each size
+            - queue_ms: p50/p99 time from the arrival of a request to the start of its batch
+            - latency_ms: p50/p99 time from the arrival of a request to its result
+            - forward_ms: p50/p99 time of the forward passes
+        """
+        with self.__lock:
+            metrics = dict(self.__metrics)
+            queue_times = np.array(metrics['queue_times']) * 1000
+            latencies = np.array(metrics['latencies']) * 1000
+            forward_times = np.array(metrics['forward_times']) * 1000
+            batch_sizes = dict(sorted(metrics['batch_sizes'].items()))
+
+        def percentiles(times):
+            if not times.size:
+                return {'p50': None, 'p99': None}
+            return {'p50': float(np.percentile(times, 50)), 'p99': float(np.percentile(times, 99))}
+
+        return {
+            'requests': metrics['requests'],
+            'images': metrics['images'],
+            'batches': metrics['batches'],
+            'mean_batch_size': metrics['images'] / metrics['batches'] if metrics['batches'] else None,
+            'batch_sizes': batch_sizes,
+            'queue_ms': percentiles(queue_times),
+            'latency_ms': percentiles(latencies),
+            'forward_ms': percentiles(forward_times)
+        }
+
+    def close(self):
+        """
+        Stop the batching thread (the pending requests are served first)
+        """
+        self.__requests.put(None)
+        self.__thread.join()
+
+    def __next_batch(self):
+        """
+        Wait for a request, then collect the following ones until the batch is full or its deadline passes
+        """
+        first = self.__deferred.pop() if self.__deferred else self.__requests.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        n_images = len(first.images)
+        deadline = first.arrival + self.max_latency
+        while n_images < self.max_batch_size:
+            try:
+                request = self.__requests.get(timeout=max(0., deadline - timer()))
+            except queue.Empty:
+                break
+            if request is None or n_images + len(request.images) > self.max_batch_size:
+                # Served by the next batch (None stops the loop after it)
+                self.__deferred.append(request)
+                break
+            batch.append(request)
+            n_images += len(request.images)
+        return batch
+
+    def __batch_loop(self):
+        while True:
+            batch = self.__next_batch()
+            if batch is None:
+                return
+
+            start = timer()
+            n_images = sum(len(request.images) for request in batch)
+            for request in batch:
+                request.queue_time = start - request.arrival
+            try:
+                images = np.concatenate([request.images for request in batch]) if len(batch) > 1 \
+                    else batch[0].images
+                probabilities = predict(images, self.weights, self.__workspace)
+
+                offset = 0
+                for request in batch:
+                    # Copied out of the workspace, which is overwritten by the next batch
+                    request.probabilities = probabilities[offset:offset + len(request.images)].copy()
+                    offset += len(request.images)
+            except Exception as error:
+                for request in batch:
+                    request.error = error
+            end = timer()
+
+            with self.__lock:
+                self.__metrics['images'] += n_images
+                self.__metrics['batches'] += 1
+                self.__metrics['batch_sizes'][n_images] += 1
+                self.__metrics['forward_times'].append(end - start)
+
+            for request in batch:
+                request.done.set()
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the inference server:
+    - POST /predict: images as a .npy file (Content-Type: application/x-npy) or as
+      JSON ({"images": [...]}), one image or a batch. Raw pixels if the checkpoint
+      has a normalization, else normalized images (see MicroBatcher). Answers
+      with the predicted classes and the probabilities of the classes
+    - GET /metrics: the statistics of the server (see MicroBatcher.metrics)
+    - GET /health
+    """
+    # Set by serve
+    batcher = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.__send_json(200, self.batcher.metrics())
+        elif self.path == '/health':
+            self.__send_json(200, {'status': 'ok'})
+        else:
+            self.__send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.__send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Type') == 'application/x-npy':
+                images = np.load(io.BytesIO(body), allow_pickle=False)
+            else:
+                content = json.loads(body)
+                if not isinstance(content, dict) or 'images' not in content:
+                    raise ValueError('The JSON body must contain "images"')
+                images = np.array(content['images'])
+            probabilities = self.batcher.predict(images)
+        except (ValueError, TypeError) as error:
+            self.__send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            self.__send_json(500, {'error': repr(error)})
+            return
+
+        self.__send_json(200, {'predictions': np.argmax(probabilities, axis=1).tolist(),
+                               'probabilities': probabilities.tolist()})
+
+    def log_message(self, format, *args):
+        # One line per request would slow down the server
+        pass
+
+    def __send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(weights_path, host=INFERENCE_HOST, port=INFERENCE_PORT, max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+          max_latency=INFERENCE_MAX_LATENCY_MS / 1000):
+    """
+    Load a checkpoint (and its normalization, if any) and create the HTTP inference server
+    (see InferenceRequestHandler)
+
+    Parameters
+    ----------
+    weights_path : string
+        The path of the checkpoint (see save_weights)
+    host : string, optional
+        Address the server listens on
+    port : int, optional
+        Port the server listens on (0: any free port)
+    max_batch_size : int, optional
+        Maximum number of images of a forward pass (see MicroBatcher)
+    max_latency : float, optional
+        Maximum time (s) a request waits for other requests (see MicroBatcher)
+
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        The server (not started: call serve_forever). Its batcher is in server.batcher
+    """
+    weights, _ = load_weights(weights_path)
+    batcher = MicroBatcher(weights, max_batch_size, max_latency, load_normalization(weights_path))
+
+    # Each server has its own handler class, bound to its batcher
+    handler = type('BoundInferenceRequestHandler', (InferenceRequestHandler,), {'batcher': batcher})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP inference server with deadline-based micro-batching')
+    parser.add_argument('--weights', default=TRAIN_WEIGHTS_PATH, help='checkpoint directory (see save_weights)')
+    parser.add_argument('--host', default=INFERENCE_HOST)
+    parser.add_argument('--port', type=int, default=INFERENCE_PORT)
+    parser.add_argument('--max-batch-size', type=int, default=INFERENCE_MAX_BATCH_SIZE)
+    parser.add_argument('--max-latency-ms', type=float, default=INFERENCE_MAX_LATENCY_MS)
+    args = parser.parse_args()
+
+    server = serve(args.weights, args.host, args.port, args.max_batch_size, args.max_latency_ms / 1000)
+    print(f'Serving {args.weights} on http://{args.host}:{server.server_address[1]} '
+          f'(max batch {args.max_batch_size}, max latency {args.max_latency_ms} ms)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        print(json.dumps(server.batcher.metrics(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
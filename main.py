@@ -20,7 +20,7 @@ def main():
 
     # TRAIN + VALIDATION
     train_model(train_images, train_labels,
-                validation_images, validation_labels, EPOCHS)
+                validation_images, validation_labels, EPOCHS, dataset.train_normalization)
 
     # TRAIN (on full train set)
     # Load the number of epochs obtained after running the model on train
@@ -32,10 +32,11 @@ def main():
 
     train_model(np.concatenate((train_images, validation_images)),
                 np.concatenate((train_labels, validation_labels)),
-                None, None, epochs[0])
+                None, None, epochs[0], dataset.train_normalization)
 
     # TEST
-    test_model(TRAIN_WEIGHTS_PATH, test_images, test_labels, dataset.classes)
+    test_model(TRAIN_WEIGHTS_PATH, test_images, test_labels, dataset.classes,
+               normalization=dataset.test_normalization)
 
     # PLOT RESULTS
     show_result_plots()
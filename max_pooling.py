@@ -40,7 +40,7 @@ def max_pool(input_images, stride=2, filter_h=2, filter_w=2, padding=0):
         input_images.shape[1],
         output_h,
         output_w
-    ))
+    ), dtype=input_images.dtype)
 
     pos_result = []
 
@@ -88,7 +88,7 @@ def __process_single_image(image, stride, output_h, output_w, filter_h, filter_w
         image.shape[0],
         output_h,
         output_w
-    ))
+    ), dtype=image.dtype)
 
     pos_vector = []
 
@@ -137,7 +137,7 @@ def __process_single_image(image, stride, output_h, output_w, filter_h, filter_w
     return maxpool_result, pos_vector
 
 
-def fast_max_pool(inputs, stride=2, kernel_h=2, kernel_w=2, padding=0):
+def fast_max_pool(inputs, stride=2, kernel_h=2, kernel_w=2, padding=0, workspace=None, return_positions=True):
     """
     Compute the FAST version of the maxpooling operation
 
@@ -153,15 +153,23 @@ def fast_max_pool(inputs, stride=2, kernel_h=2, kernel_w=2, padding=0):
         The possible padding applied to the inputs
     stride: int, optional
         The stride applied
+    workspace: Workspace, optional
+        Arena providing the buffers of the results (only used with non-overlapping windows)
+    return_positions: bool, optional
+        If False, the positions of the maxima (only needed by the backpropagation) are not computed
 
     Returns
     -------
     max_pool_result : ndarray
         The result of the computed maxpooling operation
     pos_result : ndarray
-        The indices where the maxpooling operation has been applied
+        The indices where the maxpooling operation has been applied (only if return_positions is True)
     """
 
+    # Non-overlapping windows (e.g.: 2x2 with stride 2) do not need im2col at all
+    if non_overlapping_pool(stride, kernel_h, kernel_w, padding):
+        return fast_non_overlapping_max_pool(inputs, kernel_h, workspace, return_positions)
+
     # Get required variables from the input shape
     n_images, n_channels, input_h, input_w = inputs.shape
 
@@ -222,16 +230,17 @@ def fast_max_pool(inputs, stride=2, kernel_h=2, kernel_w=2, padding=0):
     # Perform the maxpool column wise
     max_pool_result = np.max(input_matrix, axis=1)
 
+    # Reshape to the expected shape after the max pooling operation
+    # (columns are ordered by image, so this only swaps the first two axes of a view)
+    max_pool_result = max_pool_result.reshape(n_channels, n_images, out_h, out_w).transpose(1, 0, 2, 3)
+
+    if not return_positions:
+        return max_pool_result
+
     # Get the indices where the maximum values have been found
     # NOTE: this is required during the backpropagation)
     pos_result = np.argmax(input_matrix, axis=1)
 
-    # Add one dimension for managing the number of the images
-    max_pool_result = np.array(np.hsplit(max_pool_result, n_images))
-
-    # Reshape to the expected shape after the max pooling operation
-    max_pool_result = max_pool_result.reshape(n_images, n_channels, out_h, out_w)
-
     return max_pool_result, pos_result
 
 
@@ -255,7 +264,7 @@ def maxpool_backprop(gradient_values, pos_result, conv_shape):
         The result of the backpropagation operation
     """
 
-    delta_conv = np.zeros(conv_shape)
+    delta_conv = np.zeros(conv_shape, dtype=gradient_values.dtype)
 
     for image in range(len(pos_result)):
         indices = pos_result[image]
@@ -273,7 +282,8 @@ def maxpool_backprop(gradient_values, pos_result, conv_shape):
     return delta_conv
 
 
-def fast_maxpool_backprop(gradient_values, conv_shape, pos_result, padding=0, stride=2, max_pool_size=2):
+def fast_maxpool_backprop(gradient_values, conv_shape, pos_result, padding=0, stride=2, max_pool_size=2,
+                          workspace=None):
     """
     Compute the NAIVE backpropagation version through maxpooling layer
 
@@ -291,20 +301,23 @@ def fast_maxpool_backprop(gradient_values, conv_shape, pos_result, padding=0, st
         The stride applied
     max_pool_size : int, optional
         The kernel size
+    workspace: Workspace, optional
+        Arena providing the buffers of the results (only used with non-overlapping windows)
 
     Returns
     -------
     delta_conv : ndarray
         The result of the backpropagation operation
     """
+    if non_overlapping_pool(stride, max_pool_size, max_pool_size, padding):
+        return fast_non_overlapping_maxpool_backprop(gradient_values, conv_shape, pos_result, max_pool_size, workspace)
+
     n_channels = conv_shape[1]
 
-    bp_flattened = gradient_values.reshape(gradient_values.shape[0] * gradient_values.shape[1],
-                                           gradient_values.shape[2] * gradient_values.shape[3])
-    bp_flattened = np.array(np.vsplit(bp_flattened, conv_shape[0]))
-    bp_flattened = np.concatenate(bp_flattened, axis=-1)
+    # (n_channels, n_images * pooled height * pooled width), same layout of the im2col columns
+    bp_flattened = gradient_values.transpose(1, 0, 2, 3).reshape(n_channels, -1)
 
-    delta_conv = np.zeros(conv_shape)
+    delta_conv = np.zeros(conv_shape, dtype=gradient_values.dtype)
     delta_conv_col = im2col(delta_conv, max_pool_size, max_pool_size, stride, padding)
 
     row_coefficient = delta_conv_col.shape[0] // n_channels
@@ -322,3 +335,146 @@ def fast_maxpool_backprop(gradient_values, conv_shape, pos_result, padding=0, st
     delta_conv = col2im(delta_conv_col, conv_shape, max_pool_size, max_pool_size, stride, padding)
 
     return delta_conv
+
+
+def non_overlapping_pool(stride, kernel_h, kernel_w, padding=0):
+    """
+    Check if the maxpooling windows tile the input without overlapping
+
+    Parameters
+    ----------
+    stride: int
+        The stride applied
+    kernel_h : int
+        The height of the kernel
+    kernel_w : int
+        The width of the kernel
+    padding: int, optional
+        The possible padding applied to the inputs
+
+    Returns
+    -------
+    non_overlapping : bool
+        True if the windows are square, with stride equal to their size and no padding
+    """
+    return kernel_h == kernel_w == stride and padding == 0
+
+
+def fast_non_overlapping_max_pool(inputs, pool_size=2, workspace=None, return_positions=True):
+    """
+    Compute the maxpooling operation when the windows do not overlap
+    (e.g.: 2x2 windows with stride 2).
+
+    Reshaping the inputs to (N, C, H / pool_size, pool_size, W / pool_size, pool_size),
+    the element (i, j) of every window is inputs[:, :, i::pool_size, j::pool_size].
+    The maximum is computed element-wise over these pool_size * pool_size strided
+    views, so no copy of the inputs (e.g.: im2col) is ever made.
+    The last rows/columns that do not fill a whole window are ignored, as in
+    the im2col version (e.g.: a 5x5 input produces a 2x2 output).
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the layer
+    pool_size : int, optional
+        The size (and stride) of the windows
+    workspace: Workspace, optional
+        Arena providing the buffers of the results and of the temporaries
+    return_positions: bool, optional
+        If False, the positions of the maxima (only needed by the backpropagation) are not computed
+
+    Returns
+    -------
+    max_pool_result : ndarray
+        The result of the computed maxpooling operation
+    pos_result : ndarray
+        The position of the maximum inside each window (from 0 to pool_size * pool_size - 1),
+        with the same shape of the result (only if return_positions is True)
+    """
+    input_h, input_w = inputs.shape[2], inputs.shape[3]
+    out_h, out_w = input_h // pool_size, input_w // pool_size
+
+    # One view for each position inside the windows
+    window_values = [inputs[:, :, i:out_h * pool_size:pool_size, j:out_w * pool_size:pool_size]
+                     for i in range(pool_size) for j in range(pool_size)]
+
+    result_shape = window_values[0].shape
+
+    max_pool_result = get_array(workspace, 'output', result_shape, inputs.dtype)
+    if return_positions:
+        pos_result = get_array(workspace, 'positions', result_shape, np.uint8)
+        is_max = get_array(workspace, 'mask', result_shape, bool)
+    last_position = len(window_values) - 1
+
+    # The images are pooled in chunks by the intra-op threads
+    def pool_images(start, stop):
+        result = max_pool_result[start:stop]
+        np.copyto(result, window_values[0][start:stop])
+        for values in window_values[1:]:
+            np.maximum(result, values[start:stop], out=result)
+
+        if not return_positions:
+            return
+
+        # Position of the maximum. Going backwards, the first position holding
+        # the maximum is kept on ties, as np.argmax does.
+        positions = pos_result[start:stop]
+        positions.fill(last_position)
+        for position in range(last_position - 1, -1, -1):
+            np.equal(window_values[position][start:stop], result, out=is_max[start:stop])
+            np.putmask(positions, is_max[start:stop], position)
+
+    parallel_for(pool_images, inputs.shape[0], inputs.size)
+
+    if not return_positions:
+        return max_pool_result
+    return max_pool_result, pos_result
+
+
+def fast_non_overlapping_maxpool_backprop(gradient_values, conv_shape, pos_result, pool_size=2, workspace=None):
+    """
+    Compute the backpropagation through a maxpooling layer with non-overlapping windows.
+    Each gradient goes back to the position of the maximum of its window.
+
+    Parameters
+    ----------
+    gradient_values : ndarray
+        Gradient coming from the following layer in the network
+    conv_shape : int, optional
+        The expected output shape
+    pos_result : ndarray
+        The positions computed by fast_non_overlapping_max_pool
+    pool_size : int, optional
+        The size (and stride) of the windows
+    workspace: Workspace, optional
+        Arena providing the buffers of the result and of the temporaries
+
+    Returns
+    -------
+    delta_conv : ndarray
+        The result of the backpropagation operation
+    """
+    out_h, out_w = pos_result.shape[2], pos_result.shape[3]
+
+    # Rows/columns cropped during the forward pass keep a zero gradient
+    delta_conv = get_array(workspace, 'delta', conv_shape, gradient_values.dtype)
+    crop = workspace is None or out_h * pool_size != conv_shape[2] or out_w * pool_size != conv_shape[3]
+
+    is_max = get_array(workspace, 'mask', pos_result.shape, bool)
+
+    # The images are processed in chunks by the intra-op threads
+    def unpool_images(start, stop):
+        delta = delta_conv[start:stop]
+        if crop:
+            delta.fill(0)
+
+        mask = is_max[start:stop]
+        for position in range(pool_size * pool_size):
+            i, j = divmod(position, pool_size)
+            np.equal(pos_result[start:stop], position, out=mask)
+            np.multiply(gradient_values[start:stop], mask,
+                        out=delta[:, :, i:out_h * pool_size:pool_size, j:out_w * pool_size:pool_size])
+
+    parallel_for(unpool_images, conv_shape[0], delta_conv.size)
+
+    return delta_conv
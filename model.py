@@ -1,5 +1,8 @@
 from convolution import *
 from max_pooling import *
+from conv_relu_pool import *
+from optimizer import *
+from graph import *
 from plots.correct_incorrect_plot import correct_incorrect_plot
 from relu import ReLU, dReLU
 from softmax import *
@@ -8,44 +11,101 @@ from cross_entropy import *
 from timeit import default_timer as timer
 from dropout import *
 from flatten import flatten
+from data_loader import DataLoader
 
 
-def forward(input_data, input_labels, input_labels_one_hot_encoded, weights):
-    n_samples = input_data.shape[0]
+# Layer graphs already built, by configuration (see build_model_graph)
+__model_graphs = {}
 
-    # ********************
-    # CONV 1 + RELU
-    # ********************
-    if USE_FAST_CONV:
-        conv1_output = fast_convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING)
-    else:
-        conv1_output = convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING)
 
-    if USE_DROPOUT:
-        conv1_output = cnn_dropout(conv1_output, CONV_DROPOUT_PROBABILITY)
+@profiled('forward')
+def forward(input_data, input_labels, input_labels_one_hot_encoded, weights, workspace=None):
+    # The layer graph releases each value as soon as it is consumed, instead of using the workspace buffers
+    if USE_LAYER_GRAPH:
+        return build_model_graph().forward(input_data, input_labels, input_labels_one_hot_encoded, weights)
+
+    n_samples = input_data.shape[0]
+    check_dtype('input_data', input_data)
 
-    conv2_input = ReLU(conv1_output)
+    # The intermediate results are written into the buffers of the workspace (if any):
+    # they are valid until the next forward pass
+    conv1_workspace = get_scope(workspace, 'conv1')
+    conv2_workspace = get_scope(workspace, 'conv2')
 
     # ********************
-    # CONV 2 + RELU
+    # CONV 1 + RELU
     # ********************
-    if USE_FAST_CONV:
-        conv2_output = fast_convolve_2d(conv2_input, weights['conv2_w'], padding=CONV_PADDING)
-    else:
-        conv2_output = convolve_2d(conv2_input, weights['conv2_w'], padding=CONV_PADDING)
+    # im2col matrices kept for the backward pass (see CACHE_CONV_COLUMNS)
+    conv1_input_cols = None
+    conv2_input_cols = None
+
+    with profile('conv1', flops=conv_flops(input_data.shape, weights['conv1_w'].shape, CONV_PADDING)):
+        if USE_FAST_CONV and CACHE_CONV_COLUMNS:
+            conv1_output, conv1_input_cols = fast_convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING,
+                                                              return_columns=True, workspace=conv1_workspace)
+        elif USE_FAST_CONV:
+            conv1_output = fast_convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING,
+                                            workspace=conv1_workspace)
+        else:
+            conv1_output = convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING)
 
     if USE_DROPOUT:
-        conv2_output = cnn_dropout(conv2_output, CONV_DROPOUT_PROBABILITY)
-
-    maxpool_input = ReLU(conv2_output)
+        conv1_output = cnn_dropout(conv1_output, CONV_DROPOUT_PROBABILITY)
 
-    # ********************
-    # MAXPOOL
-    # ********************
-    if USE_FAST_CONV:
-        x_maxpool_output, pos_maxpool_pos = fast_max_pool(maxpool_input)
+    with profile('conv1_relu'):
+        conv2_input = ReLU(conv1_output,
+                           out=get_buffer(workspace, 'conv1/relu', conv1_output.shape, conv1_output.dtype))
+
+    conv2_flops = conv_flops(conv2_input.shape, weights['conv2_w'].shape, CONV_PADDING)
+
+    if __use_fused_conv_relu_pool():
+        # ********************
+        # CONV 2 + RELU + MAXPOOL (fused)
+        # ********************
+        # The full size conv2 output is never kept: only the pooled values and the
+        # positions of the maxima are needed during the backpropagation
+        conv2_output = None
+
+        with profile('conv2_relu_pool', flops=conv2_flops):
+            if CACHE_CONV_COLUMNS:
+                x_maxpool_output, pos_maxpool_pos, conv2_input_cols = \
+                    fast_conv_relu_pool(conv2_input, weights['conv2_w'], padding=CONV_PADDING, return_columns=True,
+                                        workspace=conv2_workspace)
+            else:
+                x_maxpool_output, pos_maxpool_pos = \
+                    fast_conv_relu_pool(conv2_input, weights['conv2_w'], padding=CONV_PADDING,
+                                        workspace=conv2_workspace)
     else:
-        x_maxpool_output, pos_maxpool_pos = max_pool(maxpool_input)
+        # ********************
+        # CONV 2 + RELU
+        # ********************
+        with profile('conv2', flops=conv2_flops):
+            if USE_FAST_CONV and CACHE_CONV_COLUMNS:
+                conv2_output, conv2_input_cols = fast_convolve_2d(conv2_input, weights['conv2_w'],
+                                                                  padding=CONV_PADDING, return_columns=True,
+                                                                  workspace=conv2_workspace)
+            elif USE_FAST_CONV:
+                conv2_output = fast_convolve_2d(conv2_input, weights['conv2_w'], padding=CONV_PADDING,
+                                                workspace=conv2_workspace)
+            else:
+                conv2_output = convolve_2d(conv2_input, weights['conv2_w'], padding=CONV_PADDING)
+
+        if USE_DROPOUT:
+            conv2_output = cnn_dropout(conv2_output, CONV_DROPOUT_PROBABILITY)
+
+        with profile('conv2_relu'):
+            maxpool_input = ReLU(conv2_output,
+                                 out=get_buffer(workspace, 'conv2/relu', conv2_output.shape, conv2_output.dtype))
+
+        # ********************
+        # MAXPOOL
+        # ********************
+        with profile('pool'):
+            if USE_FAST_CONV:
+                x_maxpool_output, pos_maxpool_pos = fast_max_pool(maxpool_input,
+                                                                  workspace=get_scope(workspace, 'pool'))
+            else:
+                x_maxpool_output, pos_maxpool_pos = max_pool(maxpool_input)
 
     # ********************
     # FLATTEN + FCs
@@ -53,8 +113,14 @@ def forward(input_data, input_labels, input_labels_one_hot_encoded, weights):
     fc1_input = flatten(x_maxpool_output)
 
     # First fc layer
-    fc1_output = np.matmul(fc1_input, weights['fc1_w']) + weights['fc1_b']
-    fc2_input = ReLU(fc1_output)
+    with profile('fc1', flops=dense_flops(n_samples, *weights['fc1_w'].shape)):
+        fc1_output = np.matmul(fc1_input, weights['fc1_w'],
+                               out=get_buffer(workspace, 'fc1/output', (n_samples, weights['fc1_w'].shape[1]),
+                                              fc1_input.dtype))
+        fc1_output += weights['fc1_b']
+
+    with profile('fc1_relu'):
+        fc2_input = ReLU(fc1_output, out=get_buffer(workspace, 'fc1/relu', fc1_output.shape, fc1_output.dtype))
 
     if USE_DROPOUT:
         fc2_input = dense_dropout(fc2_input, DENSE_DROPOUT_PROBABILITY)
@@ -63,16 +129,24 @@ def forward(input_data, input_labels, input_labels_one_hot_encoded, weights):
     # SCORE AND LOSS
     # ********************
     # Second fc layer
-    fc2_output = np.matmul(fc2_input, weights['fc2_w']) + weights['fc2_b']
+    with profile('fc2', flops=dense_flops(n_samples, *weights['fc2_w'].shape)):
+        fc2_output = np.matmul(fc2_input, weights['fc2_w'],
+                               out=get_buffer(workspace, 'fc2/output', (n_samples, weights['fc2_w'].shape[1]),
+                                              fc2_input.dtype))
+        fc2_output += weights['fc2_b']
+
+    # Apply the softmax for computing the scores (the raw outputs are not needed anymore)
+    with profile('softmax'):
+        scores = softmax(fc2_output, out=fc2_output)
 
-    # Apply the softmax for computing the scores
-    scores = softmax(fc2_output)
+    with profile('loss'):
+        # Compute the cross entropy loss
+        loss = cross_entropy(scores, input_labels_one_hot_encoded) * n_samples
 
-    # Compute the cross entropy loss
-    loss = cross_entropy(scores, input_labels_one_hot_encoded) * n_samples
+        # Compute prediction and accuracy
+        acc = accuracy(scores, input_labels) * n_samples
 
-    # Compute prediction and accuracy
-    acc = accuracy(scores, input_labels) * n_samples
+    check_dtype('scores', scores)
 
     # Values required during backpropagation
     cache = {
@@ -83,126 +157,348 @@ def forward(input_data, input_labels, input_labels_one_hot_encoded, weights):
         'pos_maxpool_pos': pos_maxpool_pos,
         'conv2_output': conv2_output,
         'conv2_input': conv2_input,
-        'conv1_output': conv1_output
+        'conv2_input_cols': conv2_input_cols,
+        'conv1_output': conv1_output,
+        'conv1_input_cols': conv1_input_cols
     }
 
     return scores, cache, loss, acc
 
 
-def backward(input_data, input_labels_one_hot_encoded, scores, cache, weights, optimizer, n_weight_updates):
-    # https://stats.stackexchange.com/questions/183840/sum-or-average-of-gradients-in-mini-batch-gradient-decent/183990
-    delta_2 = (scores - input_labels_one_hot_encoded) / BATCH_SIZE
-    d_fc2_w = cache['fc2_input'].T @ delta_2
-    d_fc2_b = np.sum(delta_2, axis=0, keepdims=True)
+@profiled('predict')
+def predict(input_data, weights, workspace=None, return_probabilities=True):
+    """
+    Inference-only forward pass: only the images are needed, and nothing is kept
+    for the backpropagation. The positions of the maxima of the pooling are not
+    computed, the ReLUs run in place, no dropout is applied, and neither the loss
+    nor the accuracy are computed. The layer graph (see USE_LAYER_GRAPH) is not
+    used: it only saves the memory of the values kept for backward.
+
+    Parameters
+    ----------
+    input_data : ndarray
+        The input images
+    weights : dict
+        The model weights
+    workspace: Workspace, optional
+        Arena providing the buffers of the results (valid until the next pass)
+    return_probabilities : bool, optional
+        If True, the softmax probabilities are returned, else the raw outputs of fc2 (logits)
+
+    Returns
+    -------
+    scores : ndarray
+        The probabilities (or the logits) of the classes, one row per image
+    """
+    n_samples = input_data.shape[0]
+    check_dtype('input_data', input_data)
+
+    conv1_workspace = get_scope(workspace, 'conv1')
+    conv2_workspace = get_scope(workspace, 'conv2')
 
-    delta_1 = np.multiply((weights['fc2_w'] @ delta_2.T).T, dReLU(cache['fc1_output']))
-    d_fc1_w = cache['fc1_input'].T @ delta_1
-    d_fc1_b = np.sum(delta_1, axis=0, keepdims=True)
+    # ********************
+    # CONV 1 + RELU
+    # ********************
+    with profile('conv1', flops=conv_flops(input_data.shape, weights['conv1_w'].shape, CONV_PADDING)):
+        if USE_FAST_CONV:
+            conv1_output = fast_convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING,
+                                            workspace=conv1_workspace)
+        else:
+            conv1_output = convolve_2d(input_data, weights['conv1_w'], padding=CONV_PADDING)
 
-    # gradient WRT x0
-    delta_0 = (weights['fc1_w'] @ delta_1.T).T
+    with profile('conv1_relu'):
+        conv2_input = ReLU(conv1_output, out=conv1_output)
 
-    # unflatten operation
-    delta_0_unflattened = delta_0.reshape(cache['x_maxpool_output'].shape)
+    # ********************
+    # CONV 2 + RELU + MAXPOOL
+    # ********************
+    conv2_flops = conv_flops(conv2_input.shape, weights['conv2_w'].shape, CONV_PADDING)
 
-    # gradients through the maxpool operation
-    if USE_FAST_CONV:
-        delta_maxpool = fast_maxpool_backprop(delta_0_unflattened, cache['conv2_output'].shape,
-                                              cache['pos_maxpool_pos'])
+    if USE_FAST_CONV and USE_FUSED_CONV_RELU_POOL:
+        with profile('conv2_relu_pool', flops=conv2_flops):
+            x_maxpool_output = fast_conv_relu_pool(conv2_input, weights['conv2_w'], padding=CONV_PADDING,
+                                                   workspace=conv2_workspace, return_positions=False)
     else:
-        delta_maxpool = maxpool_backprop(delta_0_unflattened, cache['pos_maxpool_pos'], cache['conv2_output'].shape)
+        with profile('conv2', flops=conv2_flops):
+            if USE_FAST_CONV:
+                conv2_output = fast_convolve_2d(conv2_input, weights['conv2_w'], padding=CONV_PADDING,
+                                                workspace=conv2_workspace)
+            else:
+                conv2_output = convolve_2d(conv2_input, weights['conv2_w'], padding=CONV_PADDING)
+
+        with profile('conv2_relu'):
+            maxpool_input = ReLU(conv2_output, out=conv2_output)
+
+        with profile('pool'):
+            if USE_FAST_CONV:
+                x_maxpool_output = fast_max_pool(maxpool_input, workspace=get_scope(workspace, 'pool'),
+                                                 return_positions=False)
+            else:
+                # The naive version always computes the positions
+                x_maxpool_output, _ = max_pool(maxpool_input)
 
-    delta_maxpool_w = np.multiply(delta_maxpool, dReLU(cache['conv2_output']))
+    # ********************
+    # FLATTEN + FCs
+    # ********************
+    fc1_input = flatten(x_maxpool_output)
 
-    if USE_FAST_CONV:
-        conv2_delta_w, conv2_delta_x = \
-            fast_convolution_backprop(cache['conv2_input'], weights['conv2_w'], delta_maxpool_w, padding=CONV_PADDING)
-    else:
-        conv2_delta_w, conv2_delta_x = \
-            convolution_backprop(cache['conv2_input'], weights['conv2_w'], delta_maxpool_w, padding=CONV_PADDING)
+    with profile('fc1', flops=dense_flops(n_samples, *weights['fc1_w'].shape)):
+        fc1_output = np.matmul(fc1_input, weights['fc1_w'],
+                               out=get_buffer(workspace, 'fc1/output', (n_samples, weights['fc1_w'].shape[1]),
+                                              fc1_input.dtype))
+        fc1_output += weights['fc1_b']
+
+    with profile('fc1_relu'):
+        fc2_input = ReLU(fc1_output, out=fc1_output)
+
+    with profile('fc2', flops=dense_flops(n_samples, *weights['fc2_w'].shape)):
+        scores = np.matmul(fc2_input, weights['fc2_w'],
+                           out=get_buffer(workspace, 'fc2/output', (n_samples, weights['fc2_w'].shape[1]),
+                                          fc2_input.dtype))
+        scores += weights['fc2_b']
+
+    if return_probabilities:
+        with profile('softmax'):
+            scores = softmax(scores, out=scores)
+
+    check_dtype('scores', scores)
+    return scores
+
+
+def build_model_graph():
+    """
+    Return the layer graph of the model (see graph.py).
+    It computes the same operations of forward and backward. The graph and
+    its liveness plan only depend on the configuration, so they are built
+    once for each configuration and then reused by every call. The settings
+    of the key are passed to the layers, which do not read their own copies
+
+    Returns
+    -------
+    graph : ModelGraph
+        The graph of the model
+    """
+    configuration = (USE_DROPOUT, USE_FAST_CONV, USE_FUSED_CONV_RELU_POOL, CACHE_CONV_COLUMNS, CONV_PADDING)
+    if configuration not in __model_graphs:
+        __model_graphs[configuration] = __new_model_graph()
+    return __model_graphs[configuration]
+
+
+def __new_model_graph():
+    """
+    Build the layer graph of the model with the current configuration
+    """
+    if USE_DROPOUT:
+        raise ValueError('The layer graph does not support the dropout (see USE_DROPOUT in config.py)')
 
-    conv2_delta_x = np.multiply(conv2_delta_x, dReLU(cache['conv1_output']))
+    layers = [
+        Conv2DLayer('conv1', 'conv1_w', padding=CONV_PADDING, fast_conv=USE_FAST_CONV,
+                    cache_columns=CACHE_CONV_COLUMNS),
+        ReLULayer('conv1_relu')
+    ]
 
-    if USE_FAST_CONV:
-        conv1_delta_w, _ = fast_convolution_backprop(input_data, weights['conv1_w'], conv2_delta_x,
-                                                     padding=CONV_PADDING)
+    if __use_fused_conv_relu_pool():
+        layers.append(ConvReLUPoolLayer('conv2_relu_pool', 'conv2_w', padding=CONV_PADDING,
+                                        cache_columns=CACHE_CONV_COLUMNS))
     else:
-        conv1_delta_w, _ = convolution_backprop(input_data, weights['conv1_w'], conv2_delta_x, padding=CONV_PADDING)
+        layers += [
+            Conv2DLayer('conv2', 'conv2_w', padding=CONV_PADDING, fast_conv=USE_FAST_CONV,
+                        cache_columns=CACHE_CONV_COLUMNS),
+            ReLULayer('conv2_relu'),
+            MaxPoolLayer('pool', fast_pool=USE_FAST_CONV)
+        ]
+
+    layers += [
+        FlattenLayer('flatten'),
+        DenseLayer('fc1', 'fc1_w', 'fc1_b'),
+        ReLULayer('fc1_relu'),
+        DenseLayer('fc2', 'fc2_w', 'fc2_b')
+    ]
+
+    return ModelGraph(layers)
+
+
+def __use_fused_conv_relu_pool():
+    """
+    The fused conv2 + ReLU + maxpool block is used with the fast implementation,
+    unless the dropout has to be applied between the convolution and the ReLU
+    """
+    return USE_FAST_CONV and USE_FUSED_CONV_RELU_POOL and not USE_DROPOUT
+
+
+@profiled('backward')
+def backward(input_data, input_labels_one_hot_encoded, scores, cache, weights, optimizer, n_weight_updates,
+             workspace=None):
+    # Views of the flat gradient vector (see init_optimizer_dictionary)
+    compute_gradients(input_data, input_labels_one_hot_encoded, scores, cache, weights,
+                      optimizer['weight_gradients'], workspace)
 
     # ********************
     # WEIGHT UPDATES
     # ********************
-    if OPTIMIZER == 'ADAM':
-        #  g(t+1) from the theory formulas
-        optimizer['momentum_w1'] = BETA1 * optimizer['momentum_w1'] + ((1 - BETA1) * d_fc1_w)
-        optimizer['momentum_w2'] = BETA1 * optimizer['momentum_w2'] + ((1 - BETA1) * d_fc2_w)
-        optimizer['momentum_b0'] = BETA1 * optimizer['momentum_b0'] + ((1 - BETA1) * d_fc1_b)
-        optimizer['momentum_b1'] = BETA1 * optimizer['momentum_b1'] + ((1 - BETA1) * d_fc2_b)
-        optimizer['momentum_conv1'] = BETA1 * optimizer['momentum_conv1'] + ((1 - BETA1) * conv1_delta_w)
-        optimizer['momentum_conv2'] = BETA1 * optimizer['momentum_conv2'] + ((1 - BETA1) * conv2_delta_w)
-
-        #  s(t+1) from the theory formulas
-        optimizer['velocity_w1'] = BETA2 * optimizer['velocity_w1'] + ((1 - BETA2) * (d_fc1_w ** 2))
-        optimizer['velocity_w2'] = BETA2 * optimizer['velocity_w2'] + ((1 - BETA2) * (d_fc2_w ** 2))
-        optimizer['velocity_b0'] = BETA2 * optimizer['velocity_b0'] + ((1 - BETA2) * (d_fc1_b ** 2))
-        optimizer['velocity_b1'] = BETA2 * optimizer['velocity_b1'] + ((1 - BETA2) * (d_fc2_b ** 2))
-        optimizer['velocity_conv1'] = BETA2 * optimizer['velocity_conv1'] + ((1 - BETA2) * (conv1_delta_w ** 2))
-        optimizer['velocity_conv2'] = BETA2 * optimizer['velocity_conv2'] + ((1 - BETA2) * (conv2_delta_w ** 2))
-
-        # Bias corrections
-        momentum_w1_corr = optimizer['momentum_w1'] / (1 - (BETA1 ** n_weight_updates))
-        momentum_w2_corr = optimizer['momentum_w2'] / (1 - (BETA1 ** n_weight_updates))
-        momentum_b0_corr = optimizer['momentum_b0'] / (1 - (BETA1 ** n_weight_updates))
-        momentum_b1_corr = optimizer['momentum_b1'] / (1 - (BETA1 ** n_weight_updates))
-        momentum_conv1_corr = optimizer['momentum_conv1'] / (1 - (BETA1 ** n_weight_updates))
-        momentum_conv2_corr = optimizer['momentum_conv2'] / (1 - (BETA1 ** n_weight_updates))
-
-        velocity_w1_corr = optimizer['velocity_w1'] / (1 - (BETA2 ** n_weight_updates))
-        velocity_w2_corr = optimizer['velocity_w2'] / (1 - (BETA2 ** n_weight_updates))
-        velocity_b0_corr = optimizer['velocity_b0'] / (1 - (BETA2 ** n_weight_updates))
-        velocity_b1_corr = optimizer['velocity_b1'] / (1 - (BETA2 ** n_weight_updates))
-        velocity_conv1_corr = optimizer['velocity_conv1'] / (1 - (BETA2 ** n_weight_updates))
-        velocity_conv2_corr = optimizer['velocity_conv2'] / (1 - (BETA2 ** n_weight_updates))
-
-        weights['conv1_w'] = weights['conv1_w'] - (
-                LEARNING_RATE * (momentum_conv1_corr / (np.sqrt(velocity_conv1_corr) + EPS)))
-        weights['conv2_w'] = weights['conv2_w'] - (
-                LEARNING_RATE * (momentum_conv2_corr / (np.sqrt(velocity_conv2_corr) + EPS)))
-        weights['fc1_w'] = weights['fc1_w'] - (LEARNING_RATE * (momentum_w1_corr / (np.sqrt(velocity_w1_corr) + EPS)))
-        weights['fc2_w'] = weights['fc2_w'] - (LEARNING_RATE * (momentum_w2_corr / (np.sqrt(velocity_w2_corr) + EPS)))
-        weights['fc1_b'] = weights['fc1_b'] - (LEARNING_RATE * (momentum_b0_corr / (np.sqrt(velocity_b0_corr) + EPS)))
-        weights['fc2_b'] = weights['fc2_b'] - (LEARNING_RATE * (momentum_b1_corr / (np.sqrt(velocity_b1_corr) + EPS)))
-
-    elif OPTIMIZER == 'MOMENTUM':
-        optimizer['velocity_w1'] = BETA1 * optimizer['velocity_w1'] - (LEARNING_RATE * d_fc1_w)
-        optimizer['velocity_w2'] = BETA1 * optimizer['velocity_w2'] - (LEARNING_RATE * d_fc2_w)
-        optimizer['velocity_b0'] = BETA1 * optimizer['velocity_b0'] - (LEARNING_RATE * d_fc1_b)
-        optimizer['velocity_b1'] = BETA1 * optimizer['velocity_b1'] - (LEARNING_RATE * d_fc2_b)
-        optimizer['velocity_conv1'] = BETA1 * optimizer['velocity_conv1'] - (LEARNING_RATE * conv1_delta_w)
-        optimizer['velocity_conv2'] = BETA1 * optimizer['velocity_conv2'] - (LEARNING_RATE * conv2_delta_w)
-
-        weights['conv1_w'] = weights['conv1_w'] + optimizer['velocity_conv1']
-        weights['conv2_w'] = weights['conv2_w'] + optimizer['velocity_conv2']
-        weights['fc1_w'] = weights['fc1_w'] + optimizer['velocity_w1']
-        weights['fc2_w'] = weights['fc2_w'] + optimizer['velocity_w2']
-        weights['fc1_b'] = weights['fc1_b'] + optimizer['velocity_b0']
-        weights['fc2_b'] = weights['fc2_b'] + optimizer['velocity_b1']
-
-    else:
-        weights['fc2_w'] = weights['fc2_w'] - LEARNING_RATE * d_fc2_w
-        weights['fc2_b'] = weights['fc2_b'] - LEARNING_RATE * d_fc2_b
+    # weights are views of optimizer['parameters'], so they are updated in place
+    with profile('optimizer', flops=optimizer_flops(optimizer)):
+        optimizer_step(optimizer, n_weight_updates)
 
-        weights['fc1_w'] = weights['fc1_w'] - LEARNING_RATE * d_fc1_w
-        weights['fc1_b'] = weights['fc1_b'] - LEARNING_RATE * d_fc1_b
+    return weights, optimizer
 
-        weights['conv1_w'] = weights['conv1_w'] - LEARNING_RATE * conv1_delta_w
-        weights['conv2_w'] = weights['conv2_w'] - LEARNING_RATE * conv2_delta_w
 
-    return weights, optimizer
+def compute_gradients(input_data, input_labels_one_hot_encoded, scores, cache, weights, gradients, workspace=None,
+                      gradient_ready=None):
+    """
+    Backpropagation: compute the gradients WRT the weights, without updating them.
+    The gradients are divided by BATCH_SIZE, so the gradients of the shards of a
+    batch add up to the gradients of the whole batch
+
+    Parameters
+    ----------
+    input_data : ndarray
+        The input images
+    input_labels_one_hot_encoded : ndarray
+        The one hot encoding of the labels
+    scores : ndarray
+        The scores returned by forward
+    cache : dict
+        The values returned by forward
+    weights : dict
+        The model weights
+    gradients : dict
+        Where the gradients are written (same names and shapes of the weights)
+    workspace: Workspace, optional
+        Arena providing the buffers of the temporaries. Not used by the layer
+        graph (see USE_LAYER_GRAPH), which manages the lifetime of its values itself
+    gradient_ready : function, optional
+        Called as gradient_ready(names) as soon as the gradients of a layer are
+        final, from the last layer to the first (e.g.: to start their all-reduce
+        while the earlier layers are computed, see distributed.py)
+    """
+    gradient_ready = gradient_ready or __ignore_gradients
+
+    if USE_LAYER_GRAPH:
+        build_model_graph().backward(scores, input_labels_one_hot_encoded, cache, weights, gradients,
+                                     gradient_ready=gradient_ready)
+        return
+
+    conv1_workspace = get_scope(workspace, 'conv1')
+    conv2_workspace = get_scope(workspace, 'conv2')
+    n_samples = scores.shape[0]
+
+    with profile('fc2', flops=2 * dense_flops(n_samples, *weights['fc2_w'].shape)):
+        # https://stats.stackexchange.com/questions/183840/sum-or-average-of-gradients-in-mini-batch-gradient-decent/183990
+        delta_2 = np.subtract(scores, input_labels_one_hot_encoded,
+                              out=get_buffer(workspace, 'fc2/delta', scores.shape, scores.dtype))
+        delta_2 /= BATCH_SIZE
+        np.matmul(cache['fc2_input'].T, delta_2, out=gradients['fc2_w'])
+        np.sum(delta_2, axis=0, keepdims=True, out=gradients['fc2_b'])
+        gradient_ready(('fc2_w', 'fc2_b'))
+
+        n_hidden = weights['fc2_w'].shape[0]
+        delta_1 = np.matmul(weights['fc2_w'], delta_2.T,
+                            out=get_buffer(workspace, 'fc1/delta_t', (n_hidden, n_samples), delta_2.dtype)).T
+
+    with profile('fc1_relu'):
+        delta_1 = np.multiply(delta_1, dReLU(cache['fc1_output'], out=get_buffer(workspace, 'fc1/drelu',
+                                                                                 cache['fc1_output'].shape,
+                                                                                 delta_2.dtype)),
+                              out=get_buffer(workspace, 'fc1/delta', (n_samples, n_hidden), delta_2.dtype))
+
+    with profile('fc1', flops=2 * dense_flops(n_samples, *weights['fc1_w'].shape)):
+        np.matmul(cache['fc1_input'].T, delta_1, out=gradients['fc1_w'])
+        np.sum(delta_1, axis=0, keepdims=True, out=gradients['fc1_b'])
+        gradient_ready(('fc1_w', 'fc1_b'))
+
+        # gradient WRT x0
+        n_features = weights['fc1_w'].shape[0]
+        delta_0 = np.matmul(weights['fc1_w'], delta_1.T,
+                            out=get_buffer(workspace, 'fc1/dx_t', (n_features, n_samples), delta_1.dtype)).T
+
+        # unflatten operation
+        delta_0_unflattened = get_buffer(workspace, 'flatten/delta', cache['x_maxpool_output'].shape,
+                                         delta_0.dtype)
+        if delta_0_unflattened is None:
+            delta_0_unflattened = delta_0.reshape(cache['x_maxpool_output'].shape)
+        else:
+            np.copyto(flatten(delta_0_unflattened), delta_0)
+
+    # dW and dX of conv2 (only dW for conv1)
+    conv2_flops = 2 * conv_flops(cache['conv2_input'].shape, weights['conv2_w'].shape, CONV_PADDING)
+    conv1_flops = conv_flops(input_data.shape, weights['conv1_w'].shape, CONV_PADDING)
+
+    if __use_fused_conv_relu_pool():
+        # gradients through the fused maxpool + ReLU + conv2 block
+        with profile('conv2_relu_pool', flops=conv2_flops):
+            conv2_delta_w, conv2_delta_x = \
+                fast_conv_relu_pool_backprop(cache['conv2_input'], weights['conv2_w'], delta_0_unflattened,
+                                             cache['x_maxpool_output'], cache['pos_maxpool_pos'],
+                                             padding=CONV_PADDING, input_columns=cache['conv2_input_cols'],
+                                             workspace=conv2_workspace)
+    else:
+        # gradients through the maxpool operation
+        with profile('pool'):
+            if USE_FAST_CONV:
+                delta_maxpool = fast_maxpool_backprop(delta_0_unflattened, cache['conv2_output'].shape,
+                                                      cache['pos_maxpool_pos'],
+                                                      workspace=get_scope(workspace, 'pool'))
+            else:
+                delta_maxpool = maxpool_backprop(delta_0_unflattened, cache['pos_maxpool_pos'],
+                                                 cache['conv2_output'].shape)
+
+        with profile('conv2_relu'):
+            delta_maxpool_w = np.multiply(delta_maxpool,
+                                          dReLU(cache['conv2_output'], out=get_buffer(workspace, 'conv2/drelu',
+                                                                                      cache['conv2_output'].shape,
+                                                                                      delta_maxpool.dtype)),
+                                          out=delta_maxpool)
+
+        with profile('conv2', flops=conv2_flops):
+            if USE_FAST_CONV:
+                conv2_delta_w, conv2_delta_x = \
+                    fast_convolution_backprop(cache['conv2_input'], weights['conv2_w'], delta_maxpool_w,
+                                              padding=CONV_PADDING, input_columns=cache['conv2_input_cols'],
+                                              workspace=conv2_workspace)
+            else:
+                conv2_delta_w, conv2_delta_x = \
+                    convolution_backprop(cache['conv2_input'], weights['conv2_w'], delta_maxpool_w,
+                                         padding=CONV_PADDING)
+
+    # The fc gradients are already in the flat gradient vector
+    np.copyto(gradients['conv2_w'], conv2_delta_w)
+    gradient_ready(('conv2_w',))
+
+    with profile('conv1_relu'):
+        conv2_delta_x = np.multiply(conv2_delta_x,
+                                    dReLU(cache['conv1_output'], out=get_buffer(workspace, 'conv1/drelu',
+                                                                                cache['conv1_output'].shape,
+                                                                                conv2_delta_x.dtype)),
+                                    out=conv2_delta_x)
+
+    with profile('conv1', flops=conv1_flops):
+        if USE_FAST_CONV:
+            conv1_delta_w, _ = fast_convolution_backprop(input_data, weights['conv1_w'], conv2_delta_x,
+                                                         padding=CONV_PADDING,
+                                                         input_columns=cache['conv1_input_cols'],
+                                                         workspace=conv1_workspace, input_gradient=False)
+        else:
+            conv1_delta_w, _ = convolution_backprop(input_data, weights['conv1_w'], conv2_delta_x,
+                                                    padding=CONV_PADDING)
+
+    # Any upcast along the way ends up in the gradients
+    for name, gradient in (('conv1_delta_w', conv1_delta_w), ('conv2_delta_w', conv2_delta_w), ('delta_1', delta_1),
+                           ('delta_2', delta_2)):
+        check_dtype(name, gradient)
+
+    np.copyto(gradients['conv1_w'], conv1_delta_w)
+    gradient_ready(('conv1_w',))
+
+
+def __ignore_gradients(names):
+    """
+    Default gradient_ready of compute_gradients
+    """
 
 
 def train_model(train_images, train_labels,
-                valid_images, valid_labels, epochs):
+                valid_images, valid_labels, epochs, normalization=None):
 
     # Flag indicating if the validation is required
     validation_required = valid_images is not None
@@ -217,28 +513,61 @@ def train_model(train_images, train_labels,
 
 
 
+    # Init model weights and optimizer parameters
+    weights = init_model_weights()
+    optimizer = init_optimizer_dictionary(weights)
+
+    # Buffers reused by all the batches with the same shape
+    workspace = Workspace()
+
+    # Distributed mode: this rank trains on its shard of the training set (see distributed.py)
+    ring = None
+    if DISTRIBUTED_WORLD_SIZE > 1:
+        # Imported here: distributed depends on this module
+        from distributed import DistributedTrainer
+        ring = DistributedTrainer(weights, optimizer, workspace=workspace)
+        train_images, train_labels = ring.shard(train_images, train_labels)
+
+    # Only one rank saves the weights
+    save_enabled = ring is None or ring.rank == 0
+
     # ##############################
     # CREATE BATCHES
     # ##############################
 
-    # TRAIN
-    train_images_batches = np.split(train_images, np.arange(BATCH_SIZE, len(train_images), BATCH_SIZE))
-    train_images_labels = np.split(train_labels, np.arange(BATCH_SIZE, len(train_labels), BATCH_SIZE))
+    # TRAIN (a new order at every epoch, see SHUFFLE_EACH_EPOCH)
+    # The images can be raw (e.g.: uint8): each batch is normalized by the loader (or by the workers)
+    train_loader = DataLoader(train_images, train_labels, shuffle=SHUFFLE_EACH_EPOCH, drop_last=DROP_LAST_BATCH,
+                              normalization=normalization)
 
     # VALIDATION
     if validation_required:
-        val_images_batches = np.split(valid_images, np.arange(BATCH_SIZE, len(valid_images), BATCH_SIZE))
-        val_images_labels = np.split(valid_labels, np.arange(BATCH_SIZE, len(valid_labels), BATCH_SIZE))
-
-    # Init model weights and optimizer parameters
-    weights = init_model_weights()
-    optimizer = init_optimizer_dictionary()
+        valid_loader = DataLoader(valid_images, valid_labels, normalization=normalization)
 
     # Number of times the weights are updated (needed for ADAM)
     n_weight_updates = 1
 
+    profiler = start_profiling(PROFILE_MEMORY) if ENABLE_PROFILING else None
+
+    # Data parallel mode: the gradients of each batch are computed by worker processes
+    trainer = None
+    if DATA_PARALLEL_WORKERS > 1:
+        # Imported here: data_parallel depends on this module
+        from data_parallel import DataParallelTrainer
+        trainer = DataParallelTrainer(train_images, train_labels, weights, optimizer, DATA_PARALLEL_WORKERS,
+                                      normalization)
+
+    # Asynchronous mode: worker processes update the shared weights without locks
+    hogwild = None
+    if HOGWILD_WORKERS > 1:
+        from hogwild import HogwildTrainer, staleness_stats
+        hogwild = HogwildTrainer(train_images, train_labels, weights, optimizer, HOGWILD_WORKERS, normalization)
+
     # Keep track of the current best valid accuracy
     best_valid_acc = 0
+
+    # Metrics of each epoch (returned)
+    history = []
     for e in range(epochs):
         print(f'=== EPOCH {e} ===')
         print('Epoch {} started...'.format(e))
@@ -250,24 +579,47 @@ def train_model(train_images, train_labels,
         train_batch_loss = 0
         train_batch_acc = 0
         train_samples = 0
-
-        for idx, input_data in enumerate(train_images_batches):
-            train_samples += input_data.shape[0]
-
-            input_labels = train_images_labels[idx]
-            # One hot encoding
-            input_labels_one_hot_encoded = np.zeros((input_labels.size, 10))
-            for i in range(input_labels.shape[0]):
-                position = input_labels[i]
-                input_labels_one_hot_encoded[i, position] = 1
-
-            scores, cache, loss, acc = forward(input_data, input_labels, input_labels_one_hot_encoded, weights)
-            train_batch_loss += loss
-            train_batch_acc += acc
-
-            weights, optimizer = backward(input_data, input_labels_one_hot_encoded,
-                                          scores, cache, weights, optimizer, n_weight_updates)
-            n_weight_updates += 1
+        step_times = []
+
+        if hogwild is not None:
+            # The workers go through all the batches of the epoch
+            batches = train_loader.batch_indices()
+            train_batch_loss, train_batch_acc, step_times, staleness = hogwild.train_epoch(batches)
+            train_samples = sum(len(indices) for indices in batches)
+        else:
+            # The data parallel workers read the batches from their shared copy of the training set
+            for batch in (train_loader.batch_indices() if trainer is not None else train_loader):
+                step_start = timer()
+
+                if trainer is not None:
+                    train_samples += len(batch)
+                    loss, acc = trainer.step(batch, n_weight_updates)
+                else:
+                    input_data, input_labels, input_labels_one_hot_encoded = batch
+                    train_samples += input_data.shape[0]
+
+                    if ring is not None:
+                        # The gradients are averaged over the ranks while backward runs
+                        loss, acc = ring.step(input_data, input_labels, input_labels_one_hot_encoded, n_weight_updates)
+                    else:
+                        scores, cache, loss, acc = forward(input_data, input_labels, input_labels_one_hot_encoded,
+                                                           weights, workspace)
+                        weights, optimizer = backward(input_data, input_labels_one_hot_encoded,
+                                                      scores, cache, weights, optimizer, n_weight_updates, workspace)
+
+                train_batch_loss += loss
+                train_batch_acc += acc
+                n_weight_updates += 1
+                step_times.append(timer() - step_start)
+
+        train_end = timer()
+
+        if ring is not None:
+            # Metrics of the whole training set, from the shards of all the ranks
+            communication = ring.end_epoch()
+            train_batch_loss, train_batch_acc, train_samples = \
+                ring.reduce_metrics(train_batch_loss, train_batch_acc, train_samples)
+            train_samples = int(train_samples)
 
         # ##############################
         # VALIDATION STEP
@@ -277,20 +629,15 @@ def train_model(train_images, train_labels,
             valid_batch_acc = 0
             valid_samples = 0
 
-            for idx, input_data in enumerate(val_images_batches):
-                valid_samples += input_data.shape[0]
-
-                input_labels = val_images_labels[idx]
+            # Profiled apart from the forward passes of the training
+            with profile('validation'):
+                for input_data, input_labels, input_labels_one_hot_encoded in valid_loader:
+                    valid_samples += input_data.shape[0]
 
-                # One hot encoding
-                input_labels_one_hot_encoded = np.zeros((input_labels.size, 10))
-                for i in range(input_labels.shape[0]):
-                    position = input_labels[i]
-                    input_labels_one_hot_encoded[i, position] = 1
-
-                scores, cache, loss, acc = forward(input_data, input_labels, input_labels_one_hot_encoded, weights)
-                valid_batch_loss += loss
-                valid_batch_acc += acc
+                    # Nothing is kept for the backpropagation
+                    scores = predict(input_data, weights, workspace)
+                    valid_batch_loss += cross_entropy(scores, input_labels_one_hot_encoded) * input_data.shape[0]
+                    valid_batch_acc += accuracy(scores, input_labels) * input_data.shape[0]
 
         end = timer()
 
@@ -301,36 +648,83 @@ def train_model(train_images, train_labels,
             print('\tVALID Accuracy: {:.3f}\tVALID Loss: {:.3f}'.
                   format(valid_batch_acc / valid_samples, valid_batch_loss / valid_samples))
 
+        if ring is not None:
+            print('\tCompute (s): {:.3f}\tCommunication (s): {:.3f}\tExposed communication (s): {:.3f}'.
+                  format(communication['compute_time'], communication['communication_time'],
+                         communication['exposed_communication_time']))
+
+        # Time the training waited for its batches: the input pipeline is the bottleneck if it is large
+        if hogwild is None and trainer is None:
+            print('\tLoader wait (s): {:.3f}'.format(train_loader.wait_time))
+
+        if hogwild is not None:
+            staleness = staleness_stats(staleness)
+            print('\tStaleness: mean {:.2f}\tp99 {:.0f}\tmax {}\tup-to-date updates {:.1%}'.
+                  format(staleness['mean'], staleness['p99'], staleness['max'], staleness['fresh_fraction']))
+
         print(f"Epoch {e} completed in (s): {end - start}")
 
+        history.append({
+            'epoch': e,
+            'train_accuracy': float(train_batch_acc / train_samples),
+            'train_loss': float(train_batch_loss / train_samples),
+            'valid_accuracy': float(valid_batch_acc / valid_samples) if validation_required else None,
+            'valid_loss': float(valid_batch_loss / valid_samples) if validation_required else None,
+            'train_samples': train_samples,
+            'train_time': train_end - start,
+            'epoch_time': end - start,
+            'step_times': step_times,
+            'loader_wait_time': train_loader.wait_time if hogwild is None and trainer is None else None,
+            'communication': communication if ring is not None else None,
+            'staleness': staleness if hogwild is not None else None
+        })
+
+        if profiler is not None:
+            print_profile(profiler.end_epoch(e))
+
         # Save model weights if validation score is higher
         if validation_required:
             if (valid_batch_acc / valid_samples) > best_valid_acc:
                 best_valid_acc = valid_batch_acc / valid_samples
-                print(f'\n(Higher accuracy found. Saving weights...)')
-                save_weights(weights, e + 1, VALIDATION_WEIGHTS_PATH)
+                if save_enabled:
+                    print(f'\n(Higher accuracy found. Saving weights...)')
+                    save_weights(weights, e + 1, VALIDATION_WEIGHTS_PATH, normalization)
 
         print()
 
+    if trainer is not None:
+        trainer.close(weights)
+    if ring is not None:
+        ring.close()
+    if hogwild is not None:
+        hogwild.close(weights)
+
     # Save the last training weights
-    if not validation_required:
+    if not validation_required and save_enabled:
         print(f'Training on full dataset completed. Saving weights...')
-        save_weights(weights, epochs, TRAIN_WEIGHTS_PATH)
+        save_weights(weights, epochs, TRAIN_WEIGHTS_PATH, normalization)
+
+    if profiler is not None:
+        stop_profiling()
+        profiler.to_json(PROFILING_PATH)
+        print(f'Profile saved in {PROFILING_PATH}')
 
     print()
 
+    return history
+
 
-def test_model(weights_path, test_images, test_labels, dataset_classes_desc):
+def test_model(weights_path, test_images, test_labels, dataset_classes_desc, show_plots=True, normalization=None):
     print('##############################')
     print('# TEST MODEL')
     print('##############################')
 
     # Split in batches
-    test_images_batches = np.split(test_images, np.arange(BATCH_SIZE, len(test_images), BATCH_SIZE))
-    test_images_labels = np.split(test_labels, np.arange(BATCH_SIZE, len(test_labels), BATCH_SIZE))
+    test_loader = DataLoader(test_images, test_labels, normalization=normalization)
 
     # Load weights from file system
     weights, _ = load_weights(weights_path)
+    workspace = Workspace()
 
     # Metrics
     test_batch_loss = 0
@@ -341,32 +735,39 @@ def test_model(weights_path, test_images, test_labels, dataset_classes_desc):
     correct_predictions = {}
     incorrect_predictions = {}
 
-    for idx, input_data in enumerate(test_images_batches):
+    start = timer()
+    for idx, (input_data, input_labels, input_labels_one_hot_encoded) in enumerate(test_loader):
         test_samples += input_data.shape[0]
 
-        input_labels = test_images_labels[idx]
-        # One hot encoding
-        input_labels_one_hot_encoded = np.zeros((input_labels.size, 10))
-        for i in range(input_labels.shape[0]):
-            position = input_labels[i]
-            input_labels_one_hot_encoded[i, position] = 1
-
-        scores, _, loss, acc = forward(input_data, input_labels, input_labels_one_hot_encoded, weights)
-        test_batch_loss += loss
-        test_batch_acc += acc
+        scores = predict(input_data, weights, workspace)
+        test_batch_loss += cross_entropy(scores, input_labels_one_hot_encoded) * input_data.shape[0]
+        test_batch_acc += accuracy(scores, input_labels) * input_data.shape[0]
 
         correct_predictions[idx], incorrect_predictions[idx] = single_batch_sample(scores, input_labels)
 
+    end = timer()
+
     print('TEST Accuracy: {:.3f}\tTEST Loss: {:.3f}'.
           format(test_batch_acc / test_samples, test_batch_loss / test_samples))
 
-    correct = all_batches_sample(correct_predictions, test_images_batches, test_images_labels)
-    incorrect = all_batches_sample(incorrect_predictions, test_images_batches, test_images_labels)
+    if show_plots:
+        # The samples are found by batch and position in the batch (the test set is not shuffled)
+        test_images_batches = np.split(test_images, np.arange(BATCH_SIZE, len(test_images), BATCH_SIZE))
+        test_images_labels = np.split(test_labels, np.arange(BATCH_SIZE, len(test_labels), BATCH_SIZE))
+        correct = all_batches_sample(correct_predictions, test_images_batches, test_images_labels)
+        incorrect = all_batches_sample(incorrect_predictions, test_images_batches, test_images_labels)
 
-    correct_incorrect_plot(
-        correct,
-        incorrect,
-        dataset_classes_desc
-    )
+        correct_incorrect_plot(
+            correct,
+            incorrect,
+            dataset_classes_desc
+        )
+
+    print()
 
-    print()
\ No newline at end of file
+    return {
+        'test_accuracy': float(test_batch_acc / test_samples),
+        'test_loss': float(test_batch_loss / test_samples),
+        'test_samples': test_samples,
+        'test_time': end - start
+    }
\ No newline at end of file
@@ -0,0 +1,181 @@
+from utils import *
+
+# Order of the weights inside the flat parameter vector
+PARAMETER_NAMES = ('conv1_w', 'conv2_w', 'fc1_w', 'fc1_b', 'fc2_w', 'fc2_b')
+
+
+def flatten_parameters(weights):
+    """
+    Copy the weights into a single contiguous vector
+
+    Parameters
+    ----------
+    weights : dict
+        The model weights (see init_model_weights)
+
+    Returns
+    -------
+    parameters : ndarray
+        1d array containing all the weights, in the order of PARAMETER_NAMES
+    views : dict
+        The weights as views of parameters, with their original shapes
+    """
+    n_parameters = sum(weights[name].size for name in PARAMETER_NAMES)
+    parameters = np.empty(n_parameters, dtype=DTYPE)
+
+    views = unflatten_parameters(parameters, weights)
+    for name in PARAMETER_NAMES:
+        views[name][...] = weights[name]
+
+    return parameters, views
+
+
+def unflatten_parameters(parameters, weights):
+    """
+    Split a flat vector into views with the shapes of the weights
+
+    Parameters
+    ----------
+    parameters : ndarray
+        1d array with the same size of all the weights (e.g.: the gradients)
+    weights : dict
+        The model weights, only used for their shapes
+
+    Returns
+    -------
+    views : dict
+        Views of parameters, with the same names and shapes of the weights
+    """
+    views = {}
+    offset = 0
+    for name in PARAMETER_NAMES:
+        size = weights[name].size
+        views[name] = parameters[offset:offset + size].reshape(weights[name].shape)
+        offset += size
+
+    return views
+
+
+def init_optimizer_dictionary(weights, parameters=None):
+    """
+    Initialize optimizer values.
+
+    The weights, their gradients and the optimizer moments are stored in flat
+    contiguous vectors, so that an optimizer step is a handful of in-place
+    vectorized operations over the whole model (see optimizer_step).
+    The arrays in weights are replaced by views of the flat parameter vector.
+
+    Parameters
+    ----------
+    weights : dict
+        The model weights (see init_model_weights). Updated in place
+    parameters : ndarray, optional
+        An existing flat parameter vector (e.g.: in shared memory), used
+        instead of a copy of the weights: the weights are only used for their shapes
+
+    Returns
+    -------
+    optimizer : dict
+        The generated optimizer values:
+        - parameters: the flat vector containing the weights
+        - gradients: the flat vector where the gradients are written,
+          with a view for each weight in weight_gradients
+        - momentum, velocity: the flat optimizer moments
+        - step, denominator: buffers for the temporaries of the update
+    """
+    if parameters is None:
+        parameters, views = flatten_parameters(weights)
+    else:
+        views = unflatten_parameters(parameters, weights)
+    weights.update(views)
+
+    gradients = np.zeros_like(parameters)
+
+    optimizer = {
+        'parameters': parameters,
+        'gradients': gradients,
+        'weight_gradients': unflatten_parameters(gradients, weights),
+        'momentum': np.zeros_like(parameters),
+        'velocity': np.zeros_like(parameters),
+        'step': np.zeros_like(parameters),
+        'denominator': np.zeros_like(parameters)
+    }
+    return optimizer
+
+
+def optimizer_step(optimizer, n_weight_updates):
+    """
+    Update all the weights with the optimizer selected in config.py.
+    The gradients must already be in optimizer['gradients'].
+
+    Each operation runs once over the whole flat vector and writes its
+    result in place (out=), so no temporary array is allocated.
+
+    Parameters
+    ----------
+    optimizer : dict
+        The optimizer values (see init_optimizer_dictionary)
+    n_weight_updates : int
+        Number of times the weights have been updated, including this one (needed for ADAM)
+    """
+    parameters = optimizer['parameters']
+    gradients = optimizer['gradients']
+    momentum = optimizer['momentum']
+    velocity = optimizer['velocity']
+    step = optimizer['step']
+
+    if OPTIMIZER == 'ADAM':
+        denominator = optimizer['denominator']
+
+        # Bias corrections (the same for all the weights)
+        momentum_correction = 1 - (BETA1 ** n_weight_updates)
+        velocity_correction = 1 - (BETA2 ** n_weight_updates)
+
+        # EPS underflows to zero with float16 (see DTYPE in config.py)
+        eps = max(EPS, float(np.finfo(parameters.dtype).tiny))
+
+        #  g(t+1) from the theory formulas
+        momentum *= BETA1
+        momentum += np.multiply(gradients, 1 - BETA1, out=step)
+
+        #  s(t+1) from the theory formulas
+        velocity *= BETA2
+        velocity += np.multiply(np.square(gradients, out=step), 1 - BETA2, out=step)
+
+        # sqrt(s_corr) + EPS
+        np.divide(velocity, velocity_correction, out=denominator)
+        np.sqrt(denominator, out=denominator)
+        denominator += eps
+
+        # LEARNING_RATE * g_corr / (sqrt(s_corr) + EPS)
+        np.divide(momentum, momentum_correction, out=step)
+        step /= denominator
+        step *= LEARNING_RATE
+        parameters -= step
+
+    elif OPTIMIZER == 'MOMENTUM':
+        velocity *= BETA1
+        velocity -= np.multiply(gradients, LEARNING_RATE, out=step)
+        parameters += velocity
+
+    else:
+        parameters -= np.multiply(gradients, LEARNING_RATE, out=step)
+
+
+def optimizer_flops(optimizer):
+    """
+    Approximate number of floating point operations of an optimizer step (see optimizer_step)
+
+    Parameters
+    ----------
+    optimizer : dict
+        The optimizer values (see init_optimizer_dictionary)
+
+    Returns
+    -------
+    flops : int
+        The number of floating point operations
+    """
+    # Element-wise operations for each parameter
+    operations = {'ADAM': 13, 'MOMENTUM': 4}.get(OPTIMIZER, 2)
+    return operations * optimizer['parameters'].size
@@ -0,0 +1,161 @@
+import os
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from config import *
+
+# Optional: needed to read and limit the threads of the BLAS library at runtime
+try:
+    from threadpoolctl import threadpool_info, threadpool_limits
+except ImportError:
+    threadpool_info = threadpool_limits = None
+
+# Arrays with fewer elements are processed by the calling thread: splitting them
+# costs more than it saves
+MIN_PARALLEL_SIZE = 1 << 15
+
+# The shared executor and its number of threads (see set_intra_op_threads)
+__pool = {'executor': None, 'n_threads': None}
+
+# Marks the threads running a chunk: nested parallel_for calls run serially
+__chunk_thread = threading.local()
+
+
+def available_cores():
+    """
+    Number of cores this process can run on
+
+    Returns
+    -------
+    n_cores : int
+        The number of usable cores
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def set_intra_op_threads(n_threads, blas_threads=0):
+    """
+    Set the threads used by parallel_for (see INTRA_OP_THREADS and BLAS_THREADS in config.py)
+
+    Parameters
+    ----------
+    n_threads : int
+        Number of threads, including the calling one (0: one per available core)
+    blas_threads : int, optional
+        If not 0, the BLAS library is limited to this number of threads
+
+    Returns
+    -------
+    previous : int
+        The previous number of threads (None if never set)
+    """
+    previous = __pool['n_threads']
+    n_threads = n_threads or available_cores()
+
+    if __pool['executor'] is not None:
+        __pool['executor'].shutdown(wait=True)
+
+    # The calling thread processes a chunk as well
+    __pool['executor'] = ThreadPoolExecutor(n_threads - 1, thread_name_prefix='intra-op',
+                                            initializer=__mark_chunk_thread) if n_threads > 1 else None
+    __pool['n_threads'] = n_threads
+
+    if blas_threads:
+        limit_blas_threads(blas_threads)
+
+    return previous
+
+
+def intra_op_threads():
+    """
+    Number of threads used by parallel_for
+
+    Returns
+    -------
+    n_threads : int
+        The number of threads, including the calling one
+    """
+    if __pool['n_threads'] is None:
+        set_intra_op_threads(INTRA_OP_THREADS, BLAS_THREADS)
+    return __pool['n_threads']
+
+
+def limit_blas_threads(n_threads):
+    """
+    Limit the threads of the BLAS library (used by the matrix multiplications)
+
+    Parameters
+    ----------
+    n_threads : int
+        The maximum number of BLAS threads
+
+    Returns
+    -------
+    limited : bool
+        False if the limit could not be applied (threadpoolctl not installed)
+    """
+    if threadpool_limits is None:
+        warnings.warn('threadpoolctl is not installed: the BLAS threads can only be set before starting Python '
+                      '(e.g.: OMP_NUM_THREADS, OPENBLAS_NUM_THREADS, MKL_NUM_THREADS)')
+        return False
+
+    threadpool_limits(limits=n_threads, user_api='blas')
+    return True
+
+
+def blas_threads():
+    """
+    Threads currently used by the BLAS library
+
+    Returns
+    -------
+    n_threads : int
+        The number of BLAS threads (None if unknown: threadpoolctl not installed)
+    """
+    if threadpool_info is None:
+        return None
+    return max((pool['num_threads'] for pool in threadpool_info() if pool['user_api'] == 'blas'), default=None)
+
+
+def parallel_for(function, n_items, size=None):
+    """
+    Split range(n_items) into contiguous chunks, one per thread, and call
+    function(start, stop) on each of them, using the shared executor.
+    The chunks run concurrently only when NumPy releases the GIL (e.g.: copies,
+    ufuncs), so function must work on whole slices and write disjoint outputs.
+    It returns when all the chunks are done (raising their exceptions, if any).
+
+    Parameters
+    ----------
+    function : function
+        Called as function(start, stop)
+    n_items : int
+        Number of items to split (e.g.: the images of the batch)
+    size : int, optional
+        Number of elements processed: small workloads run in the calling thread
+        (see MIN_PARALLEL_SIZE). By default, n_items
+    """
+    size = n_items if size is None else size
+    n_chunks = min(intra_op_threads(), n_items, size // MIN_PARALLEL_SIZE)
+
+    if n_chunks <= 1 or getattr(__chunk_thread, 'active', False):
+        function(0, n_items)
+        return
+
+    bounds = [n_items * chunk // n_chunks for chunk in range(n_chunks + 1)]
+    futures = [__pool['executor'].submit(function, bounds[chunk], bounds[chunk + 1]) for chunk in range(1, n_chunks)]
+
+    __chunk_thread.active = True
+    try:
+        function(bounds[0], bounds[1])
+    finally:
+        __chunk_thread.active = False
+        for future in futures:
+            future.result()
+
+
+def __mark_chunk_thread():
+    __chunk_thread.active = True
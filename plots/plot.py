@@ -4,6 +4,7 @@ from plots.initializer_comparison_plot import show_initializer_comparison_plots
 from plots.naive_fast_comparison_plot import show_naive_fast_comparison_plots
 from plots.optimizer_comparison_plot import show_optimizer_comparison_plots
 from plots.plot_utils import show_image_from_file
+from plots.training_benchmark_plot import show_training_benchmark_plots
 
 
 def __optimizer_comparison():
@@ -38,6 +39,7 @@ def __initializer_comparison():
 
 
 def __naive_vs_fast_comparison():
+    # Historical single epoch logs: the current numbers come from the training benchmark report
     base_path = os.path.join('plots', 'results', 'naive_vs_fast')
 
     naive = os.path.join(base_path, 'CIFAR10_CONV_NAIVE_1E')
@@ -48,6 +50,17 @@ def __naive_vs_fast_comparison():
     print()
 
 
+def __training_benchmark():
+    # Written by benchmarks/training_benchmark.py (not versioned: it is specific to the machine)
+    report_path = os.path.join('plots', 'results', 'training_benchmark.json')
+
+    if not os.path.isfile(report_path):
+        print(f'{report_path} not found: run python -m benchmarks.training_benchmark to create it')
+        return
+
+    show_training_benchmark_plots(report_path)
+
+
 def show_architecture():
     base_path = os.path.join('plots', 'architecture.png')
     show_image_from_file(base_path, "Architecture Overview", block=True)
@@ -57,6 +70,7 @@ def show_result_plots():
     __optimizer_comparison()
     __initializer_comparison()
     __naive_vs_fast_comparison()
+    __training_benchmark()
 
     print()
 
@@ -0,0 +1,40 @@
+import json
+
+from plots.plot_utils import *
+
+
+def show_training_benchmark_plots(report_path):
+    """
+    Plot the training throughput of each configuration of the training benchmark
+    (the JSON report written by benchmarks/training_benchmark.py)
+    """
+    with open(report_path) as file:
+        results = json.load(file)['results']
+
+    labels = []
+    images_per_second = []
+    colors = []
+    for result in results:
+        settings = result['settings']
+        labels.append('{}\n{}\n{}'.format(settings['OPTIMIZER'], settings['BATCH_SIZE'], settings['DTYPE']))
+        images_per_second.append(result['summary']['mean_images_per_second'])
+        colors.append('r' if settings['USE_FAST_CONV'] else 'b')
+
+    fig, (ax1) = plt.subplots(1, 1)
+    fig.set_figwidth(max(8, len(results)))
+    fig.set_figheight(6)
+
+    plt.text(x=0.5, y=0.94, s=f"Training benchmark", fontsize=18,
+             ha="center", transform=fig.transFigure)
+    plt.text(x=0.5, y=0.88, s=f"Naive (blue) VS Fast (red) implementation", fontsize=14,
+             weight="bold", ha="center", transform=fig.transFigure)
+
+    x = np.arange(len(results))
+    ax1.bar(x, height=images_per_second, width=0.5, color=colors)
+    ax1.set_yscale('log')
+    plt.subplots_adjust(top=0.8, bottom=0.2)
+    plt.xticks(x, labels)
+
+    ax1.set_xlabel('Optimizer, batch size, dtype', weight="bold")
+    ax1.set_ylabel('Training images per second', weight="bold")
+    plt.show(block=True)
@@ -0,0 +1,328 @@
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+# Returned by profile() when profiling is disabled: entering and exiting it does nothing
+__DISABLED = nullcontext()
+
+# The profiler currently recording (see start_profiling)
+__active = [None]
+
+
+class Profiler:
+    """
+    Record wall time, allocated bytes and FLOPs of the stages of the model.
+
+    Stages can be nested: the name of a stage is prefixed by the names of the
+    enclosing ones (e.g.: 'forward/conv1/im2col'), and its values include the
+    nested stages.
+    The bytes allocated by a stage are the peak of the memory traced by
+    tracemalloc during the stage, minus the memory traced when it started.
+    """
+
+    def __init__(self, trace_memory=True):
+        """
+        Parameters
+        ----------
+        trace_memory : bool, optional
+            If True, the allocated bytes are measured with tracemalloc (slower)
+        """
+        self.trace_memory = trace_memory
+        # True if tracemalloc was started for this profiler (and must be stopped with it)
+        self.started_tracing = False
+        self.stages = {}
+        self.epochs = []
+        self.__stack = []
+
+    def stage(self, name, flops=0):
+        """
+        Context manager recording a stage
+
+        Parameters
+        ----------
+        name : string
+            Name of the stage
+        flops : int, optional
+            Floating point operations computed by the stage (for GFLOP/s)
+
+        Returns
+        -------
+        stage : _Stage
+            The context manager
+        """
+        return _Stage(self, name, flops)
+
+    def _enter(self, name):
+        path = '/'.join([frame[0] for frame in self.__stack] + [name])
+
+        start_memory = 0
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak of the enclosing stage must survive the reset
+            if self.__stack:
+                self.__stack[-1][2] = max(self.__stack[-1][2], peak)
+            tracemalloc.reset_peak()
+            start_memory = current
+
+        # [name, path, peak memory of the nested stages, memory at the start]
+        self.__stack.append([name, path, start_memory, start_memory])
+        return time.perf_counter()
+
+    def _exit(self, start_time, flops):
+        elapsed = time.perf_counter() - start_time
+        _, path, nested_peak, start_memory = self.__stack.pop()
+
+        allocated = 0
+        if self.trace_memory:
+            peak = max(nested_peak, tracemalloc.get_traced_memory()[1])
+            allocated = peak - start_memory
+            if self.__stack:
+                self.__stack[-1][2] = max(self.__stack[-1][2], peak)
+
+        record = self.stages.get(path)
+        if record is None:
+            record = self.stages[path] = {'calls': 0, 'time': 0., 'flops': 0, 'allocated': 0, 'peak_allocated': 0}
+        record['calls'] += 1
+        record['time'] += elapsed
+        record['flops'] += flops
+        record['allocated'] += allocated
+        record['peak_allocated'] = max(record['peak_allocated'], allocated)
+
+    def end_epoch(self, epoch):
+        """
+        Close the aggregation of the current epoch
+
+        Parameters
+        ----------
+        epoch : int
+            The epoch that has been completed
+
+        Returns
+        -------
+        summary : dict
+            The statistics of the stages during the epoch (see summarize)
+        """
+        summary = {'epoch': epoch, 'stages': summarize(self.stages)}
+        self.epochs.append(summary)
+        self.stages = {}
+        return summary
+
+    def to_json(self, path):
+        """
+        Export the statistics of all the completed epochs as JSON
+
+        Parameters
+        ----------
+        path : string
+            The path of the JSON file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump({'trace_memory': self.trace_memory, 'epochs': self.epochs}, file, indent=2)
+
+
+class _Stage:
+    """
+    Context manager created by Profiler.stage
+    """
+    __slots__ = ('profiler', 'name', 'flops', 'start')
+
+    def __init__(self, profiler, name, flops):
+        self.profiler = profiler
+        self.name = name
+        self.flops = flops
+
+    def __enter__(self):
+        self.start = self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._exit(self.start, self.flops)
+        return False
+
+
+def summarize(stages):
+    """
+    Compute the statistics of the recorded stages
+
+    Parameters
+    ----------
+    stages : dict
+        The raw records of a Profiler
+
+    Returns
+    -------
+    summary : dict
+        For each stage: number of calls, total and mean time (ms), mean and peak
+        allocated bytes, GFLOPs and achieved GFLOP/s (None if the stage has no FLOPs)
+    """
+    summary = {}
+    for path, record in stages.items():
+        seconds = record['time']
+        summary[path] = {
+            'calls': record['calls'],
+            'total_ms': seconds * 1000,
+            'mean_ms': seconds * 1000 / record['calls'],
+            'mean_allocated_bytes': record['allocated'] // record['calls'],
+            'peak_allocated_bytes': record['peak_allocated'],
+            'gflops': record['flops'] / 1e9,
+            'gflop_per_s': record['flops'] / seconds / 1e9 if record['flops'] and seconds > 0 else None
+        }
+    return summary
+
+
+def print_profile(summary):
+    """
+    Print the statistics of an epoch, one stage per row
+
+    Parameters
+    ----------
+    summary : dict
+        The summary returned by Profiler.end_epoch
+    """
+    print(f'\tProfile of epoch {summary["epoch"]}')
+    print('\t{:<48} {:>7} {:>12} {:>10} {:>12} {:>9}'.format(
+        'stage', 'calls', 'total ms', 'mean ms', 'alloc MB', 'GFLOP/s'))
+    for path, stage in sorted(summary['stages'].items()):
+        gflop_per_s = stage['gflop_per_s']
+        print('\t{:<48} {:>7} {:>12.1f} {:>10.3f} {:>12.2f} {:>9}'.format(
+            path, stage['calls'], stage['total_ms'], stage['mean_ms'], stage['peak_allocated_bytes'] / 1e6,
+            '-' if gflop_per_s is None else '{:.2f}'.format(gflop_per_s)))
+
+
+def start_profiling(trace_memory=True):
+    """
+    Enable the profiling of the stages wrapped by profile()
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If True, the allocated bytes are measured with tracemalloc (slower)
+
+    Returns
+    -------
+    profiler : Profiler
+        The profiler recording the stages
+    """
+    profiler = Profiler(trace_memory)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profiler.started_tracing = True
+    __active[0] = profiler
+    return profiler
+
+
+def stop_profiling():
+    """
+    Disable the profiling, and stop tracemalloc if it was started by start_profiling
+
+    Returns
+    -------
+    profiler : Profiler
+        The profiler that was recording (None if profiling was not enabled)
+    """
+    profiler = __active[0]
+    __active[0] = None
+    # The tracing started by the caller before start_profiling is left running
+    if profiler is not None and profiler.started_tracing:
+        tracemalloc.stop()
+    return profiler
+
+
+def profile(name, flops=0):
+    """
+    Context manager recording a stage, if profiling is enabled (see start_profiling).
+    When profiling is disabled, it returns a shared context manager that does nothing.
+
+    Parameters
+    ----------
+    name : string
+        Name of the stage
+    flops : int, optional
+        Floating point operations computed by the stage (for GFLOP/s)
+
+    Returns
+    -------
+    stage : context manager
+        The stage (or a no-op context manager)
+    """
+    profiler = __active[0]
+    if profiler is None:
+        return __DISABLED
+    return profiler.stage(name, flops)
+
+
+def conv_flops(input_shape, kernel_shape, padding=0, stride=1):
+    """
+    FLOPs of a convolution (one multiply and one add for each kernel element)
+
+    Parameters
+    ----------
+    input_shape : tuple
+        Shape of the inputs (N, C, H, W)
+    kernel_shape : tuple
+        Shape of the kernel (F, C, HH, WW)
+    padding: int, optional
+        The padding applied to the inputs
+    stride: int, optional
+        The stride applied
+
+    Returns
+    -------
+    flops : int
+        The number of floating point operations
+    """
+    n_images, _, input_h, input_w = input_shape
+    out_channels, in_channels, kernel_h, kernel_w = kernel_shape
+    out_h = (input_h + 2 * padding - kernel_h) // stride + 1
+    out_w = (input_w + 2 * padding - kernel_w) // stride + 1
+    return 2 * n_images * out_channels * in_channels * kernel_h * kernel_w * out_h * out_w
+
+
+def dense_flops(n_samples, n_inputs, n_outputs):
+    """
+    FLOPs of a fully connected layer (matrix multiplication)
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples
+    n_inputs : int
+        Number of input features
+    n_outputs : int
+        Number of outputs
+
+    Returns
+    -------
+    flops : int
+        The number of floating point operations
+    """
+    return 2 * n_samples * n_inputs * n_outputs
+
+
+def profiled(name):
+    """
+    Decorator recording each call of the function as a stage (see profile)
+
+    Parameters
+    ----------
+    name : string
+        Name of the stage
+
+    Returns
+    -------
+    decorator : function
+        The decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
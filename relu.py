@@ -1,4 +1,9 @@
-def ReLU(x):
+import numpy as np
+
+from parallel import parallel_for
+
+
+def ReLU(x, out=None):
     """
     Apply the rectified linear unit opertion on the input
 
@@ -6,16 +11,26 @@ def ReLU(x):
     ----------
     x : ndarray
         Inputs that must pass through the ReLU
+    out : ndarray, optional
+        Buffer where the result is written (see Workspace)
 
     Returns
     -------
     x : ndarray
         The result of the computed ReLU operation
     """
-    return (x > 0) * x
+    if out is None:
+        out = np.empty_like(x)
 
+    # The batch is split in chunks among the intra-op threads
+    def relu_chunk(start, stop):
+        np.maximum(x[start:stop], 0, out=out[start:stop])
 
-def dReLU(x):
+    parallel_for(relu_chunk, len(x), x.size)
+    return out
+
+
+def dReLU(x, out=None):
     """
     Apply the derivative of the rectified linear unit
 
@@ -23,11 +38,21 @@ def dReLU(x):
     ----------
     x : ndarray
         Inputs that must pass through the ReLU
+    out : ndarray, optional
+        Buffer where the result is written (see Workspace)
 
     Returns
     -------
     x : ndarray
         The result of the computed derivative of the ReLU operation
     """
-    return (x > 0) * 1.0
+    if out is None:
+        # Keep the dtype of the inputs (multiplying by 1.0 would produce float64)
+        out = np.empty_like(x)
+
+    # The boolean result is cast to the type of the buffer
+    def drelu_chunk(start, stop):
+        np.greater(x[start:stop], 0, out=out[start:stop])
 
+    parallel_for(drelu_chunk, len(x), x.size)
+    return out
@@ -1,7 +1,7 @@
 import numpy as np
 
 
-def softmax(scores):
+def softmax(scores, out=None):
     """
     Compute the softmax
 
@@ -11,14 +11,25 @@ def softmax(scores):
         The values obtained from the last fully connected layer.
         The shape expected is (N, C), where N is the number of samples,
         and C is the number of classes.
+    out : ndarray, optional
+        Buffer where the result is written (it can be scores itself)
 
     Returns
     -------
     result : ndarray
         The computed softmax
     """
+    # exp underflows (and the sums overflow) with float16: computed in float32, then cast back
+    if np.finfo(scores.dtype).bits < 32:
+        result = softmax(scores.astype(np.float32))
+        if out is None:
+            return result.astype(scores.dtype)
+        out[...] = result
+        return out
+
     # the subtraction with np.max(scores) is required for having numerical stability
-    e_x2 = np.exp(scores - np.max(scores))
-    result = e_x2 / e_x2.sum(axis=1, keepdims=1)
+    e_x2 = np.subtract(scores, np.max(scores), out=out)
+    np.exp(e_x2, out=e_x2)
+    result = np.divide(e_x2, e_x2.sum(axis=1, keepdims=1), out=e_x2)
 
     return result
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules of the repository are imported as top level modules (e.g.: import model)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('MPLBACKEND', 'Agg')
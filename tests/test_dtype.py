@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# DTYPE is read when the modules are imported, so each dtype runs in a fresh process
+TRAIN_STEP = '''
+import sys
+import numpy as np
+import config
+config.DTYPE = sys.argv[1]
+import model
+
+np.random.seed(0)
+rng = np.random.default_rng(0)
+images = rng.standard_normal((16, 3, 32, 32)).astype(config.DTYPE)
+labels = rng.integers(0, 10, 16)
+labels_one_hot_encoded = model.one_hot_encode(labels)
+weights = model.init_model_weights()
+optimizer = model.init_optimizer_dictionary(weights)
+for step in (1, 2):
+    scores, cache, loss, _ = model.forward(images, labels, labels_one_hot_encoded, weights)
+    assert np.isfinite(loss), f'step {step}: loss {loss}'
+    weights, optimizer = model.backward(images, labels_one_hot_encoded, scores, cache, weights, optimizer, step)
+    assert all(np.isfinite(value).all() for value in weights.values()), f'step {step}: non finite weights'
+'''
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32', 'float16'])
+def test_training_step_is_finite(dtype):
+    process = subprocess.run([sys.executable, '-c', TRAIN_STEP, dtype], cwd=REPOSITORY_PATH, capture_output=True,
+                             text=True, env=dict(os.environ, MPLBACKEND='Agg'))
+    assert process.returncode == 0, process.stderr
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import convolution
+from convolution import fast_convolution_backprop, fast_convolve_2d
+from fft_convolution import fft_convolution_backprop, fft_convolve_2d, fft_supported
+
+# (input shape, kernel size, padding): odd and even sizes, square and not, with and without padding
+CASES = [
+    ((2, 3, 8, 8), 3, 0),
+    ((2, 3, 9, 9), 3, 1),
+    ((1, 2, 7, 12), 5, 2),
+    ((3, 1, 11, 6), 2, 0),
+    ((2, 2, 10, 7), 4, 1),
+]
+
+
+def random_problem(input_shape, kernel_size, padding, stride=1):
+    rng = np.random.default_rng(0)
+    inputs = rng.standard_normal(input_shape)
+    kernel = rng.standard_normal((4, input_shape[1], kernel_size, kernel_size))
+    output_shape = (input_shape[0], 4, (input_shape[2] + 2 * padding - kernel_size) // stride + 1,
+                    (input_shape[3] + 2 * padding - kernel_size) // stride + 1)
+    return inputs, kernel, rng.standard_normal(output_shape)
+
+
+def im2col_convolution(monkeypatch, inputs, kernel, gradient_values, padding, stride=1):
+    monkeypatch.setattr(convolution, 'CONV_ENGINE', 'IM2COL')
+    result = fast_convolve_2d(inputs, kernel, padding, stride)
+    dw, dx = fast_convolution_backprop(inputs, kernel, gradient_values, padding, stride)
+    return result, dw, dx
+
+
+@pytest.mark.parametrize('input_shape, kernel_size, padding', CASES)
+def test_fft_matches_im2col(monkeypatch, input_shape, kernel_size, padding):
+    inputs, kernel, gradient_values = random_problem(input_shape, kernel_size, padding)
+    expected = im2col_convolution(monkeypatch, inputs, kernel, gradient_values, padding)
+
+    result = fft_convolve_2d(inputs, kernel, padding)
+    dw, dx = fft_convolution_backprop(inputs, kernel, gradient_values, padding)
+
+    for value, expected_value in zip((result, dw, dx), expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.parametrize('input_shape, kernel_size, padding', CASES)
+def test_engine_reuses_transformed_inputs(monkeypatch, input_shape, kernel_size, padding):
+    inputs, kernel, gradient_values = random_problem(input_shape, kernel_size, padding)
+    expected = im2col_convolution(monkeypatch, inputs, kernel, gradient_values, padding)
+
+    monkeypatch.setattr(convolution, 'CONV_ENGINE', 'FFT')
+    result, transformed = fast_convolve_2d(inputs, kernel, padding, return_columns=True)
+    dw, dx = fast_convolution_backprop(inputs, kernel, gradient_values, padding, input_columns=transformed)
+
+    for value, expected_value in zip((result, dw, dx), expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.parametrize('stride', [2, 3])
+def test_strided_layers_fall_back_to_im2col(monkeypatch, stride):
+    inputs, kernel, gradient_values = random_problem((2, 3, 11, 9), 3, 1, stride)
+    assert not fft_supported(kernel.shape, stride)
+    expected = im2col_convolution(monkeypatch, inputs, kernel, gradient_values, 1, stride)
+
+    monkeypatch.setattr(convolution, 'CONV_ENGINE', 'FFT')
+    result, columns = fast_convolve_2d(inputs, kernel, 1, stride, return_columns=True)
+    dw, dx = fast_convolution_backprop(inputs, kernel, gradient_values, 1, stride, input_columns=columns)
+
+    for value, expected_value in zip((result, dw, dx), expected):
+        np.testing.assert_array_equal(value, expected_value)
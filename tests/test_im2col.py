@@ -0,0 +1,134 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import utils
+
+CASES = list(itertools.product((1, 2, 3), (0, 1, 2), (2, 3, 5)))
+# Square images: the INDICES backend only supports square inputs
+SHAPE = (2, 3, 11, 11)
+# The STRIDED backend is checked against a direct loop on non-square images too
+NON_SQUARE_SHAPES = [(2, 3, 7, 12), (1, 2, 13, 6)]
+
+
+def with_backend(monkeypatch, backend, function, *arguments):
+    monkeypatch.setattr(utils, 'IM2COL_BACKEND', backend)
+    return function(*arguments)
+
+
+def output_size(shape, kernel, stride, padding):
+    return (shape[2] + 2 * padding - kernel) // stride + 1, (shape[3] + 2 * padding - kernel) // stride + 1
+
+
+def reference_im2col(images, kernel, stride, padding):
+    """
+    im2col with explicit loops: one row per (channel, kernel row, kernel column),
+    one column per (image, output row, output column)
+    """
+    n_images, channels = images.shape[:2]
+    out_h, out_w = output_size(images.shape, kernel, stride, padding)
+    padded = np.pad(images, ((0, 0), (0, 0), (padding, padding), (padding, padding)))
+
+    columns = np.empty((channels * kernel * kernel, n_images * out_h * out_w))
+    for n, c, di, dj, i, j in itertools.product(range(n_images), range(channels), range(kernel), range(kernel),
+                                                range(out_h), range(out_w)):
+        columns[(c * kernel + di) * kernel + dj, (n * out_h + i) * out_w + j] = \
+            padded[n, c, i * stride + di, j * stride + dj]
+    return columns
+
+
+def reference_col2im(columns, shape, kernel, stride, padding):
+    """
+    col2im with explicit loops: the adjoint of reference_im2col
+    """
+    n_images, channels, height, width = shape
+    out_h, out_w = output_size(shape, kernel, stride, padding)
+
+    padded = np.zeros((n_images, channels, height + 2 * padding, width + 2 * padding))
+    for n, c, di, dj, i, j in itertools.product(range(n_images), range(channels), range(kernel), range(kernel),
+                                                range(out_h), range(out_w)):
+        padded[n, c, i * stride + di, j * stride + dj] += columns[(c * kernel + di) * kernel + dj,
+                                                                  (n * out_h + i) * out_w + j]
+    return padded[:, :, padding:padding + height, padding:padding + width]
+
+
+def random_columns(shape, kernel, stride, padding):
+    out_h, out_w = output_size(shape, kernel, stride, padding)
+    return np.random.default_rng(0).standard_normal((shape[1] * kernel * kernel, shape[0] * out_h * out_w))
+
+
+@pytest.mark.parametrize('stride, padding, kernel', CASES)
+def test_strided_im2col_matches_indices(monkeypatch, stride, padding, kernel):
+    images = np.random.default_rng(0).standard_normal(SHAPE)
+
+    expected = with_backend(monkeypatch, 'INDICES', utils.im2col, images, kernel, kernel, stride, padding)
+    result = with_backend(monkeypatch, 'STRIDED', utils.im2col, images, kernel, kernel, stride, padding)
+
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('stride, padding, kernel', CASES)
+def test_strided_col2im_matches_indices(monkeypatch, stride, padding, kernel):
+    shape = SHAPE
+    columns = random_columns(shape, kernel, stride, padding)
+
+    expected = with_backend(monkeypatch, 'INDICES', utils.col2im, columns, shape, kernel, kernel, stride, padding)
+    result = with_backend(monkeypatch, 'STRIDED', utils.col2im, columns, shape, kernel, kernel, stride, padding)
+
+    # The overlapping windows are summed in a different order
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('stride, padding, kernel', CASES)
+@pytest.mark.parametrize('backend', ['STRIDED', 'INDICES'])
+def test_im2col_matches_reference(monkeypatch, backend, stride, padding, kernel):
+    images = np.random.default_rng(0).standard_normal(SHAPE)
+
+    result = with_backend(monkeypatch, backend, utils.im2col, images, kernel, kernel, stride, padding)
+
+    np.testing.assert_array_equal(result, reference_im2col(images, kernel, stride, padding))
+
+
+@pytest.mark.parametrize('stride, padding, kernel', CASES)
+@pytest.mark.parametrize('shape', NON_SQUARE_SHAPES)
+def test_strided_im2col_non_square(monkeypatch, shape, stride, padding, kernel):
+    images = np.random.default_rng(0).standard_normal(shape)
+
+    result = with_backend(monkeypatch, 'STRIDED', utils.im2col, images, kernel, kernel, stride, padding)
+
+    np.testing.assert_array_equal(result, reference_im2col(images, kernel, stride, padding))
+
+
+@pytest.mark.parametrize('stride, padding, kernel', CASES)
+@pytest.mark.parametrize('shape', NON_SQUARE_SHAPES)
+def test_strided_col2im_non_square(monkeypatch, shape, stride, padding, kernel):
+    columns = random_columns(shape, kernel, stride, padding)
+
+    result = with_backend(monkeypatch, 'STRIDED', utils.col2im, columns, shape, kernel, kernel, stride, padding)
+
+    np.testing.assert_allclose(result, reference_col2im(columns, shape, kernel, stride, padding),
+                               rtol=1e-12, atol=1e-12)
+
+
+def test_indices_plan_is_cached(monkeypatch):
+    monkeypatch.setattr(utils, 'IM2COL_BACKEND', 'INDICES')
+    rng = np.random.default_rng(0)
+    utils.clear_index_cache()
+
+    columns = utils.im2col(rng.standard_normal(SHAPE), 3, 3, 1, 1)
+    info = utils.index_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (0, 1, 1)
+
+    # The number of images is not part of the key: the last, smaller, batch shares the plan
+    utils.im2col(rng.standard_normal((1,) + SHAPE[1:]), 3, 3, 1, 1)
+    info = utils.index_cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+    utils.col2im(columns, SHAPE, 3, 3, 1, 1)
+    info = utils.index_cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+    utils.clear_index_cache()
+    info = utils.index_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (0, 0, 0)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from inference_server import MicroBatcher
+from model import init_model_weights, predict
+from utils import normalize_images
+
+NORMALIZATION = (np.full((1, 3, 1, 1), 120.), np.full((1, 3, 1, 1), 60.))
+
+
+@pytest.fixture
+def weights():
+    np.random.seed(0)
+    return init_model_weights()
+
+
+@pytest.fixture
+def raw_images():
+    return np.random.default_rng(0).integers(0, 256, (4, 3, 32, 32)).astype(np.uint8)
+
+
+def test_raw_pixels_are_normalized(weights, raw_images):
+    batcher = MicroBatcher(weights, max_latency=0, normalization=NORMALIZATION)
+    try:
+        probabilities = batcher.predict(raw_images)
+        with pytest.raises(ValueError):
+            # Already normalized images are out of the range of the raw pixels
+            batcher.predict(normalize_images(raw_images, NORMALIZATION))
+    finally:
+        batcher.close()
+
+    np.testing.assert_array_equal(probabilities, predict(normalize_images(raw_images, NORMALIZATION), weights))
+
+
+def test_raw_pixels_need_a_normalization(weights, raw_images):
+    batcher = MicroBatcher(weights, max_latency=0)
+    try:
+        with pytest.raises(ValueError):
+            batcher.predict(raw_images)
+        probabilities = batcher.predict(normalize_images(raw_images, NORMALIZATION))
+    finally:
+        batcher.close()
+
+    np.testing.assert_array_equal(probabilities, predict(normalize_images(raw_images, NORMALIZATION), weights))
@@ -0,0 +1,46 @@
+import copy
+import sys
+
+import pytest
+
+from benchmarks import kernel_benchmark
+from benchmarks.kernel_benchmark import compare, is_regression, result_key
+
+
+def make_results():
+    results = []
+    for kernel, best_ms in (('fast_convolve_2d', 2.0), ('im2col', 0.5), ('col2im', 1.0)):
+        results.append({'kernel': kernel, 'batch_size': 32, 'channels': 3, 'image_size': 32, 'dtype': 'float32',
+                        'best_ms': best_ms, 'median_ms': best_ms * 1.1, 'spread_ms': best_ms * 0.02})
+    return results
+
+
+def test_compare_flags_slowed_down_kernel():
+    baseline = make_results()
+    results = copy.deepcopy(baseline)
+    results[1]['best_ms'] *= 2
+
+    regressions = compare(results, baseline)
+
+    assert [key for key, _, _ in regressions] == [result_key(results[1])]
+    assert regressions[0][1:] == (baseline[1]['best_ms'], results[1]['best_ms'])
+
+
+def test_compare_ignores_same_results():
+    baseline = make_results()
+    assert compare(copy.deepcopy(baseline), baseline) == []
+
+
+def test_slowdown_within_noise_is_not_regression():
+    base = make_results()[0]
+    now = dict(base, best_ms=base['best_ms'] * 1.2, spread_ms=base['best_ms'])
+    assert not is_regression(base, now)[0]
+
+
+def test_compare_refuses_to_overwrite_baseline(monkeypatch, tmp_path):
+    path = str(tmp_path / 'baseline.json')
+    monkeypatch.setattr(sys, 'argv', ['kernel_benchmark', '--output', path, '--compare', path])
+
+    with pytest.raises(SystemExit):
+        kernel_benchmark.main()
+    assert not (tmp_path / 'baseline.json').exists()
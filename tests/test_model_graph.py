@@ -0,0 +1,50 @@
+import numpy as np
+
+import graph
+import model
+
+
+def test_graph_is_built_once():
+    assert model.build_model_graph() is model.build_model_graph()
+
+
+def test_graph_follows_model_settings(monkeypatch):
+    fast_graph = model.build_model_graph()
+
+    # The layers do not read the copies of the graph module: the cached graph is still valid
+    monkeypatch.setattr(graph, 'USE_FAST_CONV', not model.USE_FAST_CONV)
+    monkeypatch.setattr(graph, 'CACHE_CONV_COLUMNS', not model.CACHE_CONV_COLUMNS)
+    assert model.build_model_graph() is fast_graph
+    assert all(layer.fast_conv == model.USE_FAST_CONV for layer in fast_graph.layers
+               if isinstance(layer, graph.Conv2DLayer))
+
+    monkeypatch.setattr(model, 'USE_FAST_CONV', False)
+    naive_graph = model.build_model_graph()
+    assert naive_graph is not fast_graph
+    conv_layers = [layer for layer in naive_graph.layers if isinstance(layer, graph.Conv2DLayer)]
+    assert [layer.fast_conv for layer in conv_layers] == [False, False]
+    assert all(layer.keeps_inputs for layer in conv_layers)
+    assert not any(layer.fast_pool for layer in naive_graph.layers if isinstance(layer, graph.MaxPoolLayer))
+
+
+def test_graph_matches_forward_and_backward(monkeypatch):
+    rng = np.random.default_rng(0)
+    images = rng.standard_normal((8, 3, 32, 32)).astype(model.DTYPE)
+    labels = rng.integers(0, 10, 8)
+    labels_one_hot_encoded = model.one_hot_encode(labels)
+    np.random.seed(0)
+    weights = model.init_model_weights()
+
+    results = {}
+    for use_graph in (False, True):
+        monkeypatch.setattr(model, 'USE_LAYER_GRAPH', use_graph)
+        gradients = {name: np.zeros_like(value) for name, value in weights.items()}
+        scores, cache, loss, acc = model.forward(images, labels, labels_one_hot_encoded, weights, model.Workspace())
+        scores = scores.copy()
+        model.compute_gradients(images, labels_one_hot_encoded, scores, cache, weights, gradients)
+        results[use_graph] = scores, loss, gradients
+
+    np.testing.assert_allclose(results[True][0], results[False][0], rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(results[True][1], results[False][1], rtol=1e-5)
+    for name in weights:
+        np.testing.assert_allclose(results[True][2][name], results[False][2][name], rtol=1e-4, atol=1e-6)
@@ -0,0 +1,26 @@
+import tracemalloc
+
+from profiler import profile, start_profiling, stop_profiling
+
+
+def test_profiler_stops_its_own_tracing():
+    assert not tracemalloc.is_tracing()
+    start_profiling(trace_memory=True)
+    with profile('stage'):
+        pass
+    stop_profiling()
+
+    assert not tracemalloc.is_tracing()
+
+
+def test_profiler_keeps_the_tracing_of_the_caller():
+    tracemalloc.start()
+    try:
+        start_profiling(trace_memory=True)
+        with profile('stage'):
+            pass
+        stop_profiling()
+
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
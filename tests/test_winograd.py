@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import convolution
+from convolution import convolution_backprop, convolve_2d, fast_convolution_backprop, fast_convolve_2d
+from winograd import winograd_convolution_backprop, winograd_convolve_2d, winograd_supported
+
+# (input shape, padding): odd and even sizes, square and not, with and without padding
+CASES = [
+    ((2, 3, 8, 8), 0),
+    ((2, 3, 9, 9), 0),
+    ((2, 3, 9, 9), 1),
+    ((1, 2, 7, 12), 0),
+    ((1, 2, 7, 12), 2),
+    ((3, 1, 11, 5), 1),
+]
+
+
+def random_problem(input_shape, padding):
+    rng = np.random.default_rng(0)
+    inputs = rng.standard_normal(input_shape)
+    kernel = rng.standard_normal((4, input_shape[1], 3, 3))
+    output_shape = (input_shape[0], 4, input_shape[2] + 2 * padding - 2, input_shape[3] + 2 * padding - 2)
+    return inputs, kernel, rng.standard_normal(output_shape)
+
+
+@pytest.mark.parametrize('input_shape, padding', CASES)
+def test_forward_matches_naive(input_shape, padding):
+    inputs, kernel, _ = random_problem(input_shape, padding)
+
+    np.testing.assert_allclose(winograd_convolve_2d(inputs, kernel, padding), convolve_2d(inputs, kernel, padding),
+                               rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.parametrize('input_shape, padding', CASES)
+def test_backprop_matches_naive(input_shape, padding):
+    inputs, kernel, gradient_values = random_problem(input_shape, padding)
+
+    dw, dx = winograd_convolution_backprop(inputs, kernel, gradient_values, padding)
+    expected_dw, expected_dx = convolution_backprop(inputs, kernel, gradient_values, padding)
+
+    np.testing.assert_allclose(dw, expected_dw, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(dx, expected_dx, rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.parametrize('input_shape, padding', CASES)
+def test_engine_reuses_transformed_inputs(monkeypatch, input_shape, padding):
+    inputs, kernel, gradient_values = random_problem(input_shape, padding)
+
+    monkeypatch.setattr(convolution, 'CONV_ENGINE', 'WINOGRAD')
+    result, transformed = fast_convolve_2d(inputs, kernel, padding, return_columns=True)
+    dw, dx = fast_convolution_backprop(inputs, kernel, gradient_values, padding, input_columns=transformed)
+
+    expected_dw, expected_dx = convolution_backprop(inputs, kernel, gradient_values, padding)
+    np.testing.assert_allclose(result, convolve_2d(inputs, kernel, padding), rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(dw, expected_dw, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(dx, expected_dx, rtol=1e-10, atol=1e-10)
+
+
+def test_unsupported_layers_use_im2col(monkeypatch):
+    rng = np.random.default_rng(0)
+    inputs = rng.standard_normal((2, 3, 9, 9))
+    kernel = rng.standard_normal((4, 3, 3, 3))
+    assert not winograd_supported(kernel.shape, stride=2)
+    assert not winograd_supported((4, 3, 5, 5))
+
+    monkeypatch.setattr(convolution, 'CONV_ENGINE', 'WINOGRAD')
+    np.testing.assert_allclose(fast_convolve_2d(inputs, kernel, stride=2), convolve_2d(inputs, kernel, stride=2),
+                               rtol=1e-10, atol=1e-10)
@@ -1,5 +1,9 @@
+import functools
 import numpy as np
 from config import *
+from workspace import *
+from parallel import *
+from profiler import *
 # matplotlib.use("TkAgg")
 
 
@@ -30,10 +34,92 @@ def accuracy(scores, labels):
     return acc
 
 
+def one_hot_encode(labels, n_classes=10, out=None):
+    """
+    One hot encoding of the labels
+
+    Parameters
+    ----------
+    labels : ndarray
+        The labels (integers from 0 to n_classes - 1)
+    n_classes : int, optional
+        The number of classes
+    out : ndarray, optional
+        Buffer where the result is written, with shape (len(labels), n_classes)
+
+    Returns
+    -------
+    one_hot : ndarray
+        One row per label, with 1 in the column of the label and 0 elsewhere (dtype: DTYPE)
+    """
+    if out is None:
+        out = np.zeros((labels.size, n_classes), dtype=DTYPE)
+    else:
+        out.fill(0)
+    out[np.arange(labels.size), labels] = 1
+    return out
+
+
+def normalize_images(images, normalization=None, out=None):
+    """
+    Convert images to DTYPE, normalized with (images - mean) / std
+
+    Parameters
+    ----------
+    images : ndarray
+        The images (e.g.: the raw uint8 pixels)
+    normalization : tuple, optional
+        The mean and the std, broadcastable to the images (None: the images are only converted)
+    out : ndarray, optional
+        Buffer where the result is written, with the shape of the images
+
+    Returns
+    -------
+    images : ndarray
+        The normalized images (dtype: DTYPE, or the dtype of out)
+    """
+    if out is None:
+        out = np.empty(images.shape, dtype=DTYPE)
+    if normalization is None:
+        out[...] = images
+        return out
+
+    # Computed in the dtype of the buffer
+    mean, std = (np.asarray(value, dtype=out.dtype) for value in normalization)
+    np.subtract(images, mean, out=out)
+    np.divide(out, std, out=out)
+    return out
+
+
+# ################################################################################
+# DTYPE POLICY
+# ################################################################################
+def check_dtype(name, array):
+    """
+    Check that an array follows the dtype policy (see DTYPE in config.py).
+    Used for catching the operations that silently upcast (e.g.: float32 to float64).
+
+    Parameters
+    ----------
+    name : string
+        Name of the array, used in the error message
+    array : ndarray
+        The array to check
+
+    Returns
+    -------
+    array : ndarray
+        The same array, so that the check can be chained
+    """
+    if CHECK_DTYPE and array.dtype != np.dtype(DTYPE):
+        raise TypeError(f'{name} has dtype {array.dtype}, but the dtype policy is {DTYPE} (see DTYPE in config.py)')
+    return array
+
+
 # ################################################################################
 # MODEL
 # ################################################################################
-def save_weights(weights, epoch, path):
+def save_weights(weights, epoch, path, normalization=None):
     """
     Save weigths to file system
 
@@ -45,6 +131,9 @@ def save_weights(weights, epoch, path):
         The epoch where these weights have been obtained
     path : string
         The path where weights are on file system
+    normalization : tuple, optional
+        The mean and the std applied to the raw images during the training
+        (see normalize_images), needed to predict on raw images
     """
 
     # Do not save weights if running the model on a dummy dataset
@@ -58,6 +147,9 @@ def save_weights(weights, epoch, path):
         np.save(f'{path}/conv1_w.npy', weights['conv1_w'])
         np.save(f'{path}/conv2_w.npy', weights['conv2_w'])
         np.save(f'{path}/epoch.npy', epoch)
+        if normalization is not None:
+            np.save(f'{path}/normalization_mean.npy', normalization[0])
+            np.save(f'{path}/normalization_std.npy', normalization[1])
 
 
 def load_weights(weights_path):
@@ -83,34 +175,30 @@ def load_weights(weights_path):
         'fc2_w': np.load(f'{weights_path}/fc2_w.npy'),
         'fc2_b': np.load(f'{weights_path}/fc2_b.npy'),
     }
+    # Checkpoints may have been saved with a different dtype policy
+    weights = {name: value.astype(DTYPE, copy=False) for name, value in weights.items()}
     epoch = np.load(f'{weights_path}/epoch.npy'),
     return weights, epoch
 
 
-def init_optimizer_dictionary():
+def load_normalization(weights_path):
     """
-    Initialize optimizer values
+    Load the normalization saved with the weights (see save_weights)
+
+    Parameters
+    ----------
+    weights_path : string
+        The path where weights are on file system
 
     Returns
     -------
-    optimizer : ndarray
-        The generated optimizer values
-    """
-    optimizer = {
-        'momentum_w1': 0,
-        'momentum_w2': 0,
-        'momentum_b0': 0,
-        'momentum_b1': 0,
-        'momentum_conv1': 0,
-        'momentum_conv2': 0,
-        'velocity_w1': 0,
-        'velocity_w2': 0,
-        'velocity_b0': 0,
-        'velocity_b1': 0,
-        'velocity_conv1': 0,
-        'velocity_conv2': 0
-    }
-    return optimizer
+    normalization : tuple
+        The mean and the std of the raw images, or None if the weights were
+        trained on images that were already normalized
+    """
+    if not os.path.isfile(f'{weights_path}/normalization_mean.npy'):
+        return None
+    return np.load(f'{weights_path}/normalization_mean.npy'), np.load(f'{weights_path}/normalization_std.npy')
 
 
 def init_model_weights():
@@ -164,6 +252,9 @@ def init_model_weights():
             'fc2_b': np.random.uniform(low=-fc2_stdv, high=fc2_stdv, size=(1, 10))
         }
 
+    # Apply the dtype policy (see DTYPE in config.py)
+    weights = {name: value.astype(DTYPE, copy=False) for name, value in weights.items()}
+
     return weights
 
 
@@ -196,19 +287,21 @@ def generate_kernel(input_channels=3, output_channels=16, kernel_h=3, kernel_w=3
 
     if random:
         if USE_HE_WEIGHT_INITIALIZATION:
-            return np.random.randn(output_channels, input_channels, kernel_h, kernel_w) / np.sqrt(fan_in / 2)
+            kernel = np.random.randn(output_channels, input_channels, kernel_h, kernel_w) / np.sqrt(fan_in / 2)
         else:
             stdv = 1. / np.sqrt(fan_in)
-            return np.random.uniform(low=-stdv, high=stdv, size=(output_channels, input_channels, kernel_h, kernel_w))
+            kernel = np.random.uniform(low=-stdv, high=stdv, size=(output_channels, input_channels, kernel_h, kernel_w))
 
     else:
-        return np.ones((output_channels, input_channels, kernel_h, kernel_w)) * 2
+        kernel = np.ones((output_channels, input_channels, kernel_h, kernel_w)) * 2
+
+    return kernel.astype(DTYPE)
 
 
 # ################################################################################
 # FAST CONVOLUTIONS AND MAX POOL UTILITY METHODS
 # ################################################################################
-def im2col(images, filter_h, filter_w, stride=1, padding=0):
+def im2col(images, filter_h, filter_w, stride=1, padding=0, out=None, pad_out=None):
     """
     Transform images into columns
 
@@ -224,14 +317,22 @@ def im2col(images, filter_h, filter_w, stride=1, padding=0):
         The possible padding applied to the inputs
     stride: int, optional
         The stride applied for the convolution operation
+    out: ndarray, optional
+        Buffer where the column matrix is written (see Workspace)
+    pad_out: ndarray, optional
+        Buffer where the padded images are written. Its borders must be zero
+        (e.g.: a workspace buffer used only for this)
 
     Returns
     -------
     image_cols : ndarray
         Array containing the images in column form (2d matrix)
     """
+    if IM2COL_BACKEND == 'STRIDED':
+        return __strided_im2col(images, filter_h, filter_w, stride, padding, out, pad_out)
+
     # Apply the padding
-    padded_images = np.pad(images, ((0, 0), (0, 0), (padding, padding), (padding, padding)), mode='constant')
+    padded_images = pad_images(images, padding, out=pad_out)
     row_indices, col_indices, channel_matrix = __get_indices(images.shape, filter_h, filter_w, stride, padding)
 
     # Get the image values at the positions indicated by the indices for creating the final matrix.
@@ -239,12 +340,102 @@ def im2col(images, filter_h, filter_w, stride=1, padding=0):
 
     # Create a single matrix that considers all the images concatenating along the last axis
     # (e.g.: horizontally)
-    image_cols = np.concatenate(image_cols, axis=-1)
+    image_cols = np.concatenate(image_cols, axis=-1, out=out)
 
     return image_cols
 
 
-def col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0):
+def __strided_im2col(images, filter_h, filter_w, stride=1, padding=0, out=None, pad_out=None):
+    """
+    Transform images into columns using a sliding window view.
+
+    The windows are read through a zero-copy view of the (padded) images,
+    so the only copy made is the final reshape into the column matrix.
+    The result has exactly the same layout of the index based im2col:
+    - rows are ordered by (channel, filter row, filter column)
+    - columns are ordered by (image, output row, output column)
+
+    Parameters
+    ----------
+    images : ndarray
+        The array of images
+    filter_h : int
+        filter height
+    filter_w : int
+        filter width
+    padding: int, optional
+        The possible padding applied to the inputs
+    stride: int, optional
+        The stride applied for the convolution operation
+    out: ndarray, optional
+        Buffer where the column matrix is written (see Workspace)
+    pad_out: ndarray, optional
+        Buffer where the padded images are written. Its borders must be zero
+        (e.g.: a workspace buffer used only for this)
+
+    Returns
+    -------
+    image_cols : ndarray
+        Array containing the images in column form (2d matrix)
+    """
+    n_images, n_channels, _, _ = images.shape
+
+    images = pad_images(images, padding, out=pad_out)
+
+    # View with shape (N, C, out_h, out_w, filter_h, filter_w).
+    # No data is copied here: the strides of the view simply walk the original buffer.
+    windows = np.lib.stride_tricks.sliding_window_view(images, (filter_h, filter_w), axis=(2, 3))
+    windows = windows[:, :, ::stride, ::stride]
+    out_h, out_w = windows.shape[2], windows.shape[3]
+
+    # Move to (C, filter_h, filter_w, N, out_h, out_w): reshaping it creates the
+    # contiguous column matrix with a single copy.
+    windows = windows.transpose(1, 4, 5, 0, 2, 3)
+    if out is None:
+        out = np.empty((n_channels * filter_h * filter_w, n_images * out_h * out_w), dtype=images.dtype)
+    columns = out.reshape(windows.shape)
+
+    # The images are copied in chunks by the intra-op threads
+    def copy_images(start, stop):
+        np.copyto(columns[:, :, :, start:stop], windows[:, :, :, start:stop])
+
+    parallel_for(copy_images, n_images, out.size)
+
+    return out
+
+
+def pad_images(images, padding, out=None):
+    """
+    Apply the zero padding to the images
+
+    Parameters
+    ----------
+    images : ndarray
+        The array of images
+    padding: int
+        The padding applied to the images
+    out: ndarray, optional
+        Buffer where the padded images are written. Only the inner part is
+        written, so its borders must already be zero
+
+    Returns
+    -------
+    padded_images : ndarray
+        The padded images (the images themselves when padding is 0)
+    """
+    # np.pad always copies, so skip it when not needed
+    if padding == 0:
+        return images
+
+    if out is None:
+        return np.pad(images, ((0, 0), (0, 0), (padding, padding), (padding, padding)), mode='constant')
+
+    out[:, :, padding:-padding, padding:-padding] = images
+
+    return out
+
+
+def col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0, out=None):
     """
     Transform columns into images
 
@@ -262,12 +453,17 @@ def col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0):
         The possible padding applied to the inputs
     stride: int, optional
         The stride applied for the convolution operation
+    out: ndarray, optional
+        Buffer with the shape of the padded inputs, where the images are accumulated
 
     Returns
     -------
     image : ndarray
         Array containing the inputs converted back to the original shape
     """
+    if IM2COL_BACKEND == 'STRIDED':
+        return __strided_col2im(x_col, x_shape, filter_h, filter_w, stride, padding, out)
+
     # Get required variables from the input shape
     n_images, n_channels, input_h, input_w = x_shape
 
@@ -275,7 +471,7 @@ def col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0):
     input_h_padded, input_w_padded = input_h + 2 * padding, input_w + 2 * padding
 
     # Init a variable that has the final size we expect
-    x_padded = np.zeros((n_images, n_channels, input_h_padded, input_w_padded))
+    x_padded = __zeros_buffer((n_images, n_channels, input_h_padded, input_w_padded), x_col.dtype, out)
 
     # Index matrices, necessary to transform our input image into a matrix.
     row_indices, col_indices, ch_indices = __get_indices(x_shape, filter_h, filter_w, stride, padding)
@@ -290,7 +486,7 @@ def col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0):
             
             3) We want to obtain (2, 12, 9)
     '''
-    x_col_reshaped = np.array(np.hsplit(x_col, n_images))
+    x_col_reshaped = x_col.reshape(x_col.shape[0], n_images, -1).transpose(1, 0, 2)
 
     # Reshape the matrix back to image.
     # NOTE: slice(None) is used to produce the [::] effect which means 'for every elements'.
@@ -303,7 +499,141 @@ def col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0):
         return x_padded[:, :, padding:-padding, padding:-padding]
 
 
+def __strided_col2im(x_col, x_shape, filter_h, filter_w, stride=1, padding=0, out=None):
+    """
+    Transform columns into images without scattering single elements.
+
+    Every kernel offset (i, j) contributes to a regular, strided grid of
+    positions of the padded image, so the overlapping patches are accumulated
+    with one vectorized slice-add per offset (filter_h * filter_w additions in
+    total) instead of np.add.at, which is unbuffered and works element by element.
+
+    Parameters
+    ----------
+    x_col : ndarray
+        Input passed as a 2d matrix (e.g.: computed by the im2col function)
+    x_shape : ndarray
+        Original input shape
+    filter_h : int
+        filter height
+    filter_w : int
+        filter width
+    padding: int, optional
+        The possible padding applied to the inputs
+    stride: int, optional
+        The stride applied for the convolution operation
+    out: ndarray, optional
+        Buffer with the shape of the padded inputs, where the images are accumulated
+
+    Returns
+    -------
+    image : ndarray
+        Array containing the inputs converted back to the original shape
+    """
+    # Get required variables from the input shape
+    n_images, n_channels, input_h, input_w = x_shape
+
+    # Add padding if needed.
+    input_h_padded, input_w_padded = input_h + 2 * padding, input_w + 2 * padding
+
+    # Output size
+    out_h = (input_h_padded - filter_h) // stride + 1
+    out_w = (input_w_padded - filter_w) // stride + 1
+
+    if out is None:
+        out = np.empty((n_images, n_channels, input_h_padded, input_w_padded), dtype=x_col.dtype)
+    x_padded = out
+
+    # Same layout produced by im2col: (C, filter_h, filter_w, N, out_h, out_w)
+    x_col_reshaped = x_col.reshape(n_channels, filter_h, filter_w, n_images, out_h, out_w)
+
+    # The images do not overlap: they are accumulated in chunks by the intra-op threads
+    def accumulate_images(start, stop):
+        images = x_padded[start:stop]
+        images.fill(0)
+        for i in range(filter_h):
+            for j in range(filter_w):
+                # (C, N, out_h, out_w) -> (N, C, out_h, out_w)
+                patch = x_col_reshaped[:, i, j, start:stop].transpose(1, 0, 2, 3)
+                images[:, :, i:i + stride * out_h:stride, j:j + stride * out_w:stride] += patch
+
+    parallel_for(accumulate_images, n_images, x_col.size)
+
+    # Remove padding from new image (if needed).
+    if padding == 0:
+        return x_padded
+    else:
+        return x_padded[:, :, padding:-padding, padding:-padding]
+
+
+def __zeros_buffer(shape, dtype, out=None):
+    """
+    Zero-fill the given buffer, or allocate a new one
+    """
+    if out is None:
+        return np.zeros(shape, dtype=dtype)
+
+    out.fill(0)
+    return out
+
+
 def __get_indices(input_shape, filter_h, filter_w, stride=1, pad=0):
+    """
+    Return the index matrices required by im2col and col2im.
+
+    The matrices only depend on the shape of a single input, so they are
+    computed once and then served from a bounded LRU cache (see
+    INDEX_CACHE_SIZE in config.py). The number of images is not part of
+    the key: the same plan is shared by every batch, including the last
+    (smaller) one.
+
+    Parameters
+    ----------
+    input_shape : ndarray
+        Shape of the input
+    filter_h : int
+        filter height
+    filter_w : int
+        filter width
+    pad: int, optional
+        The possible padding applied to the inputs
+    stride: int, optional
+        The stride applied for the convolution operation
+
+    Returns
+    -------
+    row_indices : ndarray
+        row positions WRT the original image (read-only)
+    column_indices : ndarray
+        column positions WRT the original image (read-only)
+    channel_matrix : ndarray
+        channel positions WRT the original image (read-only)
+    """
+    _, channels, image_h, image_w = input_shape
+    return __compute_indices(channels, image_h, image_w, filter_h, filter_w, stride, pad)
+
+
+def index_cache_info():
+    """
+    Statistics of the im2col/col2im index plan cache
+
+    Returns
+    -------
+    info : CacheInfo
+        Named tuple with the hits, misses, maxsize and currsize fields
+    """
+    return __compute_indices.cache_info()
+
+
+def clear_index_cache():
+    """
+    Drop every cached index plan and reset the hit/miss counters
+    """
+    __compute_indices.cache_clear()
+
+
+@functools.lru_cache(maxsize=INDEX_CACHE_SIZE)
+def __compute_indices(channels, image_h, image_w, filter_h, filter_w, stride=1, pad=0):
     """
     Create a matrix of indices that are required for converting
     an image (e.g.: with shape (3, 4, 4)) into a plain matrix
@@ -311,8 +641,12 @@ def __get_indices(input_shape, filter_h, filter_w, stride=1, pad=0):
 
     Parameters
     ----------
-    input_shape : ndarray
-        Shape of the input
+    channels : int
+        Number of channels of the input
+    image_h : int
+        Height of the input
+    image_w : int
+        Width of the input
     filter_h : int
         filter height
     filter_w : int
@@ -331,9 +665,6 @@ def __get_indices(input_shape, filter_h, filter_w, stride=1, pad=0):
     channel_matrix : ndarray
 
     """
-    # Input size
-    n_images, channels, image_h, image_w = input_shape
-
     # Output size
     out_h = int((image_h + 2 * pad - filter_h) / stride) + 1
     out_w = int((image_w + 2 * pad - filter_w) / stride) + 1
@@ -427,6 +758,11 @@ def __get_indices(input_shape, filter_h, filter_w, stride=1, pad=0):
     # This is used for reshaping to the final expected output.
     channel_matrix = np.repeat(np.arange(channels), filter_h * filter_w).reshape(-1, 1)
 
+    # The same arrays are returned to every caller: make sure nobody
+    # modifies them in place.
+    for indices in (row_indices, column_indices, channel_matrix):
+        indices.setflags(write=False)
+
     return row_indices, column_indices, channel_matrix
 
 
@@ -0,0 +1,321 @@
+from utils import *
+
+# ################################################################################
+# WINOGRAD F(2x2, 3x3) TRANSFORMATION MATRICES
+# ################################################################################
+# Each 4x4 input tile d and 3x3 filter g produce a 2x2 output tile:
+#   Y = A^T [(G g G^T) * (B^T d B)] A
+# where * is the element-wise product. This needs 16 multiplications per output
+# tile instead of the 36 of the direct (or im2col) convolution.
+# (https://arxiv.org/pdf/1509.09308.pdf)
+WINOGRAD_G = np.array([
+    [1.0, 0.0, 0.0],
+    [0.5, 0.5, 0.5],
+    [0.5, -0.5, 0.5],
+    [0.0, 0.0, 1.0]
+])
+
+# B^T and A^T only contain 0 and +-1, so they are applied with additions and
+# subtractions directly in the code below:
+#
+# B^T = [[1,  0, -1,  0],      A^T = [[1, 1,  1,  0],
+#        [0,  1,  1,  0],             [0, 1, -1, -1]]
+#        [0, -1,  1,  0],
+#        [0,  1,  0, -1]]
+
+
+def winograd_supported(kernel_shape, stride=1):
+    """
+    Check if a convolution can be computed with the Winograd F(2x2, 3x3) algorithm
+
+    Parameters
+    ----------
+    kernel_shape : tuple
+        Shape of the kernel of the convolutional layer
+    stride: int, optional
+        The stride applied for the convolution operation
+
+    Returns
+    -------
+    supported : bool
+        True if the kernel is 3x3 and the stride is 1
+    """
+    return kernel_shape[2] == 3 and kernel_shape[3] == 3 and stride == 1
+
+
+def winograd_convolve_2d(inputs, kernel, padding=0, return_transformed=False):
+    """
+    Compute the convolution with the Winograd F(2x2, 3x3) algorithm.
+    Only 3x3 kernels with stride 1 are supported.
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+    padding: int, optional
+        The possible padding applied to the inputs
+    return_transformed: bool, optional
+        If True, the transformed input tiles are returned as well,
+        so that they can be reused by winograd_convolution_backprop
+
+    Returns
+    -------
+    conv_result : ndarray
+        The result of the computed convolution
+    input_tiles : ndarray
+        The transformed input tiles (only if return_transformed is True)
+    """
+    n_images = inputs.shape[0]
+    out_channels, in_channels, _, _ = kernel.shape
+
+    out_h, out_w, tiles_h, tiles_w = __tiles_size(inputs.shape, padding)
+
+    # Transformed inputs with shape (16, C, N * tiles)
+    input_tiles = __transform_inputs(inputs, padding, tiles_h, tiles_w)
+
+    # Transformed kernel with shape (16, F, C)
+    kernel_tiles = __transform_kernel(kernel)
+
+    # One matrix multiplication for each one of the 16 positions of the tiles.
+    # Every multiplication sums over the input channels.
+    output_tiles = np.matmul(kernel_tiles, input_tiles)
+    output_tiles = output_tiles.reshape(4, 4, out_channels, n_images, tiles_h, tiles_w)
+
+    # Back to the spatial domain (A^T M A), first along the rows of the tiles...
+    half_tiles = np.empty((2, 4, out_channels, n_images, tiles_h, tiles_w), dtype=output_tiles.dtype)
+    __apply_at(output_tiles, half_tiles)
+
+    # ...then along the columns, writing the element (i, j) of every 2x2 tile
+    # straight to its position in the result
+    conv_result = np.empty((n_images, out_channels, 2 * tiles_h, 2 * tiles_w), dtype=output_tiles.dtype)
+    for i in range(2):
+        __apply_at(half_tiles[i], [conv_result[:, :, i::2, j::2].transpose(1, 0, 2, 3) for j in range(2)])
+
+    # Remove the last row/column if the output size is odd
+    conv_result = conv_result[:, :, :out_h, :out_w]
+
+    if return_transformed:
+        return conv_result, input_tiles
+    return conv_result
+
+
+def winograd_convolution_backprop(inputs, kernel, gradient_values, padding=0, input_tiles=None):
+    """
+    Compute the backpropagation through a convolutional layer
+    computed with the Winograd F(2x2, 3x3) algorithm.
+
+    The gradients are propagated through the same linear transformations
+    used in the forward pass (in reverse order and transposed), so both
+    the derivatives are computed in the Winograd domain.
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+    gradient_values : ndarray
+        The gradients that are flowing back from following layers
+        through the backpropagation algorithm
+    padding: int, optional
+        The possible padding applied to the inputs
+    input_tiles: ndarray, optional
+        The transformed input tiles, as returned by winograd_convolve_2d.
+        If not given, they are computed again from the inputs
+
+    Returns
+    -------
+    dW : ndarray
+        The derivative computed WRT the weights
+    dX : ndarray
+        The derivative computed WRT the inputs
+    """
+    n_images, _, input_h, input_w = inputs.shape
+    out_channels, in_channels, _, _ = kernel.shape
+
+    out_h, out_w, tiles_h, tiles_w = __tiles_size(inputs.shape, padding)
+
+    if input_tiles is None:
+        input_tiles = __transform_inputs(inputs, padding, tiles_h, tiles_w)
+
+    # Pad the gradients to a whole number of 2x2 tiles
+    if out_h % 2 or out_w % 2:
+        gradient_values = np.pad(gradient_values,
+                                 ((0, 0), (0, 0), (0, 2 * tiles_h - out_h), (0, 2 * tiles_w - out_w)),
+                                 mode='constant')
+
+    # Transpose of the output transformation (A dY A^T), first along the columns...
+    dtype = gradient_values.dtype
+    half_tiles = np.empty((2, 4, out_channels, n_images, tiles_h, tiles_w), dtype=dtype)
+    for i in range(2):
+        __apply_a([gradient_values[:, :, i::2, j::2].transpose(1, 0, 2, 3) for j in range(2)], half_tiles[i])
+
+    # ...then along the rows -> (16, F, N * tiles)
+    gradient_tiles = np.empty((4, 4, out_channels, n_images, tiles_h, tiles_w), dtype=dtype)
+    __apply_a(half_tiles, gradient_tiles)
+    gradient_tiles = gradient_tiles.reshape(16, out_channels, -1)
+
+    # Gradients WRT the transformed kernel (16, F, C) and then WRT the kernel (G^T dU G)
+    kernel_tiles_grad = np.matmul(gradient_tiles, input_tiles.transpose(0, 2, 1))
+    kernel_tiles_grad = kernel_tiles_grad.reshape(4, 4, out_channels, in_channels).transpose(2, 3, 0, 1)
+    g = WINOGRAD_G.astype(kernel.dtype)
+    dW = g.T @ kernel_tiles_grad @ g
+
+    # Gradients WRT the transformed inputs (16, C, N * tiles)
+    kernel_tiles = __transform_kernel(kernel)
+    input_tiles_grad = np.matmul(kernel_tiles.transpose(0, 2, 1), gradient_tiles)
+    input_tiles_grad = input_tiles_grad.reshape(4, 4, in_channels, n_images, tiles_h, tiles_w)
+
+    # Transpose of the input transformation (B dV B^T), first along the rows...
+    half_tiles = np.empty(input_tiles_grad.shape, dtype=input_tiles_grad.dtype)
+    __apply_b(input_tiles_grad, half_tiles)
+
+    # ...then along the columns. The 4x4 input tiles overlap by 2 rows/columns, so the
+    # element (i, j) of all the tiles is accumulated with one strided slice-add.
+    dx_padded = np.zeros((n_images, in_channels, 2 * tiles_h + 2, 2 * tiles_w + 2), dtype=input_tiles_grad.dtype)
+    row_grad = np.empty(half_tiles.shape[1:], dtype=half_tiles.dtype)
+    for i in range(4):
+        __apply_b(half_tiles[i], row_grad)
+        for j in range(4):
+            dx_padded[:, :, i:i + 2 * tiles_h:2, j:j + 2 * tiles_w:2] += row_grad[j].transpose(1, 0, 2, 3)
+
+    # Remove the padding
+    dX = dx_padded[:, :, padding:padding + input_h, padding:padding + input_w]
+
+    return dW, dX
+
+
+def __tiles_size(input_shape, padding):
+    """
+    Compute the output size and the number of 2x2 output tiles
+
+    Parameters
+    ----------
+    input_shape : tuple
+        Shape of the inputs
+    padding: int
+        The padding applied to the inputs
+
+    Returns
+    -------
+    out_h, out_w : int
+        The size of the convolution result
+    tiles_h, tiles_w : int
+        The number of tiles along the height and the width
+    """
+    out_h = input_shape[2] + 2 * padding - 2
+    out_w = input_shape[3] + 2 * padding - 2
+
+    return out_h, out_w, (out_h + 1) // 2, (out_w + 1) // 2
+
+
+def __transform_inputs(inputs, padding, tiles_h, tiles_w):
+    """
+    Split the inputs in overlapping 4x4 tiles (stride 2) and apply B^T d B
+
+    Parameters
+    ----------
+    inputs : ndarray
+        Inputs of the convolutional layer
+    padding: int
+        The padding applied to the inputs
+    tiles_h, tiles_w : int
+        The number of tiles along the height and the width
+
+    Returns
+    -------
+    input_tiles : ndarray
+        The transformed tiles with shape (16, C, N * tiles_h * tiles_w)
+    """
+    n_images, n_channels, input_h, input_w = inputs.shape
+
+    # Pad so that the last tile is complete (when the output size is odd,
+    # one more row/column of zeros is needed)
+    extra_h = 2 * tiles_h + 2 - (input_h + 2 * padding)
+    extra_w = 2 * tiles_w + 2 - (input_w + 2 * padding)
+    if padding > 0 or extra_h > 0 or extra_w > 0:
+        inputs = np.pad(inputs, ((0, 0), (0, 0), (padding, padding + extra_h), (padding, padding + extra_w)),
+                        mode='constant')
+
+    # The row i of all the tiles is inputs[:, :, i::2] (e.g.: the tiles start every 2 rows).
+    # Transform along the rows working on whole image rows...
+    row_tiles = np.empty((4, n_images, n_channels, tiles_h, inputs.shape[3]), dtype=inputs.dtype)
+    __apply_bt([inputs[:, :, i:i + 2 * tiles_h:2] for i in range(4)], row_tiles)
+
+    # ...then along the columns, writing the result in the (4, 4, C, N, tiles_h, tiles_w)
+    # layout required by the matrix multiplications
+    input_tiles = np.empty((4, 4, n_channels, n_images, tiles_h, tiles_w), dtype=inputs.dtype)
+    for i in range(4):
+        __apply_bt([row_tiles[i][..., j:j + 2 * tiles_w:2] for j in range(4)],
+                   [input_tiles[i, j].transpose(1, 0, 2, 3) for j in range(4)])
+
+    return input_tiles.reshape(16, n_channels, -1)
+
+
+def __transform_kernel(kernel):
+    """
+    Apply G g G^T to each 3x3 filter
+
+    Parameters
+    ----------
+    kernel : ndarray
+        Kernel containing the weights of the convolutional layer
+
+    Returns
+    -------
+    kernel_tiles : ndarray
+        The transformed kernel with shape (16, F, C)
+    """
+    out_channels, in_channels, _, _ = kernel.shape
+    g = WINOGRAD_G.astype(kernel.dtype)
+
+    kernel_tiles = g @ kernel @ g.T
+
+    return kernel_tiles.transpose(2, 3, 0, 1).reshape(16, out_channels, in_channels)
+
+
+# The following functions apply the transformation matrices to 4 (or 2) arrays
+# x[0], x[1], ... holding the same element of all the tiles, and write the
+# results to out[0], out[1], ...
+def __apply_bt(x, out):
+    """
+    Multiply by B^T (4 inputs, 4 outputs)
+    """
+    np.subtract(x[0], x[2], out=out[0])
+    np.add(x[1], x[2], out=out[1])
+    np.subtract(x[2], x[1], out=out[2])
+    np.subtract(x[1], x[3], out=out[3])
+
+
+def __apply_b(x, out):
+    """
+    Multiply by B (4 inputs, 4 outputs)
+    """
+    out[0][...] = x[0]
+    np.subtract(x[1], x[2], out=out[1])
+    out[1] += x[3]
+    np.add(x[1], x[2], out=out[2])
+    out[2] -= x[0]
+    np.negative(x[3], out=out[3])
+
+
+def __apply_at(x, out):
+    """
+    Multiply by A^T (4 inputs, 2 outputs)
+    """
+    np.add(x[0], x[1], out=out[0])
+    out[0] += x[2]
+    np.subtract(x[1], x[2], out=out[1])
+    out[1] -= x[3]
+
+
+def __apply_a(x, out):
+    """
+    Multiply by A (2 inputs, 4 outputs)
+    """
+    out[0][...] = x[0]
+    np.add(x[0], x[1], out=out[1])
+    np.subtract(x[0], x[1], out=out[2])
+    np.negative(x[1], out=out[3])
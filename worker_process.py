@@ -0,0 +1,39 @@
+import importlib
+
+import config
+
+
+def config_settings():
+    """
+    The current values of the settings of config.py
+
+    Returns
+    -------
+    settings : dict
+        Value of each upper case name of config.py
+    """
+    return {name: getattr(config, name) for name in dir(config) if name.isupper()}
+
+
+def run_worker(settings, target, connection, *arguments):
+    """
+    Entry point of the spawned worker processes (see data_parallel._start_workers).
+
+    A spawned process imports config.py again, so the settings changed at runtime
+    by the parent (e.g.: by the benchmarks) are applied before the modules of the
+    model import them. This module must not import them itself.
+
+    Parameters
+    ----------
+    settings : dict
+        The settings of the parent (see config_settings)
+    target : tuple
+        Module and name of the function run by the worker, called as function(connection, *arguments)
+    connection : Connection
+        The pipe to the parent
+    """
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+    module_name, function_name = target
+    getattr(importlib.import_module(module_name), function_name)(connection, *arguments)
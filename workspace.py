@@ -0,0 +1,166 @@
+import numpy as np
+
+
+class Workspace:
+    """
+    Arena of reusable buffers for the temporaries of a training step.
+
+    A buffer is identified by (name, shape, dtype): the first request allocates
+    it (zero-filled), the following ones return the same memory. After the first
+    batch of a given shape, a training step does not allocate its temporaries
+    anymore, they are simply overwritten.
+
+    The content of a buffer is only valid until the next request with the same
+    name, so every operation must use its own names. scope() creates a view of
+    the arena where all the names get a prefix (e.g.: 'conv1/cols'), so the same
+    operation can be used by different layers.
+    """
+
+    def __init__(self, prefix='', buffers=None, stats=None):
+        self.prefix = prefix
+        self.__buffers = {} if buffers is None else buffers
+        self.__stats = {'requests': 0, 'allocations': 0} if stats is None else stats
+
+    def get(self, name, shape, dtype):
+        """
+        Get a buffer, allocating it only the first time
+
+        Parameters
+        ----------
+        name : string
+            Name of the buffer (the prefix of the scope is added)
+        shape : tuple
+            Shape of the buffer
+        dtype : dtype
+            Type of the buffer
+
+        Returns
+        -------
+        buffer : ndarray
+            A contiguous array, zero-filled when allocated for the first time
+        """
+        key = (self.prefix + name, tuple(shape), np.dtype(dtype))
+        self.__stats['requests'] += 1
+
+        buffer = self.__buffers.get(key)
+        if buffer is None:
+            buffer = np.zeros(key[1], dtype=key[2])
+            self.__buffers[key] = buffer
+            self.__stats['allocations'] += 1
+
+        return buffer
+
+    def scope(self, name):
+        """
+        Create a view of the arena where all the buffer names are prefixed by name
+
+        Parameters
+        ----------
+        name : string
+            Name of the scope (e.g.: the name of the layer)
+
+        Returns
+        -------
+        workspace : Workspace
+            Workspace sharing the buffers and the statistics of this one
+        """
+        return Workspace(f'{self.prefix}{name}/', self.__buffers, self.__stats)
+
+    def clear(self):
+        """
+        Release all the buffers (e.g.: when the batch shapes are not used anymore)
+        """
+        self.__buffers.clear()
+
+    @property
+    def n_allocations(self):
+        """
+        Number of buffers allocated since the creation of the arena
+        """
+        return self.__stats['allocations']
+
+    @property
+    def n_requests(self):
+        """
+        Number of buffers requested since the creation of the arena
+        """
+        return self.__stats['requests']
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the arena (in bytes)
+        """
+        return sum(buffer.nbytes for buffer in self.__buffers.values())
+
+
+def get_buffer(workspace, name, shape, dtype):
+    """
+    Get a buffer from a workspace, if any
+
+    Parameters
+    ----------
+    workspace : Workspace
+        The arena of buffers, or None
+    name : string
+        Name of the buffer
+    shape : tuple
+        Shape of the buffer
+    dtype : dtype
+        Type of the buffer
+
+    Returns
+    -------
+    buffer : ndarray
+        The buffer, or None without a workspace.
+        None can be passed as the out= parameter of any operation, which then allocates a new array
+    """
+    if workspace is None:
+        return None
+    return workspace.get(name, shape, dtype)
+
+
+def get_array(workspace, name, shape, dtype):
+    """
+    Get a buffer from a workspace, or allocate a new (uninitialized) array without a workspace
+
+    Parameters
+    ----------
+    workspace : Workspace
+        The arena of buffers, or None
+    name : string
+        Name of the buffer
+    shape : tuple
+        Shape of the buffer
+    dtype : dtype
+        Type of the buffer
+
+    Returns
+    -------
+    buffer : ndarray
+        The buffer
+    """
+    if workspace is None:
+        return np.empty(shape, dtype=dtype)
+    return workspace.get(name, shape, dtype)
+
+
+def get_scope(workspace, name):
+    """
+    Get the scope of a workspace, if any (see Workspace.scope)
+
+    Parameters
+    ----------
+    workspace : Workspace
+        The arena of buffers, or None
+    name : string
+        Name of the scope
+
+    Returns
+    -------
+    workspace : Workspace
+        The scoped workspace, or None without a workspace
+    """
+    if workspace is None:
+        return None
+    return workspace.scope(name)